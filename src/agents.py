@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Sequence, Tuple
+
+from langchain_core.prompts import ChatPromptTemplate
+from langgraph.prebuilt import create_react_agent
+
+from .config import get_llm, llm_model_name
+
+
+"""
+Реестр ReAct-агентов
+create_react_agent компилирует подграф и заново привязывает схемы инструментов, поэтому
+каждый вариант агента (узел, температура, набор инструментов) собираем один раз на процесс.
+Скомпилированный граф не хранит состояние между вызовами, его можно вызывать из разных потоков.
+"""
+
+AgentKey = Tuple[str, float, Tuple[str, ...]]
+
+_AGENTS: Dict[AgentKey, Any] = {}
+_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0}
+# Какая модель стоит за агентом узла (имя узла -> модель)
+_MODELS: Dict[str, str] = {}
+
+
+def get_react_agent(name: str, system_prompt: str, tools: Sequence[Any], temperature: float = 0.0):
+    """
+    Возвращает скомпилированного ReAct-агента из кэша или собирает нового
+
+    - name: имя узла (coding_agent, daily_agent, ...), по нему однозначно определяется system_prompt
+    - system_prompt: системный промпт агента (используется только при первой сборке)
+    - tools: набор инструментов
+    - temperature: температура модели (сама модель выбирается по имени узла, см. config.NODE_MODELS)
+    """
+    key: AgentKey = (name, float(temperature), tuple(t.name for t in tools))
+    # Поиск, сборка и счетчики — под одной блокировкой: иначе счетчики теряют инкременты при параллельных ходах
+    with _LOCK:
+        agent = _AGENTS.get(key)
+        if agent is None:
+            prompt = ChatPromptTemplate.from_messages([
+                ("system", system_prompt),
+                ("placeholder", "{messages}"),
+            ])
+            llm = get_llm(temperature=temperature, node=name)
+            # checkpointer=False: промежуточные шаги агента не пишутся в checkpointer внешнего графа
+            agent = create_react_agent(model=llm, tools=list(tools), prompt=prompt, checkpointer=False)
+            _AGENTS[key] = agent
+            _MODELS[name] = llm_model_name(llm)
+            _STATS["misses"] += 1
+        else:
+            _STATS["hits"] += 1
+    return agent
+
+
+# Сбрасываем кэш (например, после подмены модели через config.set_llm_factory)
+def clear_agent_cache() -> None:
+    with _LOCK:
+        _AGENTS.clear()
+        _MODELS.clear()
+        _STATS["hits"] = 0
+        _STATS["misses"] = 0
+
+
+def agent_model_name(name: str) -> str:
+    return _MODELS.get(name, "")
+
+
+def agent_cache_stats() -> Dict[str, int]:
+    with _LOCK:
+        return {"size": len(_AGENTS), **_STATS}
@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .config import ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL
+
+
+"""
+Кэш ответов перед графом
+Повторные и перефразированные вопросы не проходят заново router -> planner -> gather_tools -> agent -> reviewer.
+- запрос нормализуется и превращается в вектор символьных 3-грамм;
+- кандидаты ищутся по инвертированному индексу n-грамм, затем top-k по косинусной близости;
+- ответ отдается, если близость >= порога и запросы совместимы: числа, операторы и отрицания совпадают
+  точно, а каждое несовпавшее слово — словоформа слова другого запроса ("1 до 10" != "1 до 100",
+  "старше" != "младше");
+- записи привязаны к контексту (scope): без истории диалога — общие для всех сессий, с историей —
+  только для той же сессии с той же историей (уточняющий вопрос зависит от предыдущих реплик);
+- TTL зависит от intent (для daily с датами/сроками кэш не используется), вытеснение по LRU;
+- метрики: hits/misses/hit_rate/evictions/expired
+"""
+
+NGRAM = 3
+
+# Признаки "ответ зависит от текущей даты" (для daily такой ответ не кэшируем)
+_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}|\d{1,2}[./]\d{1,2}|сегодня|завтра|вчера|дедлайн|срок|через|до\s+\d|дней|недел", re.I)
+
+
+def normalize_query(query: str) -> str:
+    q = (query or "").lower().replace("ё", "е")
+    q = re.sub(r"[^\w\s]", " ", q)
+    return re.sub(r"\s+", " ", q).strip()
+
+
+def _ngrams(text: str) -> Counter:
+    padded = f" {text} "
+    return Counter(padded[i:i + NGRAM] for i in range(max(1, len(padded) - NGRAM + 1)))
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    dot = sum(c * b.get(g, 0) for g, c in a.items())
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return dot / norm if norm else 0.0
+
+
+# Числа и операторы (по порядку) и отрицания: отличие в них меняет смысл вопроса при почти том же тексте
+# (оператор между буквами — дефис в слове: "planner-executor")
+_NUM_OP_RE = re.compile(r"\d+(?:[.,]\d+)?|(?<![^\W\d_])[-+*/^%=<>×÷](?![^\W\d_])")
+NEGATIONS = frozenset({"не", "нет", "ни", "без", "кроме", "нельзя", "no", "not", "never", "without", "except"})
+# Слова короче не сравниваем (предлоги, союзы), кроме отрицаний
+MIN_WORD = 3
+# Минимальная близость словоформ одного слова (косинус по 3-граммам слова)
+WORD_SIMILARITY = 0.5
+
+
+def _signature(query: str, words: Set[str]) -> Tuple[Tuple[str, ...], frozenset]:
+    return tuple(_NUM_OP_RE.findall((query or "").lower())), frozenset(words & NEGATIONS)
+
+
+def _content_words(norm: str) -> Set[str]:
+    return {w for w in norm.split() if len(w) >= MIN_WORD and not w.isdigit()}
+
+
+def _words_aligned(a: Set[str], b: Set[str]) -> bool:
+    # Слово без точной пары должно быть словоформой какого-то слова другого запроса
+    for word in a ^ b:
+        other = b if word in a else a
+        grams = _ngrams(word)
+        if not any(_cosine(grams, _ngrams(w)) >= WORD_SIMILARITY for w in other):
+            return False
+    return True
+
+
+def history_scope(thread_id: str, history: Optional[List[Dict[str, Any]]] = None, history_summary: str = "") -> str:
+    """
+    Контекст записи кэша: "" — ход без истории диалога (ответ не зависит от сессии),
+    иначе thread_id + хэш истории и резюме
+    """
+    if not history and not history_summary:
+        return ""
+    payload = json.dumps([[(h.get("role"), h.get("content")) for h in history or []], history_summary or ""],
+                         ensure_ascii=False)
+    return f"{thread_id}:{hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]}"
+
+
+class AnswerCache:
+    """
+    - threshold: минимальная косинусная близость запросов
+    - max_entries: размер LRU
+    - ttl_by_intent: TTL в секундах по intent (None — intent не кэшируется), ключ "default" для остальных
+    """
+
+    def __init__(
+            self,
+            threshold: float = ANSWER_CACHE_THRESHOLD,
+            max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+            ttl_by_intent: Optional[Dict[str, Optional[float]]] = None,
+            top_k: int = 5,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_by_intent = dict(ANSWER_CACHE_TTL if ttl_by_intent is None else ttl_by_intent)
+        self.top_k = top_k
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._index: Dict[str, Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "stores": 0, "skipped": 0, "evictions": 0, "expired": 0}
+
+    def _ttl(self, intent: Optional[str], query: str) -> Optional[float]:
+        if intent == "daily" and _DATE_RE.search(query or ""):
+            return None
+        return self.ttl_by_intent.get(intent or "default", self.ttl_by_intent.get("default"))
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for g in entry["vector"]:
+            ids = self._index.get(g)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._index[g]
+
+    def _candidates(self, vector: Counter) -> List[Tuple[int, int]]:
+        # Сколько общих n-грамм у запроса с каждой записью
+        overlap: Counter = Counter()
+        for g in vector:
+            for entry_id in self._index.get(g, ()):
+                overlap[entry_id] += 1
+        return overlap.most_common(self.top_k * 4)
+
+    def lookup(self, query: str, scope: str = "") -> Optional[Dict[str, Any]]:
+        """
+        Ищет близкий совместимый запрос в том же scope.
+        Возвращает запись {"final_answer", "intent", "metadata", "similarity", "source_query"} или None
+        """
+        norm = normalize_query(query)
+        vector = _ngrams(norm)
+        words = _content_words(norm) | (set(norm.split()) & NEGATIONS)
+        signature = _signature(query, words)
+        qnorm = math.sqrt(sum(v * v for v in vector.values()))
+        now = time.time()
+        with self._lock:
+            self.stats["lookups"] += 1
+            best: Optional[Tuple[float, int]] = None
+            for entry_id, _ in self._candidates(vector):
+                entry = self._entries[entry_id]
+                if entry["expires_at"] <= now:
+                    self._remove(entry_id)
+                    self.stats["expired"] += 1
+                    continue
+                if entry["scope"] != scope or entry["signature"] != signature:
+                    continue
+                dot = sum(c * entry["vector"].get(g, 0) for g, c in vector.items())
+                sim = dot / (qnorm * entry["norm"]) if qnorm and entry["norm"] else 0.0
+                if sim >= self.threshold and (best is None or sim > best[0]) and _words_aligned(words, entry["words"]):
+                    best = (sim, entry_id)
+
+            if best is None or best[0] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+
+            sim, entry_id = best
+            self._entries.move_to_end(entry_id)
+            entry = self._entries[entry_id]
+            self.stats["hits"] += 1
+            return {
+                "final_answer": entry["final_answer"],
+                "intent": entry["intent"],
+                "metadata": dict(entry["metadata"]),
+                "similarity": round(sim, 4),
+                "source_query": entry["query"],
+            }
+
+    def store(self, query: str, final_answer: str, intent: Optional[str], metadata: Optional[Dict[str, Any]] = None,
+              scope: str = "") -> bool:
+        ttl = self._ttl(intent, query)
+        if not ttl or not (final_answer or "").strip():
+            with self._lock:
+                self.stats["skipped"] += 1
+            return False
+
+        norm = normalize_query(query)
+        vector = _ngrams(norm)
+        words = _content_words(norm) | (set(norm.split()) & NEGATIONS)
+        entry = {
+            "query": query,
+            "scope": scope,
+            "words": words,
+            "signature": _signature(query, words),
+            "vector": vector,
+            "norm": math.sqrt(sum(v * v for v in vector.values())),
+            "final_answer": final_answer,
+            "intent": intent,
+            "metadata": dict(metadata or {}, cached_at=time.time()),
+            "expires_at": time.time() + ttl,
+        }
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            for g in vector:
+                self._index.setdefault(g, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+            self.stats["stores"] += 1
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["lookups"]
+            return {
+                **self.stats,
+                "size": len(self._entries),
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Общий кэш процесса (run_system и HTTP-сервис)
+ANSWER_CACHE = AnswerCache()
+
+
+# Финальный state графа -> запись кэша (scope — контекст, посчитанный до хода, как при lookup)
+def remember(out: Dict[str, Any], cache: Optional[AnswerCache] = None, scope: str = "") -> bool:
+    return (cache or ANSWER_CACHE).store(
+        out.get("query", ""),
+        out.get("final_answer", ""),
+        out.get("intent"),
+        metadata={
+            "activated_nodes": list(out.get("activated_nodes", [])),
+            "handoff_log": list(out.get("handoff_log", [])),
+            "memory_summary": out.get("memory_summary", ""),
+            "tools_used": len(out.get("tool_calls", [])),
+        },
+        scope=scope,
+    )
+
+
+# Попадание в кэш — тоже ход диалога: вопрос и ответ дописываются в историю сессии (со сверткой, как в finalize)
+def hit_session_update(session: Dict[str, Any], thread_id: str, query: str, answer: str) -> Dict[str, Any]:
+    from .summary import fold_history
+    from .utils import add_history
+
+    state = {
+        "thread_id": thread_id,
+        "history": list(session.get("history") or []),
+        "history_summary": session.get("history_summary", ""),
+    }
+    add_history(state, "user", query)
+    add_history(state, "assistant", answer)
+    fold_history(state)
+    return {"history": state["history"], "history_summary": state["history_summary"]}
+
+
+# Попадание в кэш -> state того же вида, что возвращает граф
+def state_from_hit(query: str, thread_id: str, max_rounds: int, hit: Dict[str, Any]) -> Dict[str, Any]:
+    from .state import init_state
+
+    out = dict(init_state(query, thread_id=thread_id, max_rounds=max_rounds))
+    out["intent"] = hit["intent"]
+    out["final_answer"] = hit["final_answer"]
+    out["partial"] = hit["final_answer"]
+    out["memory_summary"] = hit["metadata"].get("memory_summary", "")
+    out["activated_nodes"] = ["answer_cache"]
+    out["handoff_log"] = [f"[handoff] answer_cache -> finalize | similarity={hit['similarity']} к «{hit['source_query']}»"]
+    out["answer_cache"] = hit
+    out.update(hit_session_update(out, thread_id, query, hit["final_answer"]))
+    return out
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+"""
+Бенчмарк накладных расходов фреймворка (без реальной LLM)
+Все узлы работают на ScriptedChatModel с нулевой задержкой, поэтому измеряется только
+Python-часть: сборка промптов, парсинг, LangGraph, инструменты, чекпоинты.
+
+Запуск:
+    python -m src.bench                    # сравнить с baseline, код выхода 1 при регрессии
+    python -m src.bench --update-baseline  # перезаписать baseline
+"""
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "baseline.json")
+
+# Заметки и модель подменяем ДО импорта модулей системы (NOTES_PATH читается при импорте config)
+os.environ.setdefault("MAS_NOTES_PATH", os.path.join(tempfile.mkdtemp(prefix="mas_bench_"), "notes.json"))
+os.environ["MAS_FAKE_LLM"] = "1"
+
+
+# Среднее время одного вызова в мс (медиана по повторам)
+def _measure(fn: Callable[[], Any], repeat: int, number: int) -> float:
+    samples: List[float] = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - t0) / number * 1000)
+    return statistics.median(samples)
+
+
+# То же, но для функций, которые портят входные данные (узлы графа мутируют state)
+def _measure_fresh(make_input: Callable[[], Any], fn: Callable[[Any], Any], repeat: int, number: int) -> float:
+    samples: List[float] = []
+    for _ in range(repeat):
+        inputs = [make_input() for _ in range(number)]
+        t0 = time.perf_counter()
+        for x in inputs:
+            fn(x)
+        samples.append((time.perf_counter() - t0) / number * 1000)
+    return statistics.median(samples)
+
+
+def _synthetic_notes(n: int) -> List[Dict[str, Any]]:
+    topics = ["langgraph", "router", "память", "штрудель", "дедлайн", "python", "обзор", "reviewer"]
+    return [
+        {"ts": "2025-01-01T00:00:00", "text": f"Заметка {i}: {topics[i % len(topics)]} и {topics[(i * 3) % len(topics)]}",
+         "tags": [topics[i % len(topics)]]}
+        for i in range(n)
+    ]
+
+
+def bench_helpers(repeat: int) -> Dict[str, float]:
+    from .calc import evaluate_batch
+    from .memory_store import simple_retrieve_notes
+    from .utils import _extract_json
+
+    text = "Вот ответ модели:\n```json\n" + json.dumps(
+        {"need_more": False, "focus": "", "improved_answer": "x" * 2000}) + "\n```\nСпасибо!"
+    notes = _synthetic_notes(1000)
+    exprs = [f"({i} + 1) * 2.5 / 3" for i in range(1000)]
+    return {
+        "helper.calc_batch[1000]": _measure(lambda: evaluate_batch(exprs), repeat, 5),
+        "helper._extract_json": _measure(lambda: _extract_json(text), repeat, 200),
+        "helper.simple_retrieve_notes[1000]": _measure(
+            lambda: simple_retrieve_notes(notes, "как в langgraph сделать router с памятью", k=5), repeat, 20),
+    }
+
+
+def _node_state(intent: str):
+    from .state import init_state
+
+    s = init_state("Напиши код на python для вывода чисел", thread_id="bench")
+    s["intent"] = intent
+    s["plan"] = ["Уточнить цель", "Собрать контекст", "Сформировать ответ"]
+    s["memory_hits"] = _synthetic_notes(4)
+    s["tool_context"] = [{"ts": "t", "tool_message": "[]"} for _ in range(6)]
+    s["partial"] = "```python\nprint(1)\n```"
+    return s
+
+
+# Ревьюер через LLM: правила отключены, иначе на черновике coding срабатывает быстрый путь без модели
+def _reviewer_llm(state):
+    from . import nodes
+    from .retry import decision_scope
+
+    gates, nodes.REVIEW_GATES = nodes.REVIEW_GATES, "0"
+    try:
+        with decision_scope(state["thread_id"]):
+            return nodes.reviewer_node(state)
+    finally:
+        nodes.REVIEW_GATES = gates
+
+
+def bench_nodes(repeat: int) -> Dict[str, float]:
+    from . import nodes
+
+    cases = [
+        ("router", nodes.router_node, "coding"),
+        ("planner", nodes.planner_node, "coding"),
+        ("gather_tools", nodes.gather_tools_node, "daily"),
+        ("conceptual_agent", nodes.conceptual_agent_node, "conceptual"),
+        ("architecture_agent", nodes.architecture_agent_node, "architecture"),
+        ("coding_agent", nodes.coding_agent_node, "coding"),
+        ("daily_agent", nodes.daily_agent_node, "daily"),
+        ("literature_agent", nodes.literature_agent_node, "literature"),
+        ("reviewer", nodes.reviewer_node, "coding"),
+        ("reviewer_llm", _reviewer_llm, "coding"),
+        ("finalize", nodes.finalize_node, "coding"),
+    ]
+    return {
+        f"node.{name}": _measure_fresh(lambda intent=intent: _node_state(intent), fn, repeat, 5)
+        for name, fn, intent in cases
+    }
+
+
+def bench_react_iteration(repeat: int) -> Dict[str, float]:
+    from langchain_core.messages import HumanMessage
+    from langgraph.prebuilt import create_react_agent
+
+    from .fake_llm import ScriptedChatModel
+    from .tools import TOOLS_DAILY
+
+    def run(k: int):
+        agent = create_react_agent(model=ScriptedChatModel(max_tool_calls=k), tools=TOOLS_DAILY)
+        return lambda: agent.invoke({"messages": [HumanMessage(content="QUERY: сколько дней до дедлайна")]},
+                                    config={"recursion_limit": 40})
+
+    t1 = _measure(run(1), repeat, 5)
+    t4 = _measure(run(4), repeat, 5)
+    return {"react.iteration": max(0.0, (t4 - t1) / 3)}
+
+
+# Сборка ReAct-агента с нуля против выдачи готового агента из реестра
+def bench_agent_registry(repeat: int) -> Dict[str, float]:
+    from langchain_core.prompts import ChatPromptTemplate
+    from langgraph.prebuilt import create_react_agent
+
+    from .agents import get_react_agent
+    from .config import get_llm
+    from .nodes import DAILY_SYSTEM
+    from .tools import TOOLS_DAILY
+
+    def build():
+        prompt = ChatPromptTemplate.from_messages([("system", DAILY_SYSTEM), ("placeholder", "{messages}")])
+        return create_react_agent(model=get_llm(temperature=0.0), tools=TOOLS_DAILY, prompt=prompt)
+
+    get_react_agent("daily_agent", DAILY_SYSTEM, TOOLS_DAILY, temperature=0.0)
+    return {
+        "agent.build": _measure(build, repeat, 5),
+        "agent.registry_lookup": _measure(
+            lambda: get_react_agent("daily_agent", DAILY_SYSTEM, TOOLS_DAILY, temperature=0.0), repeat, 200),
+    }
+
+
+def bench_run_system(repeat: int) -> Dict[str, float]:
+    from .experiments import run_system
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_system("Напиши код на python для вывода чисел", thread_id="bench", use_cache=False)
+
+    return {"run_system": _measure(run, repeat, 1)}
+
+
+def run_benchmarks(repeat: int = 5) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    for bench in (bench_helpers, bench_nodes, bench_react_iteration, bench_agent_registry, bench_run_system):
+        results.update(bench(repeat))
+    return results
+
+
+# Сравниваем с baseline: регрессия, если стало медленнее в tolerance раз (и хотя бы на min_delta_ms)
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float,
+            min_delta_ms: float = 0.05) -> List[str]:
+    regressions = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if value > base * tolerance and value - base > min_delta_ms:
+            regressions.append(f"{name}: {value:.3f} ms (baseline {base:.3f} ms, x{value / max(base, 1e-9):.2f})")
+    return regressions
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Бенчмарк накладных расходов графа на фейковой модели")
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE)
+    ap.add_argument("--update-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=1.5, help="допустимое замедление относительно baseline")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args(argv)
+
+    results = run_benchmarks(repeat=args.repeat)
+    for name, value in results.items():
+        print(f"{name:<40} {value:10.3f} ms")
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({k: round(v, 4) for k, v in results.items()}, f, ensure_ascii=False, indent=2)
+        print(f"baseline сохранен: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("baseline не найден, запустите с --update-baseline")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for r in regressions:
+        print("REGRESSION", r)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
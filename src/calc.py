@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import ast
+import functools
+import math
+import operator
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для векторного пути
+    np = None
+
+
+"""
+Движок для инструментов calc / calc_batch
+Выражение разбирается через ast (без eval), проверяется по белому списку и компилируется
+в дерево замыканий. Скомпилированные выражения кэшируются, поэтому повторные вычисления дешевые.
+
+Батч: список выражений, можно давать имена промежуточным результатам ("a = 2*3", "a + 1").
+Большие батчи однотипных выражений (одинаковая структура, разные числа) считаются
+одним проходом по массивам NumPy. Строки, где число или промежуточный результат выходит за 2**53
+(float64 теряет точность целых), пересчитываются точно — батч и одиночный calc дают одно и то же.
+"""
+
+Evaluator = Callable[[Dict[str, Any]], Any]
+
+# Начиная с какого размера группы однотипных выражений включаем NumPy
+VECTORIZE_MIN_BATCH = 32
+# Ограничение на показатель степени (защита от 10**10**10)
+MAX_POW_EXPONENT = 1000
+# Ограничение на размер результата степени в битах (защита от ((9**999)**999)**999); ~4000 знаков
+MAX_POW_BITS = 13000
+# Целые точнее float64 только до 2**53
+FLOAT_EXACT_LIMIT = 2 ** 53
+# Целые float меньше этого печатаются без ".0" (как int); выше int и float печатаются по-разному
+FMT_INT_LIMIT = 1e15
+
+_BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+_UNARY_OPS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+_FUNCS = {
+    "sqrt": math.sqrt, "log": math.log, "log10": math.log10, "exp": math.exp,
+    "sin": math.sin, "cos": math.cos, "tan": math.tan,
+    "floor": math.floor, "ceil": math.ceil, "abs": abs, "round": round, "min": min, "max": max,
+}
+# Только функции, где NumPy дает тот же float, что math (log/exp/sin... в NumPy расходятся в последнем знаке)
+_NP_FUNCS = {"sqrt": "sqrt", "floor": "floor", "ceil": "ceil", "abs": "abs"}
+_CONSTS = {"pi": math.pi, "e": math.e}
+
+_ASSIGN_RE = re.compile(r"^\s*([A-Za-z_]\w*)\s*=(?!=)\s*(.+)$", flags=re.DOTALL)
+
+
+class CalcError(ValueError):
+    pass
+
+
+def _pow(a: Any, b: Any) -> Any:
+    if isinstance(b, (int, float)) and abs(b) > MAX_POW_EXPONENT:
+        raise CalcError("слишком большая степень")
+    if isinstance(a, int) and isinstance(b, int) and b > 0 and abs(a) > 1 and math.log2(abs(a)) * b > MAX_POW_BITS:
+        raise CalcError("слишком большой результат степени")
+    if a < 0 and not float(b).is_integer():
+        # Иначе Python вернет комплексное число
+        raise CalcError("дробная степень отрицательного числа")
+    return a ** b
+
+
+# Векторный путь: отмечаем строки, где промежуточный результат вне точного диапазона float64
+def _np_checked(fn: Callable[..., Any]) -> Callable[..., Any]:
+    def wrapped(env: Dict[str, Any], *args: Any) -> Any:
+        value = fn(*args)
+        env["__inexact"] = env["__inexact"] | ~(np.abs(value) < FLOAT_EXACT_LIMIT)
+        return value
+    return wrapped
+
+
+def _compile(node: ast.AST, np_mode: bool) -> Evaluator:
+    if isinstance(node, ast.Expression):
+        return _compile(node.body, np_mode)
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        v = node.value
+        return lambda env: v
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name in _CONSTS:
+            v = _CONSTS[name]
+            return lambda env: v
+
+        def load(env: Dict[str, Any]) -> Any:
+            if name not in env:
+                raise CalcError(f"неизвестное имя '{name}'")
+            return env[name]
+        return load
+
+    if isinstance(node, ast.BinOp):
+        left, right = _compile(node.left, np_mode), _compile(node.right, np_mode)
+        if isinstance(node.op, ast.Pow):
+            op = operator.pow if np_mode else _pow
+        elif type(node.op) in _BIN_OPS:
+            op = _BIN_OPS[type(node.op)]
+        else:
+            raise CalcError(f"недопустимая операция {type(node.op).__name__}")
+        if np_mode:
+            checked = _np_checked(op)
+            return lambda env: checked(env, left(env), right(env))
+        return lambda env: op(left(env), right(env))
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        op = _UNARY_OPS[type(node.op)]
+        operand = _compile(node.operand, np_mode)
+        return lambda env: op(operand(env))
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        fname = node.func.id
+        if np_mode:
+            if fname not in _NP_FUNCS:
+                raise CalcError(f"функция '{fname}' не векторизуется")
+            fn = getattr(np, _NP_FUNCS[fname])
+        elif fname in _FUNCS:
+            fn = _FUNCS[fname]
+        else:
+            raise CalcError(f"недопустимая функция '{fname}'")
+        args = [_compile(a, np_mode) for a in node.args]
+        if np_mode:
+            checked = _np_checked(fn)
+            return lambda env: checked(env, *(a(env) for a in args))
+        return lambda env: fn(*(a(env) for a in args))
+
+    raise CalcError(f"недопустимый элемент выражения: {type(node).__name__}")
+
+
+# Разбор и компиляция выражения (кэшируется по тексту)
+@functools.lru_cache(maxsize=1024)
+def compile_expression(expression: str) -> Evaluator:
+    try:
+        tree = ast.parse((expression or "").strip(), mode="eval")
+    except SyntaxError as e:
+        raise CalcError(f"синтаксическая ошибка: {e.msg}") from None
+    return _compile(tree, np_mode=False)
+
+
+def _fmt(value: Any) -> str:
+    if isinstance(value, float) and value.is_integer() and abs(value) < FMT_INT_LIMIT:
+        return str(int(value))
+    return str(value)
+
+
+def evaluate(expression: str, env: Optional[Dict[str, Any]] = None) -> Any:
+    return compile_expression(expression)(env or {})
+
+
+# "a = 2*3" -> ("a", "2*3"); "2*3" -> (None, "2*3")
+def _split_assignment(item: str) -> Tuple[Optional[str], str]:
+    m = _ASSIGN_RE.match(item or "")
+    if m and m.group(1) not in _CONSTS:
+        return m.group(1), m.group(2)
+    return None, item or ""
+
+
+# Числовые литералы (не цифры внутри имен вроде log10)
+_NUM_RE = re.compile(r"(?<![\w.])(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+
+
+# Шаблон выражения без чисел: "(3+1)*2" -> "(__c0+__c1)*__c2", [3, 1, 2]
+def _template(expression: str) -> Tuple[str, List[float]]:
+    consts: List[float] = []
+
+    def sub(m: re.Match) -> str:
+        consts.append(float(m.group(0)))
+        return f"__c{len(consts) - 1}"
+
+    text = _NUM_RE.sub(sub, re.sub(r"\s+", "", expression or ""))
+    return text, consts
+
+
+# Шаблоны компилируем для NumPy один раз
+@functools.lru_cache(maxsize=256)
+def _compile_template(template: str) -> Evaluator:
+    return _compile(ast.parse(template, mode="eval"), np_mode=True)
+
+
+def _vectorized(items: List[Tuple[int, str]], results: List[Dict[str, Any]]) -> List[Tuple[int, str]]:
+    """
+    Считает группы однотипных выражений через NumPy, возвращает то, что не удалось векторизовать
+    """
+    groups: Dict[str, List[Tuple[int, str, List[float]]]] = {}
+    rest: List[Tuple[int, str]] = []
+    for idx, expr in items:
+        template, consts = _template(expr)
+        groups.setdefault(template, []).append((idx, expr, consts))
+
+    for template, members in groups.items():
+        if len(members) < VECTORIZE_MIN_BATCH:
+            rest.extend((idx, expr) for idx, expr, _ in members)
+            continue
+        try:
+            fn = _compile_template(template)
+            consts = np.array([m[2] for m in members], dtype=np.float64).reshape(len(members), -1)
+            env = {f"__c{j}": consts[:, j] for j in range(consts.shape[1])}
+            # Строки с числом вне точного диапазона — сразу на точный путь, дальше отмечают операции
+            env["__inexact"] = ~(np.abs(consts) < FLOAT_EXACT_LIMIT).all(axis=1)
+            with np.errstate(all="ignore"):
+                values = np.broadcast_to(fn(env), (len(members),))
+                inexact = np.broadcast_to(env["__inexact"], (len(members),))
+        except Exception:
+            rest.extend((idx, expr) for idx, expr, _ in members)
+            continue
+        for (idx, expr, _), v, bad in zip(members, values.tolist(), inexact.tolist()):
+            # inf/nan (деление на ноль и т.п.), потеря точности целых и большие значения
+            # (у int и float разная запись) — пересчитываем точно
+            if bad or not math.isfinite(v) or abs(v) >= FMT_INT_LIMIT:
+                rest.append((idx, expr))
+            else:
+                results[idx] = {"expr": expr.strip(), "value": _fmt(v)}
+    return rest
+
+
+def evaluate_batch(expressions: List[str]) -> List[Dict[str, Any]]:
+    """
+    Считает список выражений за один вызов
+
+    - "name = expr" сохраняет результат под именем, дальше его можно использовать в других выражениях
+    - результат: [{"expr", "value"} | {"expr", "error"}, ...] (+ "name" для именованных)
+    """
+    results: List[Dict[str, Any]] = [{} for _ in expressions]
+    parsed = [_split_assignment(x) for x in expressions]
+
+    # Неименованные выражения без ссылок на переменные можно векторизовать
+    independent = [(i, expr) for i, (name, expr) in enumerate(parsed) if name is None]
+    if np is not None and len(independent) >= VECTORIZE_MIN_BATCH:
+        left = {i for i, _ in _vectorized(independent, results)}
+    else:
+        left = {i for i, _ in independent}
+
+    env: Dict[str, Any] = {}
+    for i, (name, expr) in enumerate(parsed):
+        if name is None and i not in left:
+            continue
+        item: Dict[str, Any] = {"expr": expr.strip()}
+        if name:
+            item["name"] = name
+        try:
+            value = evaluate(expr, env)
+            if name:
+                env[name] = value
+            item["value"] = _fmt(value)
+        except ZeroDivisionError:
+            item["error"] = "деление на ноль"
+        except Exception as e:
+            item["error"] = str(e)
+        results[i] = item
+    return results
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import ast
+import re
+import shutil
+import subprocess
+from typing import List, Tuple
+
+
+"""
+Локальная проверка кода из ответа coding-агента
+Достаем fenced-блоки ```lang ... ``` и проверяем синтаксис без запуска кода:
+- python — ast.parse
+- bash/sh — bash -n (если bash есть в системе)
+Блоки на других языках не проверяем
+"""
+
+PYTHON_LANGS = {"python", "py", "python3"}
+SHELL_LANGS = {"bash", "sh", "shell", "zsh", "console"}
+
+_FENCE_RE = re.compile(r"```[ \t]*([\w+-]*)[^\n]*\n(.*?)```", flags=re.DOTALL)
+
+
+# Достаем блоки кода: список (язык, код)
+def extract_code_blocks(text: str) -> List[Tuple[str, str]]:
+    return [(m.group(1).lower(), m.group(2)) for m in _FENCE_RE.finditer(text or "")]
+
+
+def _check_python(code: str) -> str:
+    try:
+        ast.parse(code)
+        return ""
+    except SyntaxError as e:
+        line = (e.text or "").strip()
+        return f"SyntaxError (строка {e.lineno}): {e.msg}" + (f" -> {line}" if line else "")
+
+
+def _check_shell(code: str) -> str:
+    bash = shutil.which("bash")
+    if bash is None:
+        return ""
+    try:
+        proc = subprocess.run([bash, "-n"], input=code, capture_output=True, text=True, timeout=5)
+    except Exception:
+        return ""
+    if proc.returncode == 0:
+        return ""
+    # Убираем префикс "/usr/bin/bash: " из сообщений
+    return "bash -n: " + re.sub(r"^[^\n]*?: (line \d+)", r"\1", proc.stderr.strip(), flags=re.MULTILINE)
+
+
+def check_code_blocks(text: str) -> List[str]:
+    """
+    Возвращает список ошибок (пустой список — код в порядке)
+
+    Ошибка также если в ответе нет ни одного блока кода
+    """
+    blocks = extract_code_blocks(text)
+    if not blocks:
+        return ["В ответе нет блока кода ```python ... ``` (или ```bash ... ```)"]
+
+    errors: List[str] = []
+    for i, (lang, code) in enumerate(blocks, 1):
+        if lang in PYTHON_LANGS:
+            err = _check_python(code)
+        elif lang in SHELL_LANGS:
+            err = _check_shell(code)
+        elif not lang:
+            # Язык не указан: считаем ошибкой, только если это не python и не shell
+            err = _check_python(code)
+            if err and not _check_shell(code):
+                err = ""
+        else:
+            err = ""
+        if err:
+            errors.append(f"Блок {i} ({lang or 'без языка'}): {err}")
+    return errors
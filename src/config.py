@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import functools
+import json
 import os
+from typing import Any, Callable, Dict, Optional
+
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+from langchain_core.language_models.chat_models import BaseChatModel
 
 # Загружаем env
 load_dotenv("api_keys.env")
@@ -10,6 +14,157 @@ load_dotenv("api_keys.env")
 API_KEY = os.getenv("OPENAI_API_KEY", "")
 DEFAULT_MODEL = os.getenv("MAS_DEFAULT_MODEL", "gpt-4o-mini")
 NOTES_PATH = os.getenv("MAS_NOTES_PATH", "user_notes.json")
+# Бинарный снапшот заметок для поиска через mmap (notes_snapshot.py), общий для всех процессов
+NOTES_SNAPSHOT = os.getenv("MAS_NOTES_SNAPSHOT", "1") == "1"
+NOTES_SNAPSHOT_PATH = os.getenv("MAS_NOTES_SNAPSHOT_PATH", NOTES_PATH + ".snap")
+
+# Очередь заданий для воркеров (jobs.py): файл SQLite и срок аренды задания воркером
+JOBS_DB_PATH = os.getenv("MAS_JOBS_DB", "jobs.db")
+JOB_LEASE_SECONDS = float(os.getenv("MAS_JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("MAS_JOB_MAX_ATTEMPTS", "3"))
+
+# HTTP-сервис: сколько сессий держать в памяти и через сколько секунд без запросов сессия забывается
+SERVER_MAX_SESSIONS = int(os.getenv("MAS_SERVER_MAX_SESSIONS", "1000"))
+SERVER_SESSION_TTL = float(os.getenv("MAS_SERVER_SESSION_TTL", "3600"))
+
+# Локальная фейковая модель вместо OpenAI (для тестов и бенчмарков)
+FAKE_LLM = os.getenv("MAS_FAKE_LLM", "0") == "1"
+FAKE_LLM_LATENCY = float(os.getenv("MAS_FAKE_LLM_LATENCY", "0"))
+
+# Бюджет токенов на контекст промпта для каждого узла
+CONTEXT_BUDGETS = {
+    "router": 600,
+    "planner": 900,
+    "gather_tools": 1200,
+    "reviewer": 2500,
+    "default": int(os.getenv("MAS_CONTEXT_BUDGET", "1500")),
+}
+# Максимальная длина одной записи контекста (результат инструмента, заметка, реплика)
+CONTEXT_ENTRY_MAX_TOKENS = int(os.getenv("MAS_CONTEXT_ENTRY_MAX_TOKENS", "300"))
+
+# Резюме истории: когда сворачивать старые реплики и сколько последних оставлять как есть
+HISTORY_SUMMARY_TRIGGER_TOKENS = int(os.getenv("MAS_HISTORY_SUMMARY_TRIGGER_TOKENS", "800"))
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("MAS_HISTORY_SUMMARY_MAX_TOKENS", "250"))
+HISTORY_KEEP_RAW = int(os.getenv("MAS_HISTORY_KEEP_RAW", "4"))
+
+# Кэш ответов перед графом: порог близости запросов, размер и TTL по intent (None — не кэшировать)
+ANSWER_CACHE_ENABLED = os.getenv("MAS_ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("MAS_ANSWER_CACHE_THRESHOLD", "0.9"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("MAS_ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_TTL = {
+    "conceptual": 24 * 3600,
+    "architecture": 24 * 3600,
+    "literature": 24 * 3600,
+    "coding": 6 * 3600,
+    "daily": 10 * 60,  # бытовые ответы быстро устаревают (а с датами не кэшируются вовсе)
+    "default": 3600,
+}
+
+# Модели по узлам: уровни (tier) и какой уровень или конкретная модель у каждого узла.
+# Переопределяются файлом MAS_MODEL_CONFIG (JSON {"tiers": {...}, "nodes": {...}})
+# и переменной MAS_NODE_MODELS ("router=small,coding_agent=gpt-4o")
+MODEL_TIERS: Dict[str, Dict[str, Any]] = {
+    "small": {"model": os.getenv("MAS_SMALL_MODEL", DEFAULT_MODEL)},
+    "large": {"model": os.getenv("MAS_LARGE_MODEL", DEFAULT_MODEL)},
+}
+NODE_MODELS: Dict[str, str] = {
+    "router": "small",
+    "planner": "small",
+    "reviewer": "small",
+    "gather_tools": "small",
+    "summary": "small",
+    "conceptual_agent": "large",
+    "architecture_agent": "large",
+    "coding_agent": "large",
+    "daily_agent": "large",
+    "literature_agent": "large",
+    "default": "large",
+}
+# Если маленькая модель так и не вернула разбираемый JSON — одна попытка на большой
+MODEL_ESCALATION = os.getenv("MAS_MODEL_ESCALATION", "1") == "1"
+
+
+def _load_model_config() -> None:
+    path = os.getenv("MAS_MODEL_CONFIG", "")
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            cfg = json.load(f)
+        for tier, spec in (cfg.get("tiers") or {}).items():
+            MODEL_TIERS[tier] = {**MODEL_TIERS.get(tier, {}), **spec}
+        NODE_MODELS.update(cfg.get("nodes") or {})
+    for pair in os.getenv("MAS_NODE_MODELS", "").split(","):
+        if "=" in pair:
+            node, target = pair.split("=", 1)
+            NODE_MODELS[node.strip()] = target.strip()
+
+
+_load_model_config()
+
+
+def model_spec(node: Optional[str] = None, tier: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Параметры модели узла: {"model": ..., + параметры ChatOpenAI (max_tokens, timeout, ...)}
+    tier задает уровень явно (например, "large" при эскалации)
+    """
+    target = tier or NODE_MODELS.get(node or "default", NODE_MODELS["default"])
+    if target in MODEL_TIERS:
+        return dict(MODEL_TIERS[target])
+    # В NODE_MODELS можно указать название модели напрямую
+    return {"model": target}
+
+
+# Имя модели, которая стоит за объектом LLM (для логов)
+def llm_model_name(llm: Any) -> str:
+    return str(getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__)
+
+
+# Детерминированные проверки черновика перед LLM-ревьюером (review_gates.py):
+# "1" — уверенные правила решают сами, "shadow" — только логируем рядом с решением LLM, "0" — выключено
+REVIEW_GATES = os.getenv("MAS_REVIEW_GATES", "1")
+
+# Подменная фабрика моделей: make_llm(temperature) -> BaseChatModel
+_LLM_FACTORY: Optional[Callable[[float], BaseChatModel]] = None
+
+
+def set_llm_factory(factory: Optional[Callable[[float], BaseChatModel]]) -> None:
+    """
+    Подменяет модель для всех узлов графа (None — вернуть ChatOpenAI)
+    """
+    global _LLM_FACTORY
+    _LLM_FACTORY = factory
+
+    # Собранные ReAct-агенты держат старую модель, поэтому сбрасываем их кэш
+    from .agents import clear_agent_cache
+    clear_agent_cache()
+
+
+def get_llm(temperature: float = 0.2, node: Optional[str] = None, tier: Optional[str] = None) -> BaseChatModel:
+    """
+    Модель для узла node (см. NODE_MODELS/MODEL_TIERS); без node — модель по умолчанию
+    """
+    if _LLM_FACTORY is not None:
+        return _LLM_FACTORY(temperature)
+    spec = model_spec(node, tier)
+    if FAKE_LLM:
+        from .fake_llm import ScriptedChatModel
+        return ScriptedChatModel(temperature=temperature, latency=FAKE_LLM_LATENCY, model_name=spec["model"])
+
+    params = {k: v for k, v in spec.items() if k != "model"}
+    # Ключ кэша — json параметров: вложенные dict/list (model_kwargs, stop) не хэшируются как есть
+    try:
+        key = json.dumps(params, sort_keys=True)
+    except (TypeError, ValueError):
+        return _make_openai_llm(spec["model"], float(temperature), params)
+    return _openai_llm(spec["model"], float(temperature), key)
+
+
+# Клиенты OpenAI держим "теплыми": один экземпляр (и HTTP-пул) на модель, температуру и параметры
+@functools.lru_cache(maxsize=32)
+def _openai_llm(model: str, temperature: float, params_json: str = "{}") -> BaseChatModel:
+    return _make_openai_llm(model, temperature, json.loads(params_json))
+
 
-def get_llm(temperature: float = 0.2) -> ChatOpenAI:
-    return ChatOpenAI(model=DEFAULT_MODEL, temperature=temperature, api_key=API_KEY)
\ No newline at end of file
+def _make_openai_llm(model: str, temperature: float, params: Dict[str, Any]) -> BaseChatModel:
+    from langchain_openai import ChatOpenAI
+    # stream_usage: usage (в т.ч. cached_tokens) приходит и в потоковых ответах
+    return ChatOpenAI(model=model, temperature=temperature, api_key=API_KEY, stream_usage=True, **params)
@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from .config import CONTEXT_BUDGETS, CONTEXT_ENTRY_MAX_TOKENS, DEFAULT_MODEL
+from .utils import now_iso
+
+
+"""
+Сборщик контекста для промптов узлов
+Вместо json.dumps(state) каждый узел получает контекст, уложенный в бюджет токенов:
+- токены считаем локальным токенизатором (tiktoken, если он установлен);
+- повторяющиеся результаты инструментов выкидываем;
+- длинные записи обрезаем (начало + конец);
+- сколько токенов сэкономили — пишем в state["context_stats"]
+"""
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken необязателен, без него считаем грубо
+    tiktoken = None
+
+
+# Загружаем токенизатор один раз на процесс
+@functools.lru_cache(maxsize=1)
+def _get_encoder():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(DEFAULT_MODEL)
+    except Exception:
+        pass
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+# Считаем количество токенов в строке
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _get_encoder()
+    if enc is None:
+        # Примерно 4 символа на токен
+        return max(1, len(text) // 4)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def _dumps(x: Any) -> str:
+    return x if isinstance(x, str) else json.dumps(x, ensure_ascii=False, default=str)
+
+
+# Обрезаем длинный текст: оставляем начало и конец
+def trim_text(text: str, max_tokens: int) -> str:
+    text = text or ""
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+    enc = _get_encoder()
+    head_n = max_tokens * 2 // 3
+    tail_n = max(0, max_tokens - head_n)
+    marker = f" …[сокращено ~{total - max_tokens} ток.]… "
+    if enc is None:
+        head, tail = text[:head_n * 4], (text[-tail_n * 4:] if tail_n else "")
+    else:
+        ids = enc.encode(text, disallowed_special=())
+        head = enc.decode(ids[:head_n])
+        tail = enc.decode(ids[-tail_n:]) if tail_n else ""
+    return head + marker + tail
+
+
+# Приводим записи к компактному виду (без ts и служебных полей)
+def _compact_memory_hit(h: Dict[str, Any]) -> Dict[str, Any]:
+    out = {"text": h.get("text", "")}
+    if h.get("tags"):
+        out["tags"] = h["tags"]
+    return out
+
+
+def _compact_tool_entry(e: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in e.items() if k != "ts"}
+
+
+def _compact_history(h: Dict[str, Any]) -> Dict[str, Any]:
+    return {"role": h.get("role", ""), "content": h.get("content", "")}
+
+
+def _fingerprint(entry: Any) -> str:
+    return hashlib.sha1(_dumps(entry).strip().lower().encode("utf-8")).hexdigest()
+
+
+# Убираем дубликаты, сохраняя последнее вхождение
+def _dedupe(entries: List[Any]) -> List[Any]:
+    seen = set()
+    out: List[Any] = []
+    for e in reversed(entries):
+        fp = _fingerprint(e)
+        if fp in seen:
+            continue
+        seen.add(fp)
+        out.append(e)
+    out.reverse()
+    return out
+
+
+# Обрезаем строковые поля записи до лимита
+def _trim_entry(entry: Any, max_tokens: int) -> Any:
+    if isinstance(entry, str):
+        return trim_text(entry, max_tokens)
+    if isinstance(entry, dict):
+        return {k: (trim_text(v, max_tokens) if isinstance(v, str) else v) for k, v in entry.items()}
+    return entry
+
+
+# Набираем записи секции, пока помещаются в бюджет (свежие записи приоритетнее)
+def _fit(entries: List[Any], budget: int, newest_first: bool) -> List[Any]:
+    order = list(reversed(entries)) if newest_first else list(entries)
+    taken: List[Any] = []
+    used = 0
+    for e in order:
+        cost = count_tokens(_dumps(e))
+        if used + cost > budget:
+            if newest_first:
+                break
+            continue
+        taken.append(e)
+        used += cost
+    return list(reversed(taken)) if newest_first else taken
+
+
+def pack_context(
+        state: "MASState",
+        node: str,
+        *,
+        extra: Optional[Dict[str, Any]] = None,
+        plan: bool = True,
+        memory_hits: bool = True,
+        tool_context: int = 8,
+        history: int = 4,
+        budget: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Собирает контекст узла в пределах бюджета токенов
+
+    - node: имя узла (по нему берется бюджет из CONTEXT_BUDGETS)
+    - extra: обязательные поля (intent, draft, focus, ...), которые не урезаются
+    - plan / memory_hits: включать ли план и найденные заметки
+    - tool_context / history: сколько последних записей брать (0 — не брать)
+    - budget: явный бюджет вместо значения из конфига
+
+    Приоритет секций: plan -> memory_hits -> tool_context_tail -> history_summary -> history_tail
+    """
+    if budget is None:
+        budget = CONTEXT_BUDGETS.get(node, CONTEXT_BUDGETS["default"])
+
+    if history:
+        # Подхватываем резюме истории, если фоновое свертывание уже закончилось
+        from .summary import refresh_history_summary
+        refresh_history_summary(state)
+
+    ctx: Dict[str, Any] = {"query": state.get("query", "")}
+    ctx.update(extra or {})
+
+    raw_sections: Dict[str, List[Any]] = {}
+    if plan:
+        raw_sections["plan"] = list(state.get("plan", []) or [])
+    if memory_hits:
+        raw_sections["memory_hits"] = list(state.get("memory_hits", []) or [])
+    if tool_context:
+        raw_sections["tool_context_tail"] = list(state.get("tool_context", []) or [])[-tool_context:]
+    if history and state.get("history_summary"):
+        # Резюме старых реплик вместо самих реплик (см. summary.py)
+        raw_sections["history_summary"] = [state["history_summary"]]
+    if history:
+        raw_sections["history_tail"] = list(state.get("history", []) or [])[-history:]
+
+    # Сколько токенов было бы без упаковки
+    tokens_raw = count_tokens(_dumps({**ctx, **raw_sections}))
+
+    compact = {
+        "plan": lambda x: x,
+        "memory_hits": _compact_memory_hit,
+        "tool_context_tail": _compact_tool_entry,
+        "history_tail": _compact_history,
+        "history_summary": lambda x: x,
+    }
+
+    left = budget - count_tokens(_dumps(ctx))
+    for name, entries in raw_sections.items():
+        items = [compact[name](e) for e in entries]
+        items = _dedupe(items)
+        items = [_trim_entry(e, CONTEXT_ENTRY_MAX_TOKENS) for e in items]
+        newest_first = name in ("tool_context_tail", "history_tail")
+        items = _fit(items, max(0, left), newest_first=newest_first)
+        if name == "history_summary":
+            ctx[name] = items[0] if items else ""
+        else:
+            ctx[name] = items
+        left -= count_tokens(_dumps(items))
+
+    tokens_packed = count_tokens(_dumps(ctx))
+    state.setdefault("context_stats", []).append({
+        "ts": now_iso(),
+        "node": node,
+        "budget": budget,
+        "tokens_raw": tokens_raw,
+        "tokens_packed": tokens_packed,
+        "tokens_saved": max(0, tokens_raw - tokens_packed),
+    })
+    return ctx
+
+
+# Контекст в виде JSON (для router/planner/reviewer/агентов без инструментов)
+def render_json(ctx: Dict[str, Any]) -> str:
+    return json.dumps(ctx, ensure_ascii=False)
+
+
+# Контекст в виде строк "KEY: value" (для ReAct-агентов)
+def render_lines(ctx: Dict[str, Any]) -> str:
+    return "".join(f"{k.upper()}: {_dumps(v)}\n" for k, v in ctx.items())
+
+
+# Сколько токенов сэкономили по каждому узлу за прогон
+def tokens_saved_by_node(state: "MASState") -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for s in state.get("context_stats", []) or []:
+        out[s["node"]] = out.get(s["node"], 0) + int(s.get("tokens_saved", 0))
+    return out
+
+
+# Токены промпта из ответа API: всего и сколько провайдер взял из кэша префиксов
+def prompt_usage(message: Any) -> Dict[str, int]:
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage:
+        details = usage.get("input_token_details") or {}
+        return {"input_tokens": int(usage.get("input_tokens") or 0), "cached_tokens": int(details.get("cache_read") or 0)}
+    # Старый формат OpenAI: response_metadata["token_usage"]
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    details = token_usage.get("prompt_tokens_details") or {}
+    return {"input_tokens": int(token_usage.get("prompt_tokens") or 0), "cached_tokens": int(details.get("cached_tokens") or 0)}
+
+
+# Записи для state["prompt_usage"] по ответам модели узла (сообщения без usage пропускаются)
+def prompt_usage_entries(node: str, messages: List[Any]) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for m in messages:
+        if getattr(m, "type", "") not in ("ai", "AIMessageChunk"):
+            continue
+        usage = prompt_usage(m)
+        if usage["input_tokens"]:
+            out.append({"ts": now_iso(), "node": node, **usage})
+    return out
+
+
+def record_prompt_usage(state: "MASState", node: str, messages: List[Any]) -> None:
+    """
+    Пишет в state["prompt_usage"] токены промпта по ответам модели узла
+    """
+    state.setdefault("prompt_usage", []).extend(prompt_usage_entries(node, messages))
+
+
+# Токены промпта и попадания в кэш провайдера по узлам за прогон
+def prompt_cache_by_node(state: "MASState") -> Dict[str, Dict[str, int]]:
+    out: Dict[str, Dict[str, int]] = {}
+    for u in state.get("prompt_usage", []) or []:
+        agg = out.setdefault(u["node"], {"calls": 0, "input_tokens": 0, "cached_tokens": 0})
+        agg["calls"] += 1
+        agg["input_tokens"] += int(u.get("input_tokens", 0))
+        agg["cached_tokens"] += int(u.get("cached_tokens", 0))
+    return out
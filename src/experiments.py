@@ -1,30 +1,35 @@
 from __future__ import annotations
 from typing import Any, Dict, List
 from .graph import build_graph_with_retry_loop
-from .config import get_llm
+from .answer_cache import ANSWER_CACHE, history_scope, remember, state_from_hit
+from .config import ANSWER_CACHE_ENABLED, get_llm
+from .context import prompt_cache_by_node
 from .nodes import ExperimentComment
+from .state import init_state
+from .tools import tool_cache_scope
 from .utils import _short
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.messages import SystemMessage, HumanMessage, BaseMessage
-from .retry import invoke_with_parser_retry
+from .retry import decision_scope, invoke_with_parser_retry
 import json
 
+# Промпт оценщика (статический, считается один раз)
+COMMENT_PARSER = PydanticOutputParser(pydantic_object=ExperimentComment)
+COMMENT_SYSTEM = (
+    "Ты — строгий оценщик качества ответа мультиагентной системы.\n"
+    "Оцени полезность результата и укажи, что улучшить.\n"
+    "Ориентируйся на:\n"
+    "- корректность intent/маршрутизации,\n"
+    "- осмысленность tool calls,\n"
+    "- использовалась ли память по делу,\n"
+    "- полноту и конкретику ответа.\n"
+    "Ответ строго JSON по схеме.\n"
+    f"{COMMENT_PARSER.get_format_instructions()}"
+)
+
+
 # Модель говорит что можно было бы улучшить
 def make_experiment_comment(llm_factory, out: dict) -> ExperimentComment:
-    parser = PydanticOutputParser(pydantic_object=ExperimentComment)
-
-    system = (
-        "Ты — строгий оценщик качества ответа мультиагентной системы.\n"
-        "Оцени полезность результата и укажи, что улучшить.\n"
-        "Ориентируйся на:\n"
-        "- корректность intent/маршрутизации,\n"
-        "- осмысленность tool calls,\n"
-        "- использовалась ли память по делу,\n"
-        "- полноту и конкретику ответа.\n"
-        "Ответ строго JSON по схеме.\n"
-        f"{parser.get_format_instructions()}"
-    )
-
     ctx = {
         "query": out.get("query"),
         "intent": out.get("intent"),
@@ -43,60 +48,63 @@ def make_experiment_comment(llm_factory, out: dict) -> ExperimentComment:
     comment: ExperimentComment = invoke_with_parser_retry(
         make_llm=make_llm,
         messages=[
-            SystemMessage(content=system),
+            SystemMessage(content=COMMENT_SYSTEM),
             HumanMessage(content=json.dumps(ctx, ensure_ascii=False))
         ],
-        parser=parser,
+        parser=COMMENT_PARSER,
         max_retries=3,
         temps=(0.0, 0.3, 0.7),
     )
     return comment
 
 # Запускаем пайплайн мультиагентоной системы
-def run_system(query: str, thread_id: str = "u1", max_rounds: int = 3):
+def run_system(query: str, thread_id: str = "u1", max_rounds: int = 3, use_cache: bool = ANSWER_CACHE_ENABLED):
+    # Повторный или перефразированный вопрос отдаем из кэша ответов, не запуская граф
+    # (граф здесь новый на каждый вызов, история пустая — scope общий)
+    scope = history_scope(thread_id)
+    if use_cache:
+        hit = ANSWER_CACHE.lookup(query, scope=scope)
+        if hit is not None:
+            print(f"answer_cache: hit (similarity={hit['similarity']}, intent={hit['intent']})")
+            return state_from_hit(query, thread_id, max_rounds, hit)
+
     app = build_graph_with_retry_loop()
 
-    init = {
-        "query": query,
-        "intent": None,
-        "plan": [],
-        "tool_context": [],
-        "focus": "",
-        "need_more": False,
-        "round": 0,
-        "max_rounds": max_rounds,
-        "partial": "",
-        "final_answer": "",
-        "history": [],
-        "memory_notes": [],
-        "memory_hits": [],
-        "memory_summary": "",
-        "activated_nodes": [],
-        "tool_calls": [],
-        "handoff_log": [],
-        "thread_id": thread_id,
-        "verbose": True,
-    }
+    init = init_state(query, thread_id=thread_id, max_rounds=max_rounds)
 
     config = {"configurable": {"thread_id": thread_id}, "recursion_limit": 120}
 
-    last = None
-    # Показываем какие ключи state обновились на каждом шаге
-    for update in app.stream(init, config=config, stream_mode="updates"):
-        last = update
-        for node_name, patch in update.items():
-            print(f"\n===---NODE: {node_name}---===")
-            if "handoff_log" in patch:
-                print("handoff:", patch["handoff_log"][-1:])
-            if "tool_calls" in patch:
-                print("tool_calls +", len(patch["tool_calls"]))
-            if "partial" in patch:
-                print("partial:", _short(patch["partial"], 300))
-            if "final_answer" in patch:
-                print("final_answer:", _short(patch["final_answer"], 300))
-
-    # Возвращаем финальный state
-    out = app.invoke(init, config=config)
+    # Кэш инструментов живет один прогон (см. tools.tool_cache_scope)
+    with decision_scope(thread_id), tool_cache_scope():
+        last = None
+        # Показываем какие ключи state обновились на каждом шаге
+        for update in app.stream(init, config=config, stream_mode="updates"):
+            last = update
+            for node_name, patch in update.items():
+                print(f"\n===---NODE: {node_name}---===")
+                if "handoff_log" in patch:
+                    print("handoff:", patch["handoff_log"][-1:])
+                if "tool_calls" in patch:
+                    print("tool_calls +", len(patch["tool_calls"]))
+                if "partial" in patch:
+                    print("partial:", _short(patch["partial"], 300))
+                if "final_answer" in patch:
+                    print("final_answer:", _short(patch["final_answer"], 300))
+                if patch.get("models_used", {}).get(node_name):
+                    print("model:", patch["models_used"][node_name])
+                if patch.get("context_stats"):
+                    st = patch["context_stats"][-1]
+                    print(f"context: {st['tokens_packed']}/{st['budget']} ток., сэкономлено {st['tokens_saved']}")
+
+        # Возвращаем финальный state
+        out = app.invoke(init, config=config)
+
+    # Токены промпта и попадания в кэш провайдера по узлам
+    for node, u in prompt_cache_by_node(out).items():
+        print(f"prompt {node}: {u['input_tokens']} ток. за {u['calls']} вызов(а), из кэша {u['cached_tokens']}")
+
+    if use_cache:
+        remember(out, scope=scope)
     return out
 
 
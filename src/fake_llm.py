@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import Field
+
+
+"""
+Локальная "фейковая" чат-модель
+Нужна для тестов и бенчмарков графа без обращений к OpenAI:
+- отвечает по сценарию (script) или по встроенным правилам;
+- умеет вызывать инструменты (bind_tools), поэтому работает внутри create_react_agent;
+- отдает JSON для router/planner/reviewer;
+- имитирует задержку сети (latency на вызов и latency_per_token при стриминге);
+- возвращает usage_metadata с имитацией кэша префиксов промпта у провайдера
+"""
+
+# Кэш префиксов как у OpenAI: промпты от 1024 токенов, совпадение блоками по 128 токенов
+PREFIX_CACHE_MIN_TOKENS = 1024
+PREFIX_CACHE_BLOCK = 128
+_PREFIX_CACHE: set = set()
+_PREFIX_LOCK = threading.Lock()
+
+
+# Определяем intent по ключевым словам (для ответа "роутера")
+def _guess_intent(query: str) -> str:
+    q = (query or "").lower()
+    if re.search(r"код|python|bash|скрипт|программ|code", q):
+        return "coding"
+    if re.search(r"архитектур|спроектир|state|дизайн", q):
+        return "architecture"
+    if re.search(r"литератур|стать|обзор|поисков", q):
+        return "literature"
+    if re.search(r"объясни|разниц|что такое|паттерн", q):
+        return "conceptual"
+    return "daily"
+
+
+# Достаем исходный запрос пользователя из JSON-контекста или строки "QUERY: ..."
+def _extract_query(text: str) -> str:
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return str(data.get("query", ""))
+    except Exception:
+        pass
+    m = re.search(r"^QUERY:\s*(.*)$", text or "", flags=re.MULTILINE)
+    if not m:
+        return text or ""
+    q = m.group(1).strip()
+    try:
+        return str(json.loads(q))
+    except Exception:
+        return q
+
+
+def _content(m: BaseMessage) -> str:
+    return m.content if isinstance(m.content, str) else json.dumps(m.content, ensure_ascii=False)
+
+
+# Аргументы для известных инструментов
+def _tool_args(name: str, query: str) -> Optional[Dict[str, Any]]:
+    if name == "search_user_notes":
+        return {"query": query}
+    if name == "calc":
+        return {"expression": "2*(3+4)"}
+    if name == "calc_batch":
+        return {"expressions": ["a = 2*(3+4)", "a / 7"]}
+    if name == "days_until":
+        return {"date_iso": "2030-01-01"}
+    return None
+
+
+def default_responder(messages: List[BaseMessage], tools: List[Dict[str, Any]], max_tool_calls: int = 1) -> AIMessage:
+    """
+    Правила ответа фейковой модели:
+    1) Router / Planner / reviewer / оценщик — валидный JSON по схеме узла
+    2) Если привязаны инструменты и лимит вызовов не исчерпан — tool call
+    3) Иначе — текстовый ответ (для coding-агента с блоком кода)
+    """
+    system = "\n".join(_content(m) for m in messages if isinstance(m, SystemMessage))
+    humans = [m for m in messages if isinstance(m, HumanMessage)]
+    query = _extract_query(_content(humans[0])) if humans else ""
+
+    if "Router" in system:
+        return AIMessage(content=json.dumps({"intent": _guess_intent(query), "reasoning": "fake"}, ensure_ascii=False))
+    if "Planner" in system:
+        plan = ["Уточнить цель", "Собрать контекст", "Сформировать ответ", "Проверить результат", "Сохранить заметку"]
+        return AIMessage(content=json.dumps({"plan": plan}, ensure_ascii=False))
+    if "reviewer" in system:
+        return AIMessage(content=json.dumps({"need_more": False, "focus": "", "improved_answer": ""}))
+    if "оценщик" in system:
+        return AIMessage(content=json.dumps({"helpful": True, "issues": [], "improvements": []}))
+
+    done_calls = sum(len(getattr(m, "tool_calls", None) or []) for m in messages if isinstance(m, AIMessage))
+    if tools and done_calls < max_tool_calls:
+        for t in tools:
+            name = t.get("function", {}).get("name") or t.get("name", "")
+            args = _tool_args(name, query)
+            if args is not None:
+                return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{done_calls + 1}"}])
+
+    if "coding" in system:
+        return AIMessage(content=(
+            "```python\n"
+            "def main():\n"
+            "    print(' '.join(str(i) for i in range(1, 11)))\n\n\n"
+            "if __name__ == \"__main__\":\n"
+            "    main()\n"
+            "```\n"
+            "Запуск: сохранить в main.py и выполнить `python main.py`."
+        ))
+    return AIMessage(content=f"Ответ на запрос: {query}\n1) Шаг первый\n2) Шаг второй\n3) Итог")
+
+
+# usage_metadata ответа: токены считаем грубо (4 символа), cache_read — длина уже виденного префикса
+def _usage(messages: List[BaseMessage], output: str) -> Dict[str, Any]:
+    prompt = "".join(f"{m.type}:{_content(m)}\n" for m in messages)
+    input_tokens = max(1, len(prompt) // 4)
+    cached = 0
+    if input_tokens >= PREFIX_CACHE_MIN_TOKENS:
+        with _PREFIX_LOCK:
+            hit = True
+            for n in range(PREFIX_CACHE_MIN_TOKENS, input_tokens + 1, PREFIX_CACHE_BLOCK):
+                key = hashlib.sha1(prompt[:n * 4].encode("utf-8")).hexdigest()
+                if hit and key in _PREFIX_CACHE:
+                    cached = n
+                else:
+                    hit = False
+                    _PREFIX_CACHE.add(key)
+    output_tokens = max(1, len(output) // 4)
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": input_tokens + output_tokens,
+        "input_token_details": {"cache_read": cached},
+    }
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Чат-модель без сети
+
+    - script: очередь готовых ответов (str / dict -> JSON / AIMessage), после нее работает responder
+    - responder: функция (messages, tools) -> AIMessage, по умолчанию default_responder
+    - latency: искусственная задержка на один вызов (сек)
+    - latency_per_token: задержка на токен при стриминге (сек)
+    - max_tool_calls: сколько tool calls делает встроенный responder за один диалог
+    """
+
+    script: List[Any] = Field(default_factory=list)
+    responder: Optional[Callable[[List[BaseMessage], List[Dict[str, Any]]], AIMessage]] = None
+    latency: float = 0.0
+    latency_per_token: float = 0.0
+    max_tool_calls: int = 1
+    temperature: float = 0.0
+    model_name: str = "fake-chat"
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "temperature": self.temperature}
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def _respond(self, messages: List[BaseMessage], tools: List[Dict[str, Any]]) -> AIMessage:
+        self.calls += 1
+        if self.script:
+            item = self.script.pop(0)
+            if isinstance(item, AIMessage):
+                return item
+            if isinstance(item, (dict, list)):
+                return AIMessage(content=json.dumps(item, ensure_ascii=False))
+            return AIMessage(content=str(item))
+        if self.responder is not None:
+            return self.responder(messages, tools)
+        return default_responder(messages, tools, max_tool_calls=self.max_tool_calls)
+
+    def _generate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Any = None,
+            **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        message = self._respond(messages, kwargs.get("tools") or [])
+        message.response_metadata = {**(message.response_metadata or {}), "model_name": self.model_name}
+        message.usage_metadata = _usage(messages, _content(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Any = None,
+            **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        if self.latency:
+            time.sleep(self.latency)
+        message = self._respond(messages, kwargs.get("tools") or [])
+        usage = _usage(messages, _content(message))
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": tc["name"], "args": json.dumps(tc["args"], ensure_ascii=False), "id": tc["id"], "index": i}
+                    for i, tc in enumerate(message.tool_calls)
+                ],
+                usage_metadata=usage,
+            ))
+            return
+        # Режем ответ на "токены" по пробелам и знакам препинания
+        for token in re.findall(r"\s+|[^\s\"{}\[\],:]+|.", _content(message)):
+            if self.latency_per_token:
+                time.sleep(self.latency_per_token)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        # Как OpenAI со stream_usage: usage приходит последним пустым чанком
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
@@ -10,6 +10,8 @@ from .nodes import (
     router_node,
     planner_node,
     gather_tools_node,
+    gather_item_node,
+    gather_merge_node,
     conceptual_agent_node,
     architecture_agent_node,
     coding_agent_node,
@@ -19,8 +21,8 @@ from .nodes import (
     finalize_node,
     route_after_planner,
     route_after_reviewer,
+    route_after_gather,
 )
-from IPython.display import Image, display, Markdown
 
 # Визуализация графа
 def build_graph_with_retry_loop():
@@ -30,6 +32,8 @@ def build_graph_with_retry_loop():
     g.add_node("planner", planner_node)
 
     g.add_node("gather_tools", gather_tools_node)
+    g.add_node("gather_item", gather_item_node)
+    g.add_node("gather_merge", gather_merge_node)
 
     g.add_node("conceptual_agent", conceptual_agent_node)
     g.add_node("architecture_agent", architecture_agent_node)
@@ -46,17 +50,26 @@ def build_graph_with_retry_loop():
     # planner -> gather_tools (первичный добор)
     g.add_edge("planner", "gather_tools")
 
+    agents_by_intent = {
+        "conceptual": "conceptual_agent",
+        "architecture": "architecture_agent",
+        "coding": "coding_agent",
+        "daily": "daily_agent",
+        "literature": "literature_agent",
+    }
+
     # gather_tools -> chosen agent (handoff по intent)
+    # или параллельный добор по focus_items: gather_tools -> gather_item x N (Send) -> gather_merge -> agent
     g.add_conditional_edges(
         "gather_tools",
+        route_after_gather,
+        {**agents_by_intent, "gather_item": "gather_item"}
+    )
+    g.add_edge("gather_item", "gather_merge")
+    g.add_conditional_edges(
+        "gather_merge",
         lambda s: s.get("intent") or "daily",
-        {
-            "conceptual": "conceptual_agent",
-            "architecture": "architecture_agent",
-            "coding": "coding_agent",
-            "daily": "daily_agent",
-            "literature": "literature_agent",
-        }
+        agents_by_intent
     )
 
     # Агент -> ревьюер
@@ -75,6 +88,8 @@ def build_graph_with_retry_loop():
     return g.compile(checkpointer=MemorySaver())
 
 def show_graph(app):
+    from IPython.display import Image, display, Markdown
+
     g = app.get_graph()
     try:
         display(Image(g.draw_mermaid_png()))
@@ -83,5 +98,6 @@ def show_graph(app):
 
 
 # Граф
-app = build_graph_with_retry_loop()
-show_graph(app)
\ No newline at end of file
+if __name__ == "__main__":
+    app = build_graph_with_retry_loop()
+    show_graph(app)
\ No newline at end of file
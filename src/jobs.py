@@ -0,0 +1,418 @@
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from .config import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOBS_DB_PATH
+
+
+"""
+Очередь заданий на SQLite и пул воркеров-процессов
+- enqueue кладет запрос в очередь, задания переживают падение процесса;
+- воркер берет задание в аренду (lease) и продлевает ее, пока граф работает;
+- задание с истекшей арендой (воркер упал) возвращается в очередь, после max_attempts — failed;
+- один thread_id выполняется только одним воркером за раз и строго по порядку постановки;
+- результат и финальный state пишутся в таблицу jobs, поля сессии (history, history_summary) — в sessions,
+  поэтому следующий ход сессии может выполнить любой воркер
+- заметки пользователя воркеры дописывают под flock на файле заметок (memory_store.append_note),
+  поэтому параллельные процессы не затирают записи друг друга
+
+Запуск:
+    python -m src.jobs enqueue "Как приготовить штрудель?" --thread u1
+    python -m src.jobs worker --processes 4
+    python -m src.jobs status
+    python -m src.jobs result 1
+"""
+
+# Поля сессии, которые переносятся между ходами (как в server.SESSION_FIELDS)
+SESSION_FIELDS = ("history", "history_summary")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    thread_id    TEXT NOT NULL,
+    query        TEXT NOT NULL,
+    max_rounds   INTEGER NOT NULL DEFAULT 3,
+    status       TEXT NOT NULL DEFAULT 'queued',  -- queued | running | done | failed
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker       TEXT,
+    lease_until  REAL,
+    created_at   REAL NOT NULL,
+    started_at   REAL,
+    finished_at  REAL,
+    result       TEXT,
+    state        TEXT,
+    error        TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_thread ON jobs (thread_id, status);
+CREATE TABLE IF NOT EXISTS sessions (
+    thread_id  TEXT PRIMARY KEY,
+    fields     TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class JobQueue:
+    """
+    Очередь заданий в файле SQLite (несколько процессов работают с одним файлом)
+
+    - path: файл базы
+    - lease_seconds: на сколько воркер арендует задание (продлевается heartbeat)
+    - max_attempts: сколько раз задание выдается воркерам, прежде чем стать failed
+    """
+
+    def __init__(self, path: str = JOBS_DB_PATH, lease_seconds: float = JOB_LEASE_SECONDS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.executescript(_SCHEMA)
+        finally:
+            db.close()
+
+    # Отдельное соединение на операцию: их можно вызывать из разных потоков и процессов
+    @contextmanager
+    def _tx(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA busy_timeout=30000")
+            # IMMEDIATE сразу берет блокировку записи: выбор и захват задания атомарны между процессами
+            db.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def enqueue(self, query: str, thread_id: str = "u1", max_rounds: int = 3) -> int:
+        with self._tx(immediate=True) as db:
+            cur = db.execute(
+                "INSERT INTO jobs (thread_id, query, max_rounds, max_attempts, created_at) VALUES (?, ?, ?, ?, ?)",
+                (thread_id, query, max_rounds, self.max_attempts, time.time()),
+            )
+            return int(cur.lastrowid)
+
+    def _expire_leases(self, db: sqlite3.Connection, now: float) -> None:
+        # Воркер не продлил аренду (упал или завис): задание снова в очередь или failed
+        db.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END, "
+            "worker = NULL, lease_until = NULL, error = 'lease expired' "
+            "WHERE status = 'running' AND lease_until < ?",
+            (now,),
+        )
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """
+        Берет самое старое задание, чей thread_id сейчас никем не выполняется. None — брать нечего
+        """
+        now = time.time()
+        with self._tx(immediate=True) as db:
+            self._expire_leases(db, now)
+            row = db.execute(
+                "SELECT * FROM jobs j WHERE j.status = 'queued' "
+                "AND NOT EXISTS (SELECT 1 FROM jobs r WHERE r.thread_id = j.thread_id AND r.status = 'running') "
+                "AND NOT EXISTS (SELECT 1 FROM jobs o WHERE o.thread_id = j.thread_id AND o.status = 'queued' "
+                "AND o.id < j.id) "
+                "ORDER BY j.id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                "started_at = ?, error = NULL WHERE id = ?",
+                (worker, now + self.lease_seconds, now, row["id"]),
+            )
+            job = dict(row)
+            job.update(status="running", worker=worker, attempts=row["attempts"] + 1)
+            return job
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """
+        Продлевает аренду. False — аренда уже потеряна (задание отдано другому воркеру)
+        """
+        with self._tx() as db:
+            cur = db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, job_id, worker),
+            )
+            return cur.rowcount == 1
+
+    def complete(self, job_id: int, worker: str, result: Dict[str, Any], state: Dict[str, Any]) -> bool:
+        """
+        Пишет результат, финальный state и поля сессии. Если аренда потеряна — результат отбрасывается
+        """
+        with self._tx(immediate=True) as db:
+            row = db.execute(
+                "SELECT thread_id FROM jobs WHERE id = ? AND worker = ? AND status = 'running'", (job_id, worker)
+            ).fetchone()
+            if row is None:
+                return False
+            now = time.time()
+            db.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ?, lease_until = NULL, result = ?, state = ? "
+                "WHERE id = ?",
+                (now, _dumps(result), _dumps(state), job_id),
+            )
+            fields = {k: state.get(k) for k in SESSION_FIELDS if k in state}
+            db.execute(
+                "INSERT INTO sessions (thread_id, fields, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET fields = excluded.fields, updated_at = excluded.updated_at",
+                (row["thread_id"], _dumps(fields), now),
+            )
+            return True
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """
+        Ошибка выполнения: задание возвращается в очередь, пока не исчерпаны попытки
+        """
+        with self._tx(immediate=True) as db:
+            cur = db.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END, "
+                "worker = NULL, lease_until = NULL, finished_at = ?, error = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time(), error, job_id, worker),
+            )
+            return cur.rowcount == 1
+
+    def load_session(self, thread_id: str) -> Dict[str, Any]:
+        with self._tx() as db:
+            row = db.execute("SELECT fields FROM sessions WHERE thread_id = ?", (thread_id,)).fetchone()
+        return json.loads(row["fields"]) if row else {}
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with self._tx() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for k in ("result", "state"):
+            job[k] = json.loads(job[k]) if job[k] else None
+        return job
+
+    def wait(self, job_id: int, timeout: Optional[float] = None, poll: float = 0.2) -> Optional[Dict[str, Any]]:
+        """
+        Ждет, пока задание станет done/failed (None — не дождались)
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while deadline is None or time.time() < deadline:
+            job = self.get(job_id)
+            if job is not None and job["status"] in ("done", "failed"):
+                return job
+            time.sleep(poll)
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        with self._tx() as db:
+            rows = db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+
+def _dumps(x: Any) -> str:
+    return json.dumps(x, ensure_ascii=False, default=str)
+
+
+# Продлеваем аренду в фоне, пока граф выполняется
+class _Heartbeat(threading.Thread):
+    def __init__(self, queue: JobQueue, job_id: int, worker: str):
+        super().__init__(daemon=True)
+        self.queue, self.job_id, self.worker = queue, job_id, worker
+        self.lost = False
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.queue.lease_seconds / 3):
+            if not self.queue.heartbeat(self.job_id, self.worker):
+                self.lost = True
+                return
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def run_job(app: Any, queue: JobQueue, job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Выполняет один ход сессии: поля сессии берутся из sessions, остальной state — с нуля
+    """
+    from .state import init_state
+    from .summary import refresh_history_summary
+    from .retry import decision_scope
+    from .tools import tool_cache_scope
+
+    init = dict(init_state(job["query"], thread_id=job["thread_id"], max_rounds=job["max_rounds"]))
+    init["verbose"] = False
+    init.update(queue.load_session(job["thread_id"]))
+    config = {"configurable": {"thread_id": job["thread_id"]}, "recursion_limit": 120}
+    try:
+        with decision_scope(job["thread_id"]), tool_cache_scope():
+            out = app.invoke(init, config=config)
+    finally:
+        # Сессия хранится в sessions, чекпоинты хода в памяти воркера не нужны (иначе растут с числом thread_id)
+        app.checkpointer.delete_thread(job["thread_id"])
+    # Резюме истории сворачивается в фоне этого процесса — дожидаемся, чтобы сохранить его в sessions
+    refresh_history_summary(out, wait=True)
+    return out
+
+
+def _result(out: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "intent": out.get("intent"),
+        "final_answer": out.get("final_answer", ""),
+        "activated_nodes": out.get("activated_nodes", []),
+        "handoff_log": out.get("handoff_log", []),
+        "tools_used": len(out.get("tool_calls", [])),
+        "memory_summary": out.get("memory_summary", ""),
+        "models_used": out.get("models_used", {}),
+    }
+
+
+def worker_loop(
+        db_path: str = JOBS_DB_PATH,
+        name: Optional[str] = None,
+        poll: float = 0.5,
+        drain: bool = False,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        fake: bool = False,
+        fake_latency: float = 0.0,
+) -> int:
+    """
+    Цикл воркера: берет задания, пока не остановят (drain=True — выйти, когда очередь пуста). Возвращает число заданий
+    """
+    if fake:
+        from .config import set_llm_factory
+        from .fake_llm import ScriptedChatModel
+        set_llm_factory(lambda t: ScriptedChatModel(temperature=t, latency=fake_latency))
+
+    from .graph import build_graph_with_retry_loop
+
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    queue = JobQueue(db_path, lease_seconds=lease_seconds)
+    app = build_graph_with_retry_loop()
+    stop = threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    done = 0
+    while not stop.is_set():
+        job = queue.claim(name)
+        if job is None:
+            if drain and not queue.stats().get("running"):
+                break
+            stop.wait(poll)
+            continue
+
+        hb = _Heartbeat(queue, job["id"], name)
+        hb.start()
+        try:
+            out = run_job(app, queue, job)
+        except Exception as e:
+            hb.stop()
+            queue.fail(job["id"], name, f"{type(e).__name__}: {e}")
+            continue
+        hb.stop()
+        if queue.complete(job["id"], name, _result(out), out):
+            done += 1
+    return done
+
+
+def _worker_main(kwargs: Dict[str, Any]) -> None:
+    try:
+        worker_loop(**kwargs)
+    except KeyboardInterrupt:
+        pass
+
+
+def run_pool(processes: int, **kwargs: Any) -> None:
+    """
+    Запускает processes воркеров в отдельных процессах и ждет их завершения
+    """
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_worker_main, args=(kwargs,), name=f"mas-worker-{i}") for i in range(processes)]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Очередь заданий мультиагентной системы")
+    ap.add_argument("--db", default=JOBS_DB_PATH, help="файл SQLite очереди")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p_enq = sub.add_parser("enqueue", help="поставить запрос в очередь")
+    p_enq.add_argument("query")
+    p_enq.add_argument("--thread", default="u1")
+    p_enq.add_argument("--max-rounds", type=int, default=3)
+    p_enq.add_argument("--wait", type=float, default=0.0, help="дождаться результата (сек)")
+
+    p_work = sub.add_parser("worker", help="запустить воркеры")
+    p_work.add_argument("--processes", type=int, default=1)
+    p_work.add_argument("--poll", type=float, default=0.5, help="пауза при пустой очереди, сек")
+    p_work.add_argument("--lease", type=float, default=JOB_LEASE_SECONDS, help="срок аренды задания, сек")
+    p_work.add_argument("--drain", action="store_true", help="выйти, когда очередь опустеет")
+    p_work.add_argument("--fake", action="store_true", help="локальная ScriptedChatModel вместо OpenAI")
+    p_work.add_argument("--fake-latency", type=float, default=0.0)
+
+    sub.add_parser("status", help="сколько заданий в каждом статусе")
+
+    p_res = sub.add_parser("result", help="результат задания")
+    p_res.add_argument("job_id", type=int)
+    p_res.add_argument("--state", action="store_true", help="вывести и финальный state")
+
+    args = ap.parse_args(argv)
+    queue = JobQueue(args.db)
+
+    if args.cmd == "enqueue":
+        job_id = queue.enqueue(args.query, thread_id=args.thread, max_rounds=args.max_rounds)
+        print(job_id)
+        if args.wait:
+            job = queue.wait(job_id, timeout=args.wait)
+            print(json.dumps(job["result"] if job else {"status": "timeout"}, ensure_ascii=False, indent=2))
+    elif args.cmd == "worker":
+        kwargs = dict(db_path=args.db, poll=args.poll, drain=args.drain, lease_seconds=args.lease,
+                      fake=args.fake, fake_latency=args.fake_latency)
+        if args.processes <= 1:
+            print(f"обработано заданий: {worker_loop(**kwargs)}")
+        else:
+            run_pool(args.processes, **kwargs)
+    elif args.cmd == "status":
+        print(json.dumps(queue.stats(), ensure_ascii=False))
+    elif args.cmd == "result":
+        job = queue.get(args.job_id)
+        if job is None:
+            print(f"задание {args.job_id} не найдено")
+            return 1
+        if not args.state:
+            job.pop("state", None)
+        print(json.dumps(job, ensure_ascii=False, indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+"""
+Нагрузочный и длительный (soak) тест графа на фейковой модели
+Много сессий (thread_id) параллельно, в каждой несколько ходов подряд, запросы по смеси intent.
+Отчет:
+- пропускная способность (ходов в секунду), латентность хода и каждого узла: p50/p95/p99;
+- латентность по номеру хода и по числу раундов gather_tools -> reviewer;
+- RSS процесса во времени и число thread_id в MemorySaver. Сервис удаляет чекпоинты после каждого хода,
+  поэтому рост памяти чекпоинтов виден только с --keep-checkpoints (как до ограничения памяти сессий);
+- конфликты записи в файл заметок: сохраненные заметки, которых нет в файле в конце
+
+Запуск:
+    python -m src.loadtest --sessions 50 --turns 4 --concurrency 16 --fake-latency 0.01
+    python -m src.loadtest --mix coding=3,daily=1 --note-rate 0.5 --json report.json
+    python -m src.loadtest --sessions 200 --keep-checkpoints   # рост памяти чекпоинтов
+"""
+
+# Заметки и модель подменяем ДО импорта модулей системы (NOTES_PATH читается при импорте config)
+os.environ.setdefault("MAS_NOTES_PATH", os.path.join(tempfile.mkdtemp(prefix="mas_load_"), "notes.json"))
+os.environ["MAS_FAKE_LLM"] = "1"
+
+QUERIES: Dict[str, List[str]] = {
+    "conceptual": [
+        "Объясни разницу между supervisor и planner-executor паттернами",
+        "Что такое tool calling в LLM-агентах?",
+    ],
+    "architecture": [
+        "Спроектируй архитектуру мультиагентной системы поддержки",
+        "Предложи дизайн state для графа агентов",
+    ],
+    "coding": [
+        "Напиши код на python для чтения CSV",
+        "Напиши скрипт bash для бэкапа каталога",
+    ],
+    "daily": [
+        "Сколько дней до 2030-01-01 и сколько это недель?",
+        "Как приготовить штрудель?",
+    ],
+    "literature": [
+        "Дай поисковые запросы и критерии отбора литературы по multi-agent LLM",
+        "Составь обзор литературы по prompt caching",
+    ],
+}
+
+NOTE_MARKER = "loadtest-note"
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """
+    "coding=3,daily=1" -> {"coding": 3.0, "daily": 1.0}; пустая строка — все intent поровну
+    """
+    if not text:
+        return {intent: 1.0 for intent in QUERIES}
+    mix: Dict[str, float] = {}
+    for pair in text.split(","):
+        intent, _, weight = pair.partition("=")
+        intent = intent.strip()
+        if intent not in QUERIES:
+            raise ValueError(f"неизвестный intent '{intent}', доступны: {', '.join(QUERIES)}")
+        mix[intent] = float(weight or 1)
+    return mix
+
+
+# RSS процесса в МБ (Linux: /proc/self/statm, иначе пиковый RSS из resource)
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples: List[Dict[str, float]] = []
+        self._done = threading.Event()
+        self._t0 = time.perf_counter()
+
+    def run(self):
+        while not self._done.is_set():
+            self.samples.append({"t_s": round(time.perf_counter() - self._t0, 2), "rss_mb": round(_rss_mb(), 1)})
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.samples.append({"t_s": round(time.perf_counter() - self._t0, 2), "rss_mb": round(_rss_mb(), 1)})
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"n": 0, "mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    v = sorted(values)
+
+    def pct(p: float) -> float:
+        return round(v[min(len(v) - 1, int(p * len(v)))], 2)
+
+    return {"n": len(v), "mean": round(statistics.fmean(v), 2), "p50": pct(0.50), "p95": pct(0.95),
+            "p99": pct(0.99), "max": round(v[-1], 2)}
+
+
+def _make_responder(note_rate: float, rng: random.Random, rng_lock: threading.Lock, saved: List[str]):
+    """
+    Ответы фейковой модели: как default_responder, но агенты с save_user_note с вероятностью note_rate
+    сохраняют уникальную заметку (так нагружаем файл заметок конкурентной записью)
+    """
+    from langchain_core.messages import AIMessage
+    from .fake_llm import default_responder
+
+    def responder(messages, tools):
+        names = {t.get("function", {}).get("name") or t.get("name", "") for t in tools or []}
+        first_call = not any(getattr(m, "tool_calls", None) for m in messages if isinstance(m, AIMessage))
+        if "save_user_note" in names and first_call:
+            with rng_lock:
+                write = rng.random() < note_rate
+            if write:
+                text = f"{NOTE_MARKER} {uuid.uuid4().hex}"
+                saved.append(text)
+                return AIMessage(content="", tool_calls=[
+                    {"name": "save_user_note", "args": {"text": text, "tags_json": "[\"load\"]"}, "id": "call_note"}])
+        return default_responder(messages, tools)
+
+    return responder
+
+
+def run_load(
+        sessions: int = 20,
+        turns: int = 3,
+        concurrency: int = 8,
+        mix: Optional[Dict[str, float]] = None,
+        fake_latency: float = 0.0,
+        fake_token_latency: float = 0.0,
+        note_rate: float = 0.2,
+        max_rounds: int = 3,
+        sample_interval: float = 0.5,
+        seed: int = 0,
+        keep_checkpoints: bool = False,
+) -> Dict[str, Any]:
+    """
+    Прогоняет sessions сессий по turns ходов (ходы одной сессии идут последовательно), concurrency сессий параллельно
+    """
+    from .config import NOTES_PATH, set_llm_factory
+    from .fake_llm import ScriptedChatModel
+    from .memory_store import load_notes
+    from .server import MASService
+
+    mix = mix or parse_mix("")
+    intents, weights = list(mix), list(mix.values())
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    saved_notes: List[str] = []
+    responder = _make_responder(note_rate, rng, rng_lock, saved_notes)
+    set_llm_factory(lambda t: ScriptedChatModel(
+        temperature=t, latency=fake_latency, latency_per_token=fake_token_latency, responder=responder))
+
+    service = MASService(max_rounds=max_rounds, use_cache=False, keep_checkpoints=keep_checkpoints)
+    lock = threading.Lock()
+    turn_ms: List[float] = []
+    node_ms: Dict[str, List[float]] = {}
+    by_turn: Dict[int, List[float]] = {}
+    by_rounds: Dict[int, List[float]] = {}
+    by_intent: Dict[str, List[float]] = {}
+    errors: List[str] = []
+
+    def run_session(i: int) -> None:
+        srng = random.Random(seed * 100003 + i)
+        thread_id = f"load-{i}"
+        for turn in range(1, turns + 1):
+            intent = srng.choices(intents, weights)[0]
+            query = f"{srng.choice(QUERIES[intent])} (сессия {i}, ход {turn})"
+            t0 = time.perf_counter()
+            nodes: List[tuple] = []
+            rounds = 0
+            try:
+                for event, data in service.run_turn(query, thread_id):
+                    if event == "node":
+                        nodes.append((data["node"], data["ms"]))
+                        rounds = max(rounds, int(data.get("round") or 0))
+            except Exception as e:
+                with lock:
+                    errors.append(f"{thread_id}#{turn}: {type(e).__name__}: {e}")
+                continue
+            ms = (time.perf_counter() - t0) * 1000
+            with lock:
+                turn_ms.append(ms)
+                by_turn.setdefault(turn, []).append(ms)
+                by_rounds.setdefault(rounds, []).append(ms)
+                by_intent.setdefault(intent, []).append(ms)
+                for node, node_time in nodes:
+                    node_ms.setdefault(node, []).append(node_time)
+
+    sampler = RSSSampler(sample_interval)
+    sampler.start()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load") as pool:
+        list(pool.map(run_session, range(sessions)))
+    elapsed = time.perf_counter() - t0
+    sampler.stop()
+    set_llm_factory(None)
+
+    # Заметки, которые инструмент сохранил, но которых нет в файле: затерты параллельной записью
+    stored = {n.get("text", "") for n in load_notes() if NOTE_MARKER in n.get("text", "")}
+    lost = [t for t in saved_notes if t not in stored]
+
+    rss = [s["rss_mb"] for s in sampler.samples]
+    return {
+        "config": {"sessions": sessions, "turns": turns, "concurrency": concurrency, "mix": mix,
+                   "fake_latency": fake_latency, "fake_token_latency": fake_token_latency,
+                   "note_rate": note_rate, "max_rounds": max_rounds, "notes_path": NOTES_PATH,
+                   "keep_checkpoints": keep_checkpoints},
+        "elapsed_s": round(elapsed, 2),
+        "turns_ok": len(turn_ms),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "throughput_turns_per_s": round(len(turn_ms) / elapsed, 2) if elapsed else None,
+        "turn_latency_ms": _percentiles(turn_ms),
+        "node_latency_ms": {n: _percentiles(v) for n, v in sorted(node_ms.items())},
+        "latency_by_turn_ms": {t: _percentiles(v) for t, v in sorted(by_turn.items())},
+        "latency_by_rounds_ms": {r: _percentiles(v) for r, v in sorted(by_rounds.items())},
+        "latency_by_intent_ms": {k: _percentiles(v) for k, v in sorted(by_intent.items())},
+        "rss_mb": {"start": rss[0], "end": rss[-1], "peak": max(rss), "samples": sampler.samples},
+        "checkpoint_threads": len(service.app.checkpointer.storage),
+        "notes": {"saved": len(saved_notes), "in_file": len(stored), "lost_writes": len(lost)},
+    }
+
+
+def _print_report(r: Dict[str, Any]) -> None:
+    c = r["config"]
+    print(f"сессий {c['sessions']} x ходов {c['turns']}, параллельно {c['concurrency']}, "
+          f"задержка модели {c['fake_latency']} с")
+    print(f"ходов: {r['turns_ok']}, ошибок: {r['errors']}, за {r['elapsed_s']} с -> {r['throughput_turns_per_s']} ход/с")
+    for e in r["error_samples"]:
+        print("  ошибка:", e)
+
+    def line(name: str, p: Dict[str, Any]) -> str:
+        return f"{name:<28} n={p['n']:<5} p50={p['p50']:<9} p95={p['p95']:<9} p99={p['p99']:<9} max={p['max']}"
+
+    print(line("turn", r["turn_latency_ms"]))
+    print("-- узлы (мс)")
+    for name, p in r["node_latency_ms"].items():
+        print(line(name, p))
+    print("-- по номеру хода в сессии")
+    for turn, p in r["latency_by_turn_ms"].items():
+        print(line(f"turn #{turn}", p))
+    print("-- по числу раундов добора")
+    for rounds, p in r["latency_by_rounds_ms"].items():
+        print(line(f"rounds={rounds}", p))
+    rss = r["rss_mb"]
+    print(f"RSS: {rss['start']} -> {rss['end']} МБ (пик {rss['peak']}), замеров {len(rss['samples'])}")
+    kept = "сохраняются" if c["keep_checkpoints"] else "удаляются после хода"
+    print(f"чекпоинты ({kept}): thread_id в MemorySaver {r['checkpoint_threads']}")
+    n = r["notes"]
+    print(f"заметки: сохранено {n['saved']}, в файле {n['in_file']}, потеряно при параллельной записи {n['lost_writes']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Нагрузочный тест графа на фейковой модели")
+    ap.add_argument("--sessions", type=int, default=20, help="сколько thread_id")
+    ap.add_argument("--turns", type=int, default=3, help="ходов в каждой сессии")
+    ap.add_argument("--concurrency", type=int, default=8, help="сколько сессий выполняется одновременно")
+    ap.add_argument("--mix", default="", help="веса intent: conceptual=1,coding=2,... (по умолчанию поровну)")
+    ap.add_argument("--fake-latency", type=float, default=0.0, help="задержка фейковой модели на вызов, сек")
+    ap.add_argument("--fake-token-latency", type=float, default=0.0, help="задержка фейковой модели на токен, сек")
+    ap.add_argument("--note-rate", type=float, default=0.2, help="доля ходов агента, которые пишут заметку")
+    ap.add_argument("--max-rounds", type=int, default=3)
+    ap.add_argument("--sample-interval", type=float, default=0.5, help="период замера RSS, сек")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--keep-checkpoints", action="store_true",
+                    help="не удалять чекпоинты после хода (замер роста памяти MemorySaver)")
+    ap.add_argument("--json", default="", help="сохранить полный отчет в файл")
+    args = ap.parse_args(argv)
+
+    report = run_load(
+        sessions=args.sessions,
+        turns=args.turns,
+        concurrency=args.concurrency,
+        mix=parse_mix(args.mix),
+        fake_latency=args.fake_latency,
+        fake_token_latency=args.fake_token_latency,
+        note_rate=args.note_rate,
+        max_rounds=args.max_rounds,
+        sample_interval=args.sample_interval,
+        seed=args.seed,
+        keep_checkpoints=args.keep_checkpoints,
+    )
+    _print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"отчет: {args.json}")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
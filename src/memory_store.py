@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import re
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import NOTES_PATH, NOTES_SNAPSHOT
+from .utils import now_iso
+
+try:
+    import fcntl
+except ImportError:  # Windows: только блокировка внутри процесса
+    fcntl = None
+
+
+"""
+Хранилище памяти
+Сохраняем историю на диск в json-файл и извлекаем ответы по запросу
+Поиск идет по бинарному снапшоту заметок через mmap (notes_snapshot.py): процессы-воркеры делят одну
+копию в page cache вместо того, чтобы каждый разбирал весь json; MAS_NOTES_SNAPSHOT=0 — поиск по json
+Заметки пишут несколько процессов (воркеры jobs.py, потоки сервера): json заменяется атомарно
+(временный файл + os.replace), а цикл загрузить-добавить-сохранить идет под flock на файле <json>.lock
+"""
+
+_LOCK = threading.Lock()
+
+# Загружаем историю из json-файла
+def load_notes(path: Optional[str] = None) -> List[Dict[str, Any]]:
+    path = path or NOTES_PATH
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+            return data if isinstance(data, list) else []
+    except Exception:
+        return []
+
+# Эксклюзивная блокировка файла заметок между процессами и потоками
+@contextlib.contextmanager
+def notes_lock(path: Optional[str] = None):
+    path = path or NOTES_PATH
+    with _LOCK:
+        if fcntl is None:
+            yield
+            return
+        with open(path + ".lock", "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+# Сохраняем историю в json-файл: атомарно, читатели видят либо старый, либо новый файл целиком.
+# Снапшот здесь не пересобираем (это O(N) на каждую заметку) — его пересоберет первый поиск
+def save_notes(notes: List[Dict[str, Any]], path: Optional[str] = None) -> None:
+    path = path or NOTES_PATH
+    data = json.dumps(notes, ensure_ascii=False, indent=2).encode("utf-8")
+    fd, tmp = tempfile.mkstemp(prefix=".notes_", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+# Добавляем в память ответ и сохраняем в файл. Заметки перечитываются под блокировкой,
+# поэтому параллельные записи других процессов не затираются
+def append_note(text: str, tags: Optional[List[str]] = None, path: Optional[str] = None) -> Dict[str, Any]:
+    path = path or NOTES_PATH
+    note = {"ts": now_iso(), "text": (text or "").strip(), "tags": tags or []}
+    with notes_lock(path):
+        # Битый json не подменяем списком из одной заметки: ошибка уйдет в инструмент
+        notes: List[Dict[str, Any]] = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                notes = json.load(f)
+            if not isinstance(notes, list):
+                raise ValueError(f"{path}: ожидается список заметок")
+        notes.append(note)
+        save_notes(notes, path)
+    return note
+
+# Работа с памятью
+def simple_retrieve_notes(notes: List[Dict[str, Any]], query: str, k: int = 5) -> List[Dict[str, Any]]:
+    """
+    Алгоритм:
+    1) Берем запрос и приводим к нижнему регистру, извлекаем токены длиной >= 3
+    2) Для каждой заметки считаем "score" = сколько токенов запроса встречается в тексте ответа или в тегах
+    3) Возвращаем топ ответов с максимальной оценкой
+
+    Параметры:
+    - notes: список заметок (list[dict])
+    - query: запрос от пользователя или агента
+    - k: сколько ответов нужно вернуть
+
+    Возвращает:
+    - список заметок (dict), наиболее релевантных запросу
+    """
+    q = (query or "").lower()
+    tokens = set(re.findall(r"[a-zа-я0-9]{3,}", q))
+    scored: List[Tuple[int, Dict[str, Any]]] = []
+    for n in notes:
+        text = (n.get("text", "") + " " + " ".join(n.get("tags", []))).lower()
+        score = sum(1 for t in tokens if t in text)
+        if score > 0:
+            scored.append((score, n))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [n for _, n in scored[:k]]
+
+
+# Поиск заметок по запросу: через снапшот (тот же результат, что simple_retrieve_notes по load_notes())
+def retrieve_notes(query: str, k: int = 5) -> List[Dict[str, Any]]:
+    if NOTES_SNAPSHOT:
+        from .notes_snapshot import open_snapshot
+        try:
+            return open_snapshot().search(query, k=k)
+        except Exception:
+            pass
+    return simple_retrieve_notes(load_notes(), query, k=k)
@@ -1,28 +1,39 @@
 from __future__ import annotations
 
-import json
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, get_args
 
 from pydantic import BaseModel, Field
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
-
-from langgraph.prebuilt import create_react_agent  # оставляем (у тебя оно работает)
-
-from .config import get_llm
-from .memory_store import load_notes, simple_retrieve_notes
-from .retry import invoke_with_parser_retry
+from langgraph.types import Send
+
+from .agents import agent_model_name, get_react_agent
+from .code_check import check_code_blocks
+from .config import MODEL_ESCALATION, REVIEW_GATES, get_llm, llm_model_name, model_spec
+from .context import pack_context, prompt_usage_entries, record_prompt_usage, render_json, render_lines
+from .memory_store import retrieve_notes
+from .review_gates import run_gates
+from .retry import StreamedDecision, defer_decision, invoke_with_parser_retry, pop_decision
 from .state import MASState, Intent
-from .tools import TOOLS_CODING, TOOLS_DAILY, TOOLS_LITERATURE, search_user_notes, save_user_note
+from .summary import fold_history, refresh_history_summary
+from .tools import (
+    TOOLS_CODING,
+    TOOLS_DAILY,
+    TOOLS_LITERATURE,
+    current_tool_cache,
+    save_user_note,
+    search_user_notes,
+    tool_result_cached,
+)
 from .utils import (
     now_iso,
     _coerce_text,
     _short,
     add_history,
     add_tool_log,
+    add_tool_context,
+    add_trace,
     add_node_log,
-    trim_history,
 )
 
 # Planner схема
@@ -36,6 +47,7 @@ class PlanOut(BaseModel):
 class ReviewDecision(BaseModel):
     need_more: bool = Field(..., description="Нужно ли добирать информацию через инструменты")
     focus: str = Field("", description="Что конкретно добрать/уточнить (коротко)")
+    focus_items: List[str] = Field(default_factory=list, description="Независимые пункты focus, которые можно добирать параллельно")
     improved_answer: str = Field("", description="Улучшенная версия текста, если уже можно улучшить без добора")
 
 class ExperimentComment(BaseModel):
@@ -44,6 +56,127 @@ class ExperimentComment(BaseModel):
     improvements: List[str] = Field(default_factory=list, description="Что улучшить (коротко и конкретно)")
 
 
+# Статические части промптов считаем один раз при импорте: системный промпт (вместе с инструкциями
+# парсера) — неизменный префикс запроса, переменный контекст идет последним сообщением.
+# Так префикс совпадает байт-в-байт между вызовами и попытками, и срабатывает кэш промптов провайдера
+ROUTER_PARSER = PydanticOutputParser(pydantic_object=RouteDecision)
+ROUTER_SYSTEM = (
+    "Ты — Router мультиагентной системы.\n"
+    "Определи intent запроса одним из:\n"
+    "- conceptual: теоретика MAS/LLM\n"
+    "- architecture: проектирование/архитектура\n"
+    "- coding: реализация/код\n"
+    "- daily: повседневные задачи\n"
+    "- literature: поиск/обзор литературы\n"
+    "Ответ строго JSON по схеме.\n"
+    f"{ROUTER_PARSER.get_format_instructions()}"
+)
+
+PLANNER_PARSER = PydanticOutputParser(pydantic_object=PlanOut)
+PLANNER_SYSTEM = (
+    "Ты — Planner.\n"
+    "Составь короткий план решения из 5–10 шагов по запросу пользователя.\n"
+    "Учитывай intent, memory_hits и историю.\n"
+    "Ответ строго JSON по схеме.\n"
+    f"{PLANNER_PARSER.get_format_instructions()}"
+)
+
+REVIEWER_PARSER = PydanticOutputParser(pydantic_object=ReviewDecision)
+REVIEWER_SYSTEM = (
+    "Ты — reviewer.\n"
+    "Проверь: хватает ли информации для хорошего ответа.\n"
+    "Если НЕ хватает: need_more=true и в focus напиши ЧТО добрать через инструменты.\n"
+    "Если добрать нужно несколько независимых вещей — перечисли их по одной в focus_items.\n"
+    "Если хватает: need_more=false и improved_answer содержит улучшенную версию (или пусто).\n"
+    "Ответ строго JSON.\n"
+    f"{REVIEWER_PARSER.get_format_instructions()}"
+)
+
+CONCEPTUAL_SYSTEM = (
+    "Ты — conceptual-агент (теория MAS/LLM-агенты).\n"
+    "Дай структурированный ответ: определения, ключевые идеи, 1–2 примера.\n"
+    "Опирайся на plan + memory_hits + tool_context.\n"
+    "Если чего-то не хватает — явно укажи, что именно.\n"
+)
+
+ARCHITECTURE_SYSTEM = (
+    "Ты — architecture-агент (архитектура/дизайн).\n"
+    "Сформируй ответ с блоками:\n"
+    "1) компоненты и роли агентов,\n"
+    "2) state поля,\n"
+    "3) handoff/маршрутизация,\n"
+    "4) tool calling,\n"
+    "5) memory management,\n"
+    "6) риски и улучшения.\n"
+    "Опирайся на plan + memory_hits + tool_context.\n"
+)
+
+# Системные промпты ReAct-агентов (агенты собираются один раз в реестре agents.py)
+CODING_SYSTEM = (
+    "Ты — coding-агент.\n"
+    "Твоя задача: выдать ИСПОЛНИМЫЙ код.\n"
+    "Формат ответа ОБЯЗАТЕЛЕН:\n"
+    "1) Один кодовый блок ```python ... ``` (или ```bash``` если нужно)\n"
+    "2) Ниже 2–5 строк инструкции как запустить.\n"
+    "3) Обязательно напиши код по синтаксическим правилам написания кода. \n"
+    "Если не хватает данных — предположи разумные значения и отметь TODO в коде.\n"
+    "Инструменты: calc_batch, search_user_notes, save_user_note.\n"
+    "Если полезно — сначала search_user_notes.\n"
+)
+
+DAILY_SYSTEM = (
+    "Ты — daily-агент (повседневные задачи).\n"
+    "Инструменты: days_until, calc_batch, search_user_notes, save_user_note.\n"
+    "Если есть дата/дедлайн — days_until.\n"
+    "Если есть расчёты — передай ВСЕ выражения одним вызовом calc_batch (промежуточные результаты: \"a = ...\").\n"
+    "Если выдаёшь полезный план/чеклист — сохрани save_user_note.\n"
+)
+
+LITERATURE_SYSTEM = (
+    "Ты — literature-агент.\n"
+    "Сформируй:\n"
+    "1) 5–10 поисковых запросов (лучше на английском)\n"
+    "2) критерии отбора статей\n"
+    "3) структуру обзора\n"
+    "Инструменты: search_user_notes, save_user_note.\n"
+    "Если есть полезные выводы — сохрани заметку.\n"
+)
+
+GATHER_SYSTEM = (
+    "Ты — агент добора информации через инструменты.\n"
+    "Твоя задача — добрать недостающие данные, следуя focus.\n"
+    "Всегда начинай с поиска в заметках (search_user_notes), если это уместно.\n"
+    "Используй инструменты строго по необходимости.\n"
+    "После добора кратко резюмируй, что нашёл.\n"
+)
+
+
+# Фиксируем, какая модель отвечала за узел
+def _record_model(state: MASState, node: str, model: Any) -> None:
+    state.setdefault("models_used", {})[node] = model if isinstance(model, str) else llm_model_name(model)
+
+
+# Большая модель для эскалации, если у узла своя (меньшая) модель; served — куда записать, что эскалация была
+def _escalation_llm(node: str, served: Optional[List[str]] = None):
+    if not MODEL_ESCALATION or model_spec(node) == model_spec(tier="large"):
+        return None
+
+    def make_llm(temp: float):
+        llm = get_llm(temperature=temp, tier="large")
+        if served is not None:
+            served.append(llm_model_name(llm))
+        return llm
+    return make_llm
+
+
+# Модель узла (с учетом эскалации) и токены промпта по завершенному отложенному решению
+def _record_decision_usage(state: MASState, node: str, decision: StreamedDecision) -> None:
+    if decision.models:
+        model = decision.models[-1]
+        _record_model(state, node, f"{model} (escalated)" if decision.escalated else model)
+    record_prompt_usage(state, node, decision.responses)
+
+
 # Агенты (ноды)
 def router_node(state: MASState) -> MASState:
     """
@@ -51,50 +184,42 @@ def router_node(state: MASState) -> MASState:
     """
     add_node_log(state, "router")
 
-    # Долговременная память
-    notes = load_notes()
-    hits = simple_retrieve_notes(notes, state["query"], k=4)
-    state["memory_notes"] = notes
-    state["memory_hits"] = hits
-
-    # Отчет роутера парсим с помощью PydanticOutputParser
-    parser = PydanticOutputParser(pydantic_object=RouteDecision)
-
-    system = (
-        "Ты — Router мультиагентной системы.\n"
-        "Определи intent запроса одним из:\n"
-        "- conceptual: теоретика MAS/LLM\n"
-        "- architecture: проектирование/архитектура\n"
-        "- coding: реализация/код\n"
-        "- daily: повседневные задачи\n"
-        "- literature: поиск/обзор литературы\n"
-        "Ответ строго JSON по схеме.\n"
-        f"{parser.get_format_instructions()}"
-    )
+    # Резюме, свернутое в конце прошлого хода, к этому моменту обычно уже готово
+    refresh_history_summary(state, wait=True)
 
-    ctx = {"query": state["query"], "memory_hits": hits, "history_tail": state["history"][-4:]}
+    # Долговременная память (поиск по общему снапшоту, все заметки в state не копируем)
+    state["memory_hits"] = retrieve_notes(state["query"], k=4)
+
+    ctx = pack_context(state, "router", plan=False, tool_context=0)
 
     def make_llm(temp: float):
-        return get_llm(temperature=temp)
+        return get_llm(temperature=temp, node="router")
 
-    decision: RouteDecision = invoke_with_parser_retry(
+    # Стримим ответ: intent идет первым полем, reasoning дописывается в фоне, пока работает planner
+    decision = StreamedDecision(
         make_llm=make_llm,
         messages=[
-            SystemMessage(content=system),
-            HumanMessage(content=json.dumps(ctx, ensure_ascii=False)),
+            SystemMessage(content=ROUTER_SYSTEM),
+            HumanMessage(content=render_json(ctx)),
         ],
-        parser=parser,
+        parser=ROUTER_PARSER,
         max_retries=3,
         temps=(0.1, 0.2, 0.3),
+        escalate_llm=_escalation_llm("router"),
     )
+    _record_model(state, "router", get_llm(node="router"))
+    intent = decision.wait_field("intent")
+    if intent not in get_args(Intent):
+        intent = decision.result().intent
 
-    state["intent"] = decision.intent
-    # Фиксируем handoff router передал управление нужному агенту
-    state["handoff_log"].append(f"[handoff] router -> {decision.intent} | {decision.reasoning}")
+    state["intent"] = intent
+    # Фиксируем handoff router передал управление нужному агенту (reasoning допишет finalize)
+    state["handoff_log"].append(f"[handoff] router -> {intent}")
+    defer_decision(state["thread_id"], "router", decision)
 
     # Обновляем историю диалога в оперативной памяти сессии
     add_history(state, "user", state["query"])
-    trim_history(state)
+    fold_history(state)
     return state
 
 
@@ -102,35 +227,27 @@ def router_node(state: MASState) -> MASState:
 def planner_node(state: MASState) -> MASState:
     add_node_log(state, "planner")
 
-    parser = PydanticOutputParser(pydantic_object=PlanOut)
-    system = (
-        "Ты — Planner.\n"
-        "Составь короткий план решения из 5–10 шагов по запросу пользователя.\n"
-        "Учитывай intent, memory_hits и историю.\n"
-        "Ответ строго JSON по схеме.\n"
-        f"{parser.get_format_instructions()}"
-    )
-
-    ctx = {
-        "query": state["query"],
-        "intent": state["intent"],
-        "memory_hits": state["memory_hits"],
-        "history_tail": state["history"][-4:],
-    }
+    ctx = pack_context(state, "planner", extra={"intent": state["intent"]}, plan=False, tool_context=0)
 
     def make_llm(temp: float):
-        return get_llm(temperature=temp)
+        return get_llm(temperature=temp, node="planner")
 
+    escalated: List[str] = []
+    responses: List[Any] = []
     out: PlanOut = invoke_with_parser_retry(
         make_llm=make_llm,
         messages=[
-            SystemMessage(content=system),
-            HumanMessage(content=json.dumps(ctx, ensure_ascii=False)),
+            SystemMessage(content=PLANNER_SYSTEM),
+            HumanMessage(content=render_json(ctx)),
         ],
-        parser=parser,
+        parser=PLANNER_PARSER,
         max_retries=3,
         temps=(0.2, 0.5, 0.8),
+        escalate_llm=_escalation_llm("planner", escalated),
+        on_response=responses.append,
     )
+    record_prompt_usage(state, "planner", responses)
+    _record_model(state, "planner", f"{escalated[-1]} (escalated)" if escalated else get_llm(node="planner"))
 
     plan = out.plan if isinstance(out.plan, list) and out.plan else []
     if not plan:
@@ -144,26 +261,15 @@ def planner_node(state: MASState) -> MASState:
 def conceptual_agent_node(state: MASState) -> MASState:
     add_node_log(state, "conceptual_agent")
 
-    llm = get_llm(temperature=0.2)
-    system = (
-        "Ты — conceptual-агент (теория MAS/LLM-агенты).\n"
-        "Дай структурированный ответ: определения, ключевые идеи, 1–2 примера.\n"
-        "Опирайся на plan + memory_hits + tool_context.\n"
-        "Если чего-то не хватает — явно укажи, что именно.\n"
-    )
-
-    ctx = {
-        "query": state["query"],
-        "plan": state.get("plan", []),
-        "memory_hits": state.get("memory_hits", []),
-        "tool_context_tail": state.get("tool_context", [])[-8:],
-        "history_tail": state.get("history", [])[-4:],
-    }
+    llm = get_llm(temperature=0.2, node="conceptual_agent")
+    _record_model(state, "conceptual_agent", llm)
+    ctx = pack_context(state, "conceptual_agent")
 
     raw = llm.invoke([
-        SystemMessage(content=system),
-        HumanMessage(content=json.dumps(ctx, ensure_ascii=False))
+        SystemMessage(content=CONCEPTUAL_SYSTEM),
+        HumanMessage(content=render_json(ctx))
     ])
+    record_prompt_usage(state, "conceptual_agent", [raw])
     state["partial"] = _coerce_text(raw)
     return state
 
@@ -172,42 +278,21 @@ def conceptual_agent_node(state: MASState) -> MASState:
 def architecture_agent_node(state: MASState) -> MASState:
     add_node_log(state, "architecture_agent")
 
-    llm = get_llm(temperature=0.2)
-    system = (
-        "Ты — architecture-агент (архитектура/дизайн).\n"
-        "Сформируй ответ с блоками:\n"
-        "1) компоненты и роли агентов,\n"
-        "2) state поля,\n"
-        "3) handoff/маршрутизация,\n"
-        "4) tool calling,\n"
-        "5) memory management,\n"
-        "6) риски и улучшения.\n"
-        "Опирайся на plan + memory_hits + tool_context.\n"
-    )
-
-    ctx = {
-        "query": state["query"],
-        "plan": state.get("plan", []),
-        "memory_hits": state.get("memory_hits", []),
-        "tool_context_tail": state.get("tool_context", [])[-8:],
-        "history_tail": state.get("history", [])[-4:],
-    }
+    llm = get_llm(temperature=0.2, node="architecture_agent")
+    _record_model(state, "architecture_agent", llm)
+    ctx = pack_context(state, "architecture_agent")
 
     raw = llm.invoke([
-        SystemMessage(content=system),
-        HumanMessage(content=json.dumps(ctx, ensure_ascii=False))
+        SystemMessage(content=ARCHITECTURE_SYSTEM),
+        HumanMessage(content=render_json(ctx))
     ])
+    record_prompt_usage(state, "architecture_agent", [raw])
     state["partial"] = _coerce_text(raw)
     return state
 
 
-# Проверка похожести ответа от модели на код (нужно для кодингового агента)
-def _looks_like_code(text: str) -> bool:
-    t = (text or "")
-    if "```" in t:
-        return True
-    # Эвристики
-    return any(x in t for x in ["def ", "class ", "import ", "from ", "pip install", "```python"])
+# Сколько раз просим coding-агента исправить синтаксис в том же диалоге
+MAX_CODE_REPAIR_TURNS = 1
 
 
 # Кодинговый ответ
@@ -215,61 +300,45 @@ def coding_agent_node(state: MASState) -> MASState:
     add_node_log(state, "coding_agent")
 
     tools = TOOLS_CODING
-    prompt = ChatPromptTemplate.from_messages([
-        ("system",
-         "Ты — coding-агент.\n"
-         "Твоя задача: выдать ИСПОЛНИМЫЙ код.\n"
-         "Формат ответа ОБЯЗАТЕЛЕН:\n"
-         "1) Один кодовый блок ```python ... ``` (или ```bash``` если нужно)\n"
-         "2) Ниже 2–5 строк инструкции как запустить.\n"
-         "3) Обязательно напиши код по синтаксическим правилам написания кода. \n"
-         "Если не хватает данных — предположи разумные значения и отметь TODO в коде.\n"
-         "Инструменты: calc, search_user_notes, save_user_note.\n"
-         "Если полезно — сначала search_user_notes.\n"),
-        ("placeholder", "{messages}")
-    ])
-
-    user_msg = (
-        f"QUERY: {state['query']}\n"
-        f"PLAN: {state.get('plan', [])}\n"
-        f"MEMORY_HITS: {state.get('memory_hits', [])}\n"
-        f"TOOL_CONTEXT_TAIL: {state.get('tool_context', [])[-8:]}\n"
-        f"HISTORY_TAIL: {state.get('history', [])[-4:]}\n"
-    )
-
-    # 1-я попытка
-    llm = get_llm(temperature=0.0)
-    agent = create_react_agent(model=llm, tools=tools, prompt=prompt)
-    res = agent.invoke(
-        {"messages": [HumanMessage(content=user_msg)]},
-        config={"recursion_limit": 40, "configurable": {"thread_id": state["thread_id"]}}
-    )
-
-    # Логируем ответы интрументов
-    for m in res["messages"]:
-        if m.__class__.__name__.startswith("ToolMessage"):
-            content = getattr(m, "content", "")
-            add_tool_log(state, "tool_message", {"content": content})
-            state["tool_context"].append({"ts": now_iso(), "tool_message": content})
-
-    text = _coerce_text(res["messages"][-1])
-
-    # 2-я попытка, если кода нет
-    if not _looks_like_code(text):
-        llm2 = get_llm(temperature=0.4)
-        agent2 = create_react_agent(model=llm2, tools=tools, prompt=prompt)
-        res2 = agent2.invoke(
-            {"messages": [HumanMessage(
-                content=user_msg + "\n\nВАЖНО: верни ответ строго в формате: ```python``` + инструкции.")]},
-            config={"recursion_limit": 40, "configurable": {"thread_id": state["thread_id"]}}
-        )
-        for m in res2["messages"]:
+    user_msg = render_lines(pack_context(state, "coding_agent"))
+    # Без своего configurable: агент выполняется как вложенный подграф узла и наследует его namespace
+    # (по нему сервер понимает, чьи это токены)
+    config = {"recursion_limit": 40}
+
+    agent = get_react_agent("coding_agent", CODING_SYSTEM, tools, temperature=0.0)
+    _record_model(state, "coding_agent", agent_model_name("coding_agent"))
+    messages = agent.invoke({"messages": [HumanMessage(content=user_msg)]}, config=config)["messages"]
+    seen = 0
+
+    repair_turns = 0
+    while True:
+        record_prompt_usage(state, "coding_agent", messages[seen:])
+        # Логируем ответы интрументов (только новые сообщения диалога)
+        for m in messages[seen:]:
             if m.__class__.__name__.startswith("ToolMessage"):
                 content = getattr(m, "content", "")
-                add_tool_log(state, "tool_message", {"content": content})
-                state["tool_context"].append({"ts": now_iso(), "tool_message": content})
-        text = _coerce_text(res2["messages"][-1])
+                _log_tool_message(state, content, getattr(m, "name", None))
+                add_tool_context(state, content, getattr(m, "name", None))
+        seen = len(messages)
+
+        text = _coerce_text(messages[-1])
+
+        # Проверяем синтаксис блоков кода локально (ast.parse / bash -n)
+        errors = check_code_blocks(text)
+        add_trace(state, "code_check", {"errors": errors, "repair_turn": repair_turns})
+        if not errors or repair_turns >= MAX_CODE_REPAIR_TURNS:
+            break
+
+        # Одна уточняющая реплика в том же диалоге с конкретной ошибкой
+        repair_turns += 1
+        fix_msg = (
+            "Проверка синтаксиса не прошла:\n"
+            + "\n".join(f"- {e}" for e in errors)
+            + "\nИсправь ошибки и верни ответ целиком в том же формате: блок кода + инструкции."
+        )
+        messages = agent.invoke({"messages": list(messages) + [HumanMessage(content=fix_msg)]}, config=config)["messages"]
 
+    state["code_repair_turns"] = repair_turns
     state["partial"] = text
     return state
 
@@ -279,38 +348,22 @@ def daily_agent_node(state: MASState) -> MASState:
     add_node_log(state, "daily_agent")
 
     tools = TOOLS_DAILY
-    llm = get_llm(temperature=0.0)
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system",
-         "Ты — daily-агент (повседневные задачи).\n"
-         "Инструменты: days_until, calc, search_user_notes, save_user_note.\n"
-         "Если есть дата/дедлайн — days_until.\n"
-         "Если есть расчёты — calc.\n"
-         "Если выдаёшь полезный план/чеклист — сохрани save_user_note.\n"),
-        ("placeholder", "{messages}")
-    ])
-
-    agent = create_react_agent(model=llm, tools=tools, prompt=prompt)
+    agent = get_react_agent("daily_agent", DAILY_SYSTEM, tools, temperature=0.0)
+    _record_model(state, "daily_agent", agent_model_name("daily_agent"))
 
-    user_msg = (
-        f"QUERY: {state['query']}\n"
-        f"PLAN: {state.get('plan', [])}\n"
-        f"MEMORY_HITS: {state.get('memory_hits', [])}\n"
-        f"TOOL_CONTEXT_TAIL: {state.get('tool_context', [])[-8:]}\n"
-        f"HISTORY_TAIL: {state.get('history', [])[-4:]}\n"
-    )
+    user_msg = render_lines(pack_context(state, "daily_agent"))
 
     res = agent.invoke(
         {"messages": [HumanMessage(content=user_msg)]},
-        config={"recursion_limit": 40, "configurable": {"thread_id": state["thread_id"]}}
+        config={"recursion_limit": 40}
     )
+    record_prompt_usage(state, "daily_agent", res["messages"])
 
     for m in res["messages"]:
         if m.__class__.__name__.startswith("ToolMessage"):
             content = getattr(m, "content", "")
-            add_tool_log(state, "tool_message", {"content": content})
-            state["tool_context"].append({"ts": now_iso(), "tool_message": content})
+            _log_tool_message(state, content, getattr(m, "name", None))
+            add_tool_context(state, content, getattr(m, "name", None))
 
     state["partial"] = _coerce_text(res["messages"][-1])
     return state
@@ -321,40 +374,22 @@ def literature_agent_node(state: MASState) -> MASState:
     add_node_log(state, "literature_agent")
 
     tools = TOOLS_LITERATURE
-    llm = get_llm(temperature=0.0)
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system",
-         "Ты — literature-агент.\n"
-         "Сформируй:\n"
-         "1) 5–10 поисковых запросов (лучше на английском)\n"
-         "2) критерии отбора статей\n"
-         "3) структуру обзора\n"
-         "Инструменты: search_user_notes, save_user_note.\n"
-         "Если есть полезные выводы — сохрани заметку.\n"),
-        ("placeholder", "{messages}")
-    ])
+    agent = get_react_agent("literature_agent", LITERATURE_SYSTEM, tools, temperature=0.0)
+    _record_model(state, "literature_agent", agent_model_name("literature_agent"))
 
-    agent = create_react_agent(model=llm, tools=tools, prompt=prompt)
-
-    user_msg = (
-        f"QUERY: {state['query']}\n"
-        f"PLAN: {state.get('plan', [])}\n"
-        f"MEMORY_HITS: {state.get('memory_hits', [])}\n"
-        f"TOOL_CONTEXT_TAIL: {state.get('tool_context', [])[-8:]}\n"
-        f"HISTORY_TAIL: {state.get('history', [])[-4:]}\n"
-    )
+    user_msg = render_lines(pack_context(state, "literature_agent"))
 
     res = agent.invoke(
         {"messages": [HumanMessage(content=user_msg)]},
-        config={"recursion_limit": 40, "configurable": {"thread_id": state["thread_id"]}}
+        config={"recursion_limit": 40}
     )
+    record_prompt_usage(state, "literature_agent", res["messages"])
 
     for m in res["messages"]:
         if m.__class__.__name__.startswith("ToolMessage"):
             content = getattr(m, "content", "")
-            add_tool_log(state, "tool_message", {"content": content})
-            state["tool_context"].append({"ts": now_iso(), "tool_message": content})
+            _log_tool_message(state, content, getattr(m, "name", None))
+            add_tool_context(state, content, getattr(m, "name", None))
 
     state["partial"] = _coerce_text(res["messages"][-1])
     return state
@@ -364,65 +399,130 @@ def literature_agent_node(state: MASState) -> MASState:
 def reviewer_node(state: MASState) -> MASState:
     add_node_log(state, "reviewer")
 
-    parser = PydanticOutputParser(pydantic_object=ReviewDecision)
-
-    system = (
-        "Ты — reviewer.\n"
-        "Проверь: хватает ли информации для хорошего ответа.\n"
-        "Если НЕ хватает: need_more=true и в focus напиши ЧТО добрать через инструменты.\n"
-        "Если хватает: need_more=false и improved_answer содержит улучшенную версию (или пусто).\n"
-        "Ответ строго JSON.\n"
-        f"{parser.get_format_instructions()}"
+    # Быстрый путь: очевидно хороший или очевидно неполный черновик решаем без LLM
+    gate = run_gates(state) if REVIEW_GATES in ("1", "shadow") else None
+    if gate is not None and REVIEW_GATES == "1":
+        need_more = gate["need_more"] and state["round"] < state["max_rounds"]
+        state["need_more"] = need_more
+        state["focus"] = gate["focus"] if need_more else ""
+        state["focus_items"] = []
+        _record_model(state, "reviewer", f"gate:{gate['gate']}")
+        return state
+
+    ctx = pack_context(
+        state,
+        "reviewer",
+        extra={
+            "intent": state["intent"],
+            "draft": state["partial"],
+            "round": state["round"],
+            "max_rounds": state["max_rounds"],
+        },
+        history=0,
     )
 
-    ctx = {
-        "query": state["query"],
-        "intent": state["intent"],
-        "plan": state["plan"],
-        "draft": state["partial"],
-        "tool_context_tail": state["tool_context"][-8:],
-        "memory_hits": state["memory_hits"],
-        "round": state["round"],
-        "max_rounds": state["max_rounds"],
-    }
-
     def make_llm(temp: float):
-        return get_llm(temperature=temp)
+        return get_llm(temperature=temp, node="reviewer")
 
-    decision: ReviewDecision = invoke_with_parser_retry(
+    # Маршрут решает need_more (первое поле), focus/improved_answer заберут gather_tools/finalize
+    decision = StreamedDecision(
         make_llm=make_llm,
         messages=[
-            SystemMessage(content=system),
-            HumanMessage(content=json.dumps(ctx, ensure_ascii=False)),
+            SystemMessage(content=REVIEWER_SYSTEM),
+            HumanMessage(content=render_json(ctx)),
         ],
-        parser=parser,
+        parser=REVIEWER_PARSER,
         max_retries=3,
         temps=(0.0, 0.4, 0.8),
+        escalate_llm=_escalation_llm("reviewer"),
     )
+    _record_model(state, "reviewer", get_llm(node="reviewer"))
+    need_more = decision.wait_field("need_more")
+    if not isinstance(need_more, bool):
+        need_more = decision.result().need_more
+
+    # Теневой режим: решение правил рядом с решением LLM (для оценки точности правил)
+    if gate is not None:
+        add_trace(state, "review_gate_audit", {
+            "gate": gate["gate"], "gate_need_more": gate["need_more"], "llm_need_more": need_more})
 
     # Ограничение по числу циклов
     if state["round"] >= state["max_rounds"]:
-        decision.need_more = False
-
-    state["need_more"] = decision.need_more
-    state["focus"] = (decision.focus or "").strip()
+        need_more = False
 
-    if (not decision.need_more) and decision.improved_answer.strip():
-        state["partial"] = decision.improved_answer.strip()
+    state["need_more"] = need_more
+    state["focus"] = ""
+    state["focus_items"] = []
+    defer_decision(state["thread_id"], "reviewer", decision)
 
     return state
 
 
+# Сколько пунктов focus добираем параллельно за один раунд (остальные — в следующем раунде через focus)
+MAX_FOCUS_ITEMS = 4
+
+
+def _focus_items(items: Any) -> List[str]:
+    out: List[str] = []
+    for item in items if isinstance(items, list) else []:
+        text = _coerce_text(item).strip()
+        if text and text.lower() not in (o.lower() for o in out):
+            out.append(text)
+    return out[:MAX_FOCUS_ITEMS]
+
+
+# Забираем поля ответа reviewer, которые дописывались в фоне
+# (при need_more ответ может еще дописываться — решение возвращается, чтобы учесть токены позже)
+def _apply_reviewer_decision(state: MASState) -> Optional[StreamedDecision]:
+    decision = pop_decision(state["thread_id"], "reviewer")
+    if decision is None:
+        return None
+    if state.get("need_more"):
+        state["focus"] = (decision.wait_field("focus") or "").strip()
+        state["focus_items"] = _focus_items(decision.wait_field("focus_items"))
+        return decision
+    improved = (decision.result().improved_answer or "").strip()
+    if improved:
+        state["partial"] = improved
+    _record_decision_usage(state, "reviewer", decision)
+    return None
+
+
+# Дописываем reasoning роутера в handoff_log
+def _apply_router_decision(state: MASState) -> None:
+    decision = pop_decision(state["thread_id"], "router")
+    if decision is None:
+        return
+    try:
+        reasoning = decision.result().reasoning
+    except Exception:
+        return
+    _record_decision_usage(state, "router", decision)
+    entry = f"[handoff] router -> {state['intent']}"
+    for i in range(len(state["handoff_log"]) - 1, -1, -1):
+        if state["handoff_log"][i] == entry:
+            state["handoff_log"][i] = f"{entry} | {reasoning}"
+            break
+
+
 def route_after_reviewer(state: MASState) -> str:
     return "gather_tools" if state.get("need_more") else "finalize"
 
 
 def finalize_node(state: MASState) -> MASState:
     add_node_log(state, "finalize")
+    _apply_reviewer_decision(state)
+    _apply_router_decision(state)
 
     state["final_answer"] = (state["partial"] or "").strip()
+
+    # Итог кэша инструментов за прогон (сколько повторных вызовов не выполнялись); по каждому вызову —
+    # флаг cached у ответа инструмента в tool_calls
+    cache = current_tool_cache()
+    if cache is not None:
+        add_trace(state, "tool_cache", cache.stats())
     add_history(state, "assistant", state["final_answer"])
-    trim_history(state)
+    fold_history(state)
 
     if state["memory_hits"]:
         state["memory_summary"] = "Использованы заметки: " + "; ".join(
@@ -437,6 +537,104 @@ def route_after_planner(state: MASState) -> str:
     return state.get("intent") or "daily"
 
 
+def _gather_tools_for(intent: Optional[str]) -> List[Any]:
+    if intent == "coding":
+        return TOOLS_CODING
+    if intent == "daily":
+        return TOOLS_DAILY
+    if intent == "literature":
+        return TOOLS_LITERATURE
+    return [search_user_notes, save_user_note]
+
+
+# Один проход ReAct-агента добора по focus. state только читается (в ветках fan-out это срез state из Send),
+# результат применяется к state через _apply_gather
+def _run_gather(state: Dict[str, Any], focus: str) -> Dict[str, Any]:
+    # Испольщуем create_react_agent из примера мультиагентной системы (собирается один раз, см. agents.py)
+    agent = get_react_agent("gather_tools", GATHER_SYSTEM, _gather_tools_for(state.get("intent")), temperature=0.1)
+
+    user_msg = render_lines(pack_context(
+        state,
+        "gather_tools",
+        extra={
+            # Тип вопроса от пользователя
+            "intent": state.get("intent"),
+            # Какую информацию нужно дособрать
+            "focus": focus,
+            # Итеративный процесс
+            "round": f"{state.get('round', 0)} / {state.get('max_rounds', 3)}",
+        },
+        # Какие результаты у интрументов уже были
+        tool_context=5,
+        history=0,
+    ))
+
+    res = agent.invoke(
+        {"messages": [HumanMessage(content=user_msg)]},
+        config={"recursion_limit": 30}
+    )
+    return {
+        "id": f"{state.get('round', 0)}:{focus}",
+        "focus": focus,
+        "tool_messages": [
+            {"tool": getattr(m, "name", None), "content": getattr(m, "content", ""),
+             "cached": tool_result_cached(getattr(m, "name", None), getattr(m, "content", ""))}
+            for m in res["messages"] if m.__class__.__name__.startswith("ToolMessage")
+        ],
+        "summary": _coerce_text(res["messages"][-1]),
+        "prompt_usage": prompt_usage_entries("gather_tools", res["messages"]),
+    }
+
+
+def _tool_payload(content: Any, cached: Optional[bool]) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {"content": content}
+    if cached is not None:
+        payload["cached"] = cached
+    return payload
+
+
+# Ответ инструмента в лог прогона; cached — взят ли он из кэша инструментов (None — кэш не включен)
+def _log_tool_message(state: MASState, content: Any, tool: Optional[str]) -> None:
+    add_tool_log(state, "tool_message", _tool_payload(content, tool_result_cached(tool, content)))
+
+
+# Результат добора -> tool_log, tool_context (повторы одного и того же вывода не дублируются), tool_calls
+def _apply_gather(state: MASState, result: Dict[str, Any], node: str = "gather_tools") -> None:
+    state.setdefault("tool_calls", [])
+    state.setdefault("tool_context", [])
+
+    # Сохраняем результаты инструментов
+    for m in result["tool_messages"]:
+        content = m["content"]
+        add_tool_log(state, "tool_message", _tool_payload(content, m.get("cached")))
+
+        add_tool_context(state, content, m["tool"])
+        state["tool_calls"].append({
+            "ts": now_iso(),
+            "node": node,
+            "type": "ToolMessage",
+            "payload": {"content": content},
+        })
+
+    # Сообщение агента
+    entry = {"ts": now_iso(), "gather_summary": result["summary"]}
+    if node != "gather_tools":
+        entry["focus"] = result["focus"]
+    state["tool_context"].append(entry)
+    state.setdefault("prompt_usage", []).extend(result["prompt_usage"])
+
+
+# Ответ reviewer к этому моменту дописан — учитываем его модель и токены
+def _finish_review(state: MASState, review: Optional[StreamedDecision]) -> None:
+    if review is None:
+        return
+    try:
+        review.result()
+    except Exception:
+        pass
+    _record_decision_usage(state, "reviewer", review)
+
+
 def gather_tools_node(state: MASState) -> MASState:
     """
     gather_tools – агент добора информации через инструменты
@@ -444,86 +642,70 @@ def gather_tools_node(state: MASState) -> MASState:
     Роль в системе:
     - Это узел, который через ReAct tool calling добирает недостающую информацию перед основным ответом
     - Узел используется также как часть цикла улучшения: reviewer может вернуть approved=False + focus, после чего мы снова заходим в gather_tools_node, чтобы добрать контекст
+    - Если reviewer вернул несколько независимых focus_items, добор по ним идет параллельно
+      (route_after_gather -> gather_item x N -> gather_merge), а этот узел только передает решение ревьюера дальше
     """
     add_node_log(state, "gather_tools")
+    review = _apply_reviewer_decision(state)
+    _record_model(state, "gather_tools", agent_model_name("gather_tools"))
 
-    if state["intent"] == "coding":
-        tools = TOOLS_CODING
-    elif state["intent"] == "daily":
-        tools = TOOLS_DAILY
-    elif state["intent"] == "literature":
-        tools = TOOLS_LITERATURE
-    else:
-        tools = [search_user_notes, save_user_note]
-
-    llm = get_llm(temperature=0.1)
-    prompt = ChatPromptTemplate.from_messages([
-        ("system",
-         "Ты — агент добора информации через инструменты.\n"
-         "Твоя задача — добрать недостающие данные, следуя focus.\n"
-         "Всегда начинай с поиска в заметках (search_user_notes), если это уместно.\n"
-         "Используй инструменты строго по необходимости.\n"
-         "После добора кратко резюмируй, что нашёл.\n"),
-        ("placeholder", "{messages}")
-    ])
-
-    # Испольщуем create_react_agent из примера мультиагентной системы
-    agent = create_react_agent(model=llm, tools=tools, prompt=prompt)
-
-    user_msg = (
-        # Запрос
-        f"QUERY: {state['query']}\n"
+    items = state.get("focus_items") or []
+    if len(items) > 1:
+        if review is not None:
+            defer_decision(state["thread_id"], "reviewer", review)
+        return state
 
-        # Тип вопроса от пользователя
-        f"INTENT: {state['intent']}\n"
+    # Один пункт focus_items при пустом focus — это и есть focus
+    state["focus"] = state.get("focus") or (items[0] if items else "")
+    _apply_gather(state, _run_gather(state, state["focus"]))
 
-        # План
-        f"PLAN: {state['plan']}\n"
-
-        # Какую информацию нужно дособрать 
-        f"FOCUS: {state.get('focus', '')}\n"
+    # Счетчик итераций
+    """
+    Нужно для остановки цикла
+    Была ошибка, что модель зацикливалась, поэтому добавила
+    """
+    state["round"] = int(state.get("round", 0)) + 1
 
-        # Информация, которая есть в памяти
-        f"MEMORY_HITS: {state.get('memory_hits', [])}\n"
+    _finish_review(state, review)
+    return state
 
-        # Какие результаты у интрументов уже были
-        f"TOOL_CONTEXT_TAIL: {state.get('tool_context', [])[-5:]}\n"
 
-        # Итеративный процесс
-        f"ROUND: {state.get('round', 0)} / {state.get('max_rounds', 3)}\n"
-    )
+# Поля state, которые нужны подзадаче добора (в Send уходит срез, а не весь state)
+GATHER_ITEM_FIELDS = ("query", "intent", "plan", "memory_hits", "tool_context", "round", "max_rounds", "thread_id")
 
-    res = agent.invoke(
-        {"messages": [HumanMessage(content=user_msg)]},
-        config={"recursion_limit": 30, "configurable": {"thread_id": state["thread_id"]}}
-    )
 
-    state.setdefault("tool_calls", [])
-    state.setdefault("tool_context", [])
+def route_after_gather(state: MASState):
+    items = state.get("focus_items") or []
+    if len(items) > 1:
+        base = {k: state.get(k) for k in GATHER_ITEM_FIELDS}
+        return [Send("gather_item", {**base, "focus": item}) for item in items]
+    return state.get("intent") or "daily"
 
-    # Сохраняем результаты инструментов
-    for m in res["messages"]:
-        if m.__class__.__name__.startswith("ToolMessage"):
-            content = getattr(m, "content", "")
-            add_tool_log(state, "tool_message", {"content": content})
 
-            state["tool_context"].append({"ts": now_iso(), "tool_message": content})
-            state["tool_calls"].append({
-                "ts": now_iso(),
-                "node": "gather_tools",
-                "type": "ToolMessage",
-                "payload": {"content": content},
-            })
+def gather_item_node(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Подзадача fan-out: добор по одному пункту focus. Пишет только в gather_results (сливается редьюсером)
+    """
+    return {"gather_results": [_run_gather(item, item["focus"])]}
 
-    # Сообщение агента
-    summary = _coerce_text(res["messages"][-1])
-    state["tool_context"].append({"ts": now_iso(), "gather_summary": summary})
 
-    # Счетчик итераций
+def gather_merge_node(state: MASState) -> MASState:
     """
-    Нужно для остановки цикла
-    Была ошибка, что модель зацикливалась, поэтому добавила
+    Сводит результаты параллельного добора в tool_context; весь fan-out считается одним раундом для max_rounds
     """
+    add_node_log(state, "gather_merge")
+    results = state.get("gather_results") or []
+    for result in results:
+        _apply_gather(state, result, node="gather_item")
+
+    add_trace(state, "gather_fanout", {
+        "round": state.get("round", 0),
+        "items": [r["focus"] for r in results],
+        "tool_messages": sum(len(r["tool_messages"]) for r in results),
+    })
     state["round"] = int(state.get("round", 0)) + 1
+    state["focus_items"] = []
+    state["gather_results"] = None
 
+    _finish_review(state, pop_decision(state["thread_id"], "reviewer"))
     return state
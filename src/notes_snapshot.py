@@ -0,0 +1,416 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .config import NOTES_PATH, NOTES_SNAPSHOT_PATH
+from .memory_store import load_notes, simple_retrieve_notes
+
+
+"""
+Бинарный снапшот заметок только для чтения
+Каждый процесс, который делает load_notes(), держит свою копию всех заметок в dict-ах Python.
+Снапшот читается через mmap без копирования: все процессы делят одну копию файла в page cache,
+разбирается только то, что вернул поиск.
+
+Формат (little-endian, секции выровнены по 8 байт):
+- заголовок: MAGIC, версия, число заметок и термов, хэш байтов json, из которых собран снапшот,
+  смещения секций;
+- notes: таблица смещений (n + 1, u64) и JSON каждой заметки подряд (utf-8);
+- terms: отсортированные токены заметок через "\\n" и таблица их смещений (m + 1, u32);
+- postings: таблица смещений (m + 1, u32) и номера заметок по каждому токену (u32, по возрастанию).
+
+Поиск совпадает с simple_retrieve_notes: токен запроса ищется как подстрока, но не по текстам заметок,
+а по словарю токенов (mmap.find), заметки находятся через postings.
+Снапшот пересобирается, когда меняется json: заметки и хэш берутся из одних и тех же байтов, поэтому
+снапшот старых заметок не может получить отметку нового файла (параллельная пересборка в другом процессе). Хэш json
+пересчитывается, только когда меняются mtime_ns/размер файла. Запись — во временный файл и os.replace,
+читатели видят либо старый, либо новый снапшот целиком.
+
+Бенчмарк против json (RSS/PSS процессов и холодная загрузка):
+    python -m src.notes_snapshot bench --notes 50000 --procs 4
+"""
+
+MAGIC = b"MASNOTE1"
+VERSION = 2
+# magic, version, n_notes, n_terms, хэш json (blake2b, 16 байт), 6 смещений секций
+HEADER = struct.Struct("<8sIII16s6Q")
+
+# Токены как в simple_retrieve_notes: токен запроса (>= 3 символов из этого класса) — подстрока
+# текста заметки, значит он целиком лежит внутри одного такого слова длиной >= 3
+_WORD_RE = re.compile(r"[a-zа-я0-9]{3,}")
+
+
+def _searchable(note: Dict[str, Any]) -> str:
+    return (note.get("text", "") + " " + " ".join(note.get("tags", []))).lower()
+
+
+def _align(buf: bytearray) -> int:
+    buf.extend(b"\0" * (-len(buf) % 8))
+    return len(buf)
+
+
+def _le(arr: array) -> bytes:
+    if sys.byteorder != "little":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _source_stamp(json_path: str) -> Tuple[int, int]:
+    try:
+        st = os.stat(json_path)
+    except OSError:
+        return 0, 0
+    return st.st_mtime_ns, st.st_size
+
+
+def content_digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _read_source(json_path: str) -> bytes:
+    try:
+        with open(json_path, "rb") as f:
+            return f.read()
+    except OSError:
+        return b""
+
+
+# Разбор как в load_notes (битый или чужой json — пустой список)
+def _parse_notes(data: bytes) -> List[Dict[str, Any]]:
+    try:
+        notes = json.loads(data) if data else []
+    except ValueError:
+        return []
+    return notes if isinstance(notes, list) else []
+
+
+def build_snapshot(notes: List[Dict[str, Any]], path: str, digest: bytes = b"") -> None:
+    """
+    Пишет снапшот notes в path атомарно (временный файл в том же каталоге + os.replace)
+    """
+    postings: Dict[str, List[int]] = {}
+    note_offsets = array("Q", [0])
+    note_data = bytearray()
+    for i, note in enumerate(notes):
+        note_data += json.dumps(note, ensure_ascii=False).encode("utf-8")
+        note_offsets.append(len(note_data))
+        for term in set(_WORD_RE.findall(_searchable(note))):
+            postings.setdefault(term, []).append(i)
+
+    terms = sorted(postings)
+    term_offsets = array("I")
+    term_data = bytearray()
+    post_offsets = array("I", [0])
+    post_ids = array("I")
+    for term in terms:
+        term_offsets.append(len(term_data))
+        term_data += term.encode("utf-8") + b"\n"
+        post_ids.extend(postings[term])
+        post_offsets.append(len(post_ids))
+    term_offsets.append(len(term_data))
+
+    buf = bytearray(HEADER.size)
+    sections = []
+    for part in (_le(note_offsets), note_data, _le(term_offsets), term_data, _le(post_offsets), _le(post_ids)):
+        sections.append(_align(buf))
+        buf += part
+    HEADER.pack_into(buf, 0, MAGIC, VERSION, len(notes), len(terms), digest, *sections)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".notes_snap_", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(buf)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+class NotesSnapshot:
+    """
+    Снапшот, открытый через mmap. Таблицы — memoryview поверх mmap (без копирования)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < HEADER.size:
+            self._mm.close()
+            raise ValueError(f"{path}: не снапшот заметок")
+        magic, version, self.n_notes, self.n_terms, self.digest, *sections = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or sys.byteorder != "little":
+            self._mm.close()
+            raise ValueError(f"{path}: не снапшот заметок версии {VERSION}")
+
+        note_offsets, self._note_data, term_offsets, self._term_data, post_offsets, post_ids = sections
+        view = memoryview(self._mm)
+        self._note_offsets = view[note_offsets:note_offsets + 8 * (self.n_notes + 1)].cast("Q")
+        self._term_offsets = view[term_offsets:term_offsets + 4 * (self.n_terms + 1)].cast("I")
+        self._post_offsets = view[post_offsets:post_offsets + 4 * (self.n_terms + 1)].cast("I")
+        self._post_ids = view[post_ids:post_ids + 4 * self._post_offsets[self.n_terms]].cast("I")
+
+    def __len__(self) -> int:
+        return self.n_notes
+
+    def note(self, i: int) -> Dict[str, Any]:
+        start = self._note_data + self._note_offsets[i]
+        end = self._note_data + self._note_offsets[i + 1]
+        return json.loads(self._mm[start:end])
+
+    def notes(self) -> Iterator[Dict[str, Any]]:
+        for i in range(self.n_notes):
+            yield self.note(i)
+
+    # Номера термов, в которые token входит подстрокой (поиск по словарю прямо в mmap)
+    def _terms_containing(self, token: bytes) -> Iterator[int]:
+        base = self._term_data
+        end = base + self._term_offsets[self.n_terms]
+        pos = self._mm.find(token, base, end)
+        while pos != -1:
+            term = bisect_right(self._term_offsets, pos - base) - 1
+            yield term
+            pos = self._mm.find(token, base + self._term_offsets[term + 1], end)
+
+    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """
+        То же, что simple_retrieve_notes(все заметки, query, k): score — сколько токенов запроса есть в заметке
+        """
+        tokens = set(re.findall(r"[a-zа-я0-9]{3,}", (query or "").lower()))
+        scores: Counter = Counter()
+        for token in tokens:
+            ids = set()
+            for term in self._terms_containing(token.encode("utf-8")):
+                ids.update(self._post_ids[self._post_offsets[term]:self._post_offsets[term + 1]])
+            scores.update(ids)
+        # Порядок как у устойчивой сортировки по score: при равенстве — порядок заметок в файле
+        top = sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:k]
+        return [self.note(i) for i, _ in top]
+
+
+# Открытые снапшоты процесса: путь снапшота -> (mtime_ns/размер json, при которых он сверен, снапшот)
+_OPEN: Dict[str, Tuple[Tuple[int, int], NotesSnapshot]] = {}
+_LOCK = threading.Lock()
+
+
+def rebuild_snapshot(json_path: Optional[str] = None, snap_path: Optional[str] = None,
+                     notes: Optional[List[Dict[str, Any]]] = None, data: Optional[bytes] = None) -> NotesSnapshot:
+    """
+    Пересобирает снапшот json_path. data — уже прочитанные байты json,
+    notes — они же разобранные; отметка снапшота всегда считается по тем байтам, из которых взяты заметки
+    """
+    json_path = json_path or NOTES_PATH
+    snap_path = snap_path or NOTES_SNAPSHOT_PATH
+    if data is None:
+        data = _read_source(json_path)
+        notes = None
+    build_snapshot(_parse_notes(data) if notes is None else notes, snap_path, content_digest(data))
+    return NotesSnapshot(snap_path)
+
+
+def open_snapshot(json_path: Optional[str] = None, snap_path: Optional[str] = None) -> NotesSnapshot:
+    """
+    Актуальный снапшот для json_path. На каждый вызов — только os.stat json; если json изменился,
+    его хэш сверяется с снапшотом на диске (его уже мог пересобрать другой процесс), при расхождении — пересборка
+    """
+    json_path = json_path or NOTES_PATH
+    snap_path = snap_path or NOTES_SNAPSHOT_PATH
+    stamp = _source_stamp(json_path)
+    cached = _OPEN.get(snap_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    with _LOCK:
+        cached = _OPEN.get(snap_path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        # stat до чтения: если файл поменяется после, следующий вызов увидит новый stat и сверит заново
+        data = _read_source(json_path)
+        try:
+            snap: Optional[NotesSnapshot] = NotesSnapshot(snap_path)
+        except (OSError, ValueError):
+            snap = None
+        if snap is None or snap.digest != content_digest(data):
+            snap = rebuild_snapshot(json_path, snap_path, data=data)
+        # Старый снапшот не закрываем: его еще могут читать другие потоки, mmap освободится сборщиком
+        _OPEN[snap_path] = (stamp, snap)
+        return snap
+
+
+# Память процесса в МБ из /proc/self/smaps_rollup: rss и pss (общие страницы делятся между процессами)
+def _proc_memory_mb() -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    out[key.lower()] = int(value.split()[0]) / 1024
+    except OSError:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        out = {"rss": rss, "pss": rss}
+    return out
+
+
+# Убираем файл из page cache (для холодной загрузки), если ОС это умеет
+def _drop_page_cache(path: str) -> None:
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _bench_reader(mode: str, json_path: str, snap_path: str, queries: List[str], barrier: Any, results: Any) -> None:
+    before = _proc_memory_mb()
+    t0 = time.perf_counter()
+    if mode == "json":
+        notes = load_notes(json_path)
+
+        def search(q: str):
+            return simple_retrieve_notes(notes, q, k=5)
+    else:
+        snap = open_snapshot(json_path, snap_path)
+
+        def search(q: str):
+            return snap.search(q, k=5)
+    search(queries[0])
+    cold_ms = (time.perf_counter() - t0) * 1000
+
+    t1 = time.perf_counter()
+    for q in queries:
+        search(q)
+    search_ms = (time.perf_counter() - t1) * 1000 / len(queries)
+
+    # PSS меряем, когда живы все читатели — только тогда общие страницы делятся между ними
+    barrier.wait()
+    after = _proc_memory_mb()
+    results.put({
+        "mode": mode,
+        "cold_load_ms": round(cold_ms, 2),
+        "search_ms": round(search_ms, 3),
+        "rss_mb": round(after["rss"] - before["rss"], 2),
+        "pss_mb": round(after["pss"] - before["pss"], 2),
+    })
+    barrier.wait()
+
+
+def _bench_notes(n: int) -> List[Dict[str, Any]]:
+    words = ["langgraph", "router", "память", "штрудель", "дедлайн", "python", "обзор", "reviewer",
+             "checkpoint", "агент", "инструмент", "планировщик", "кэш", "снапшот", "воркер", "очередь"]
+    return [
+        {"ts": "2025-01-01T00:00:00",
+         "text": f"Заметка {i}: " + " ".join(words[(i * p) % len(words)] for p in (1, 3, 5, 7)) + f" id{i}",
+         "tags": [words[i % len(words)]]}
+        for i in range(n)
+    ]
+
+
+def bench(notes: int, procs: int, queries: int) -> Dict[str, Any]:
+    """
+    procs процессов-читателей для json и для снапшота: холодная загрузка (загрузка + первый поиск),
+    средний поиск, прирост RSS и PSS на процесс
+    """
+    import multiprocessing
+    import statistics
+
+    directory = tempfile.mkdtemp(prefix="mas_snap_bench_")
+    json_path = os.path.join(directory, "notes.json")
+    snap_path = json_path + ".snap"
+    data = _bench_notes(notes)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    t0 = time.perf_counter()
+    rebuild_snapshot(json_path, snap_path)
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    qs = [f"langgraph {w} память id{i * 7}" for i, w in enumerate(["router", "агент", "кэш", "очередь"] * (queries // 4 + 1))][:queries]
+    ctx = multiprocessing.get_context("spawn")
+    report: Dict[str, Any] = {
+        "notes": notes, "procs": procs,
+        "json_mb": round(os.path.getsize(json_path) / 2 ** 20, 2),
+        "snapshot_mb": round(os.path.getsize(snap_path) / 2 ** 20, 2),
+        "snapshot_build_ms": round(build_ms, 1),
+    }
+    for mode in ("json", "snapshot"):
+        _drop_page_cache(json_path)
+        _drop_page_cache(snap_path)
+        barrier = ctx.Barrier(procs + 1)
+        results = ctx.Queue()
+        workers = [ctx.Process(target=_bench_reader, args=(mode, json_path, snap_path, qs, barrier, results))
+                   for _ in range(procs)]
+        for p in workers:
+            p.start()
+        barrier.wait()
+        rows = [results.get() for _ in workers]
+        barrier.wait()
+        for p in workers:
+            p.join()
+        report[mode] = {
+            key: round(statistics.fmean(r[key] for r in rows), 3)
+            for key in ("cold_load_ms", "search_ms", "rss_mb", "pss_mb")
+        }
+        report[mode]["pss_total_mb"] = round(sum(r["pss_mb"] for r in rows), 2)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Бинарный снапшот заметок (mmap)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p_build = sub.add_parser("build", help="пересобрать снапшот по json")
+    p_build.add_argument("--notes-path", default=NOTES_PATH)
+    p_build.add_argument("--snapshot-path", default=None)
+
+    p_bench = sub.add_parser("bench", help="сравнить с json: RSS/PSS и холодная загрузка в нескольких процессах")
+    p_bench.add_argument("--notes", type=int, default=50000)
+    p_bench.add_argument("--procs", type=int, default=4)
+    p_bench.add_argument("--queries", type=int, default=50)
+    p_bench.add_argument("--json", default="", help="сохранить отчет в файл")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "build":
+        snap_path = args.snapshot_path or (args.notes_path + ".snap")
+        rebuild_snapshot(json_path=args.notes_path, snap_path=snap_path)
+        snap = NotesSnapshot(snap_path)
+        print(f"{snap_path}: {len(snap)} заметок, {snap.n_terms} токенов, {os.path.getsize(snap_path)} байт")
+        return 0
+
+    report = bench(args.notes, args.procs, args.queries)
+    print(f"заметок: {report['notes']}, процессов: {report['procs']}, json {report['json_mb']} МБ, "
+          f"снапшот {report['snapshot_mb']} МБ (сборка {report['snapshot_build_ms']} мс)")
+    print(f"{'':<10} {'cold_load_ms':>13} {'search_ms':>10} {'rss_mb':>8} {'pss_mb':>8} {'pss_total_mb':>13}")
+    for mode in ("json", "snapshot"):
+        r = report[mode]
+        print(f"{mode:<10} {r['cold_load_ms']:>13} {r['search_ms']:>10} {r['rss_mb']:>8} {r['pss_mb']:>8} {r['pss_total_mb']:>13}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
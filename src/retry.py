@@ -1,11 +1,21 @@
 from __future__ import annotations
 
-from typing import Any, List, Optional, Tuple
+import contextlib
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage
 from langchain_core.output_parsers import PydanticOutputParser
 
-from .utils import _coerce_text, _extract_json
+from .config import llm_model_name
+from .utils import IncrementalJSONParser, _coerce_text, _extract_json
+
+
+RETRY_HINT = (
+    "ВАЖНО: верни ТОЛЬКО JSON без пояснений, без markdown, без лишнего текста.\n"
+    "Даже если не уверен — верни валидный JSON по схеме.\n"
+)
 
 
 # PydanticOutputParser
@@ -16,6 +26,8 @@ def invoke_with_parser_retry(
         parser: PydanticOutputParser,
         max_retries: int = 3,
         temps: Tuple[float, ...] = (0.1, 0.2, 0.3),
+        escalate_llm=None,
+        on_response=None,
 ) -> Any:
     """
     - make_llm: функция вида make_llm(temp) -> LLM. Нужна, чтобы удобно менять температуру на каждой попытке
@@ -23,38 +35,182 @@ def invoke_with_parser_retry(
     - parser: PydanticOutputParser, который знает целевую схему ответа
     - max_retries: максимальное число попыток (ограничиваем до 3х по заданию)
     - temps: набор температур по попыткам (увеличиваем на 0,1)
+    - escalate_llm: make_llm для более сильной модели — последняя попытка, если все остальные не разобрались
+    - on_response: вызывается с каждым сырым ответом модели (для учета токенов промпта)
     """
     last_err: Optional[Exception] = None
 
+    def respond(llm, msgs: List[BaseMessage]) -> Any:
+        raw = llm.invoke(msgs)
+        if on_response is not None:
+            on_response(raw)
+        return raw
+
     n = min(max_retries, len(temps))
     for i in range(n):
         llm = make_llm(temps[i])
 
-        extra = ""
-        if i > 0:
-            extra = (
-                "\nВАЖНО: верни ТОЛЬКО JSON без пояснений, без markdown, без лишнего текста.\n"
-                "Даже если не уверен — верни валидный JSON по схеме.\n"
-            )
-
+        # Подсказку добавляем в конец: системный промпт (префикс) остается байт-в-байт тем же,
+        # и кэш промптов у провайдера продолжает срабатывать на повторных попытках
         patched = list(messages)
-        if patched and isinstance(patched[0], SystemMessage):
-            patched[0] = SystemMessage(content=patched[0].content + extra)
-        else:
-            patched = [SystemMessage(content=extra)] + patched
+        if i > 0:
+            patched.append(HumanMessage(content=RETRY_HINT))
 
         try:
-            raw = llm.invoke(patched)
+            raw = respond(llm, patched)
             text = _coerce_text(raw)
             return parser.parse(text)
         except Exception as e:
             last_err = e
 
     # Извлекаем jsonиз ответа
-    raw = make_llm(temps[-1]).invoke(messages)
-    text = _coerce_text(raw)
-    data = _extract_json(text)
-    if data is not None:
-        return parser.pydantic_object.model_validate(data)
+    try:
+        raw = respond(make_llm(temps[-1]), messages)
+        text = _coerce_text(raw)
+        data = _extract_json(text)
+        if data is not None:
+            return parser.pydantic_object.model_validate(data)
+    except Exception as e:
+        last_err = e
+
+    # Эскалация: та же задача на большой модели
+    if escalate_llm is not None:
+        raw = respond(escalate_llm(temps[0]), messages)
+        return parser.parse(_coerce_text(raw))
+
+    raise last_err or ValueError("Не удалось проанализировать ответ модели")
 
-    raise last_err or ValueError("Не удалось проанализировать ответ модели")
\ No newline at end of file
+class StreamedDecision:
+    """
+    Потоковый вызов модели с ранней выдачей полей JSON-ответа
+
+    Модель стримится в фоновом потоке через IncrementalJSONParser:
+    - wait_field(name) возвращает поле, как только его значение дописано (остальное еще генерируется);
+    - result() ждет весь ответ и возвращает pydantic-объект.
+    Если поток упал или ответ не разобрался — result() делает обычный invoke_with_parser_retry
+    (с эскалацией на escalate_llm, если она задана)
+    """
+
+    def __init__(
+            self,
+            *,
+            make_llm,
+            messages: List[BaseMessage],
+            parser: PydanticOutputParser,
+            max_retries: int = 3,
+            temps: Tuple[float, ...] = (0.1, 0.2, 0.3),
+            escalate_llm=None,
+    ):
+        # Какие модели отвечали (по порядку вызовов) и была ли эскалация на большую
+        self.models: List[str] = []
+        self.escalated = False
+        # Сырые ответы модели (для учета токенов промпта), заполняются по мере завершения вызовов
+        self.responses: List[Any] = []
+        self._make_llm = self._tracked(make_llm)
+        self._escalate_llm = self._tracked(escalate_llm, escalation=True) if escalate_llm is not None else None
+        self._messages = messages
+        self._parser = parser
+        self._max_retries = max_retries
+        self._temps = temps
+        self._json = IncrementalJSONParser()
+        self._cond = threading.Condition()
+        self._finished = False
+        self._result: Any = None
+        self._error: Optional[Exception] = None
+        self.first_field_at: Optional[float] = None
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _tracked(self, make_llm, escalation: bool = False):
+        def wrapped(temp: float):
+            llm = make_llm(temp)
+            self.models.append(llm_model_name(llm))
+            self.escalated = self.escalated or escalation
+            return llm
+        return wrapped
+
+    def _run(self):
+        text = ""
+        merged = None
+        try:
+            for chunk in self._make_llm(self._temps[0]).stream(self._messages):
+                merged = chunk if merged is None else merged + chunk
+                piece = _coerce_text(chunk)
+                text += piece
+                if self._json.feed(piece):
+                    with self._cond:
+                        if self.first_field_at is None:
+                            self.first_field_at = time.perf_counter()
+                        self._cond.notify_all()
+            if merged is not None:
+                self.responses.append(merged)
+            result = self._parser.parse(text)
+        except Exception:
+            try:
+                result = invoke_with_parser_retry(
+                    make_llm=self._make_llm,
+                    messages=self._messages,
+                    parser=self._parser,
+                    max_retries=self._max_retries,
+                    temps=self._temps,
+                    escalate_llm=self._escalate_llm,
+                    on_response=self.responses.append,
+                )
+            except Exception as e:
+                result = None
+                self._error = e
+        with self._cond:
+            self._result = result
+            self._finished = True
+            self._cond.notify_all()
+
+    def wait_field(self, name: str, timeout: Optional[float] = None) -> Any:
+        """
+        Значение поля, как только оно готово. Если поле так и не пришло в потоке — берем из полного ответа
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: name in self._json.fields or self._finished, timeout=timeout)
+            if name in self._json.fields and not self._finished:
+                return self._json.fields[name]
+        return getattr(self.result(), name)
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        with self._cond:
+            self._cond.wait_for(lambda: self._finished, timeout=timeout)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+# Решения, которые узел отдал рано, а остаток ответа еще дописывается (thread_id -> node -> решение)
+_PENDING: Dict[str, Dict[str, StreamedDecision]] = {}
+_PENDING_LOCK = threading.Lock()
+
+
+def defer_decision(thread_id: str, node: str, decision: StreamedDecision) -> None:
+    with _PENDING_LOCK:
+        _PENDING.setdefault(thread_id, {})[node] = decision
+
+
+def pop_decision(thread_id: str, node: str) -> Optional[StreamedDecision]:
+    with _PENDING_LOCK:
+        return _PENDING.get(thread_id, {}).pop(node, None)
+
+
+def discard_decisions(thread_id: str) -> None:
+    with _PENDING_LOCK:
+        _PENDING.pop(thread_id, None)
+
+
+@contextlib.contextmanager
+def decision_scope(thread_id: str):
+    """
+    Ход сессии: решения, не забранные узлами (исключение или отмена графа посреди хода), удаляются
+    при выходе — следующий ход того же thread_id не получит чужое устаревшее решение
+    """
+    discard_decisions(thread_id)
+    try:
+        yield
+    finally:
+        discard_decisions(thread_id)
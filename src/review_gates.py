@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .code_check import check_code_blocks, extract_code_blocks
+from .utils import add_trace
+
+
+"""
+Детерминированные проверки черновика перед LLM-ревьюером
+Для очевидно хороших или очевидно неполных черновиков need_more решается локально,
+LLM-ревьюер вызывается только для спорных случаев.
+- правила регистрируются по intent через @register_gate(...) ("*" — для всех);
+- правило возвращает {"need_more", "focus", "reason"}, если уверено, иначе None;
+- первое уверенное правило решает, все проверки пишутся в trace ("review_gate") для аудита точности.
+need_more=true правила ставят только когда добор инструментами действительно может помочь
+(пустой или слишком короткий ответ, нет кода, нет результата days_until) — иначе лишний раунд дороже
+вызова ревьюера.
+Если черновику не хватает того, что инструменты не добудут (разделы архитектуры), правило не решает,
+решает LLM-ревьюер
+"""
+
+Verdict = Dict[str, Any]
+Gate = Callable[["MASState"], Optional[Verdict]]
+
+_GATES: Dict[str, List[Tuple[str, Gate]]] = {}
+
+
+def register_gate(*intents: str):
+    """
+    Декоратор: добавляет правило для перечисленных intent ("*" — для всех, проверяется первым)
+    """
+    def deco(fn: Gate) -> Gate:
+        for intent in intents:
+            _GATES.setdefault(intent, []).append((fn.__name__, fn))
+        return fn
+    return deco
+
+
+def _verdict(need_more: bool, reason: str, focus: str = "") -> Verdict:
+    return {"need_more": need_more, "focus": focus if need_more else "", "reason": reason}
+
+
+def run_gates(state: "MASState") -> Optional[Verdict]:
+    """
+    Прогоняет правила intent по порядку. Возвращает решение первого уверенного правила (+ "gate") или None
+    """
+    intent = state.get("intent") or ""
+    checks: List[Dict[str, Any]] = []
+    decision: Optional[Verdict] = None
+    for name, gate in _GATES.get("*", []) + _GATES.get(intent, []):
+        try:
+            verdict = gate(state)
+        except Exception as e:
+            checks.append({"gate": name, "error": str(e)})
+            continue
+        checks.append({"gate": name, "need_more": None if verdict is None else verdict["need_more"],
+                       "reason": (verdict or {}).get("reason", "")})
+        if verdict is not None:
+            decision = {**verdict, "gate": name}
+            break
+
+    add_trace(state, "review_gate", {
+        "intent": intent,
+        "round": state.get("round", 0),
+        "checks": checks,
+        "need_more": None if decision is None else decision["need_more"],
+    })
+    return decision
+
+
+def _draft(state: "MASState") -> str:
+    return (state.get("partial") or "").strip()
+
+
+def _used_tool(state: "MASState", tool: str) -> bool:
+    return any(e.get("tool") == tool for e in state.get("tool_context", []) or [])
+
+
+@register_gate("*")
+def empty_draft(state: "MASState") -> Optional[Verdict]:
+    if not _draft(state):
+        return _verdict(True, "пустой черновик", "собрать данные для ответа на запрос")
+    return None
+
+
+# Минимальная длина ответа в словах: короче — черновик явно не дописан, достаточно длинный — решает
+# следующее правило или LLM-ревьюер. Для coding/daily короткий ответ нормален (блок кода, одно число),
+# для architecture раунд добора разделы не допишет (см. architecture_sections)
+MIN_DRAFT_WORDS = {"conceptual": 10, "literature": 10}
+
+
+@register_gate("*")
+def draft_length(state: "MASState") -> Optional[Verdict]:
+    need = MIN_DRAFT_WORDS.get(state.get("intent") or "")
+    words = len(_draft(state).split())
+    if need is not None and words < need:
+        return _verdict(True, f"слишком короткий черновик ({words} слов)", "собрать материал для полного ответа")
+    return None
+
+
+_TODO_RE = re.compile(r"\bTODO\b|\bFIXME\b|NotImplementedError|^\s*\.\.\.\s*$", flags=re.MULTILINE)
+
+
+@register_gate("coding")
+def parseable_code(state: "MASState") -> Optional[Verdict]:
+    draft = _draft(state)
+    blocks = extract_code_blocks(draft)
+    if not blocks:
+        return _verdict(True, "нет блока кода", "нужен исполнимый блок кода ```python ... ``` и инструкция запуска")
+    # Синтаксические ошибки или заглушки — спорный случай, решает LLM-ревьюер
+    if check_code_blocks(draft) or any(_TODO_RE.search(code) for _, code in blocks):
+        return None
+    return _verdict(False, "код разбирается, заглушек нет")
+
+
+# Блоки ответа из промпта architecture-агента
+ARCHITECTURE_SECTIONS = {
+    "компоненты и роли": r"компонент|рол[ьи]",
+    "state": r"\bstate\b|состояни",
+    "handoff/маршрутизация": r"handoff|маршрутиз",
+    "tool calling": r"\btool|инструмент",
+    "memory": r"memory|памят",
+    "риски и улучшения": r"риск|улучшени",
+}
+
+
+@register_gate("architecture")
+def architecture_sections(state: "MASState") -> Optional[Verdict]:
+    draft = _draft(state)
+    missing = [name for name, pattern in ARCHITECTURE_SECTIONS.items() if not re.search(pattern, draft, flags=re.I)]
+    if not missing:
+        return _verdict(False, "есть все разделы")
+    # Разделы дописывает агент, а не инструменты добора (поиск/сохранение заметок) — раунд gather_tools
+    # их не добавит, поэтому неполный черновик отдаем LLM-ревьюеру
+    return None
+
+
+_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+@register_gate("daily")
+def daily_date_evidence(state: "MASState") -> Optional[Verdict]:
+    if not _DATE_RE.search(state.get("query", "")):
+        return None
+    if _used_tool(state, "days_until"):
+        return _verdict(False, "есть результат days_until")
+    return _verdict(True, "в запросе дата, но days_until не вызывался", "посчитать days_until до даты из запроса")
+
+
+_LIST_ITEM_RE = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s+\S", flags=re.MULTILINE)
+
+
+@register_gate("literature")
+def literature_structure(state: "MASState") -> Optional[Verdict]:
+    draft = _draft(state)
+    if len(_LIST_ITEM_RE.findall(draft)) >= 5 and re.search(r"критери", draft, flags=re.I):
+        return _verdict(False, "есть список запросов и критерии отбора")
+    return None
@@ -0,0 +1,384 @@
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .answer_cache import ANSWER_CACHE, history_scope, hit_session_update, remember
+from .config import ANSWER_CACHE_ENABLED, SERVER_MAX_SESSIONS, SERVER_SESSION_TTL
+from .context import prompt_cache_by_node
+from .graph import build_graph_with_retry_loop
+from .retry import decision_scope
+from .state import init_state
+from .summary import discard_summary
+from .tools import tool_cache_scope
+from .utils import _short
+
+
+"""
+HTTP-сервис мультиагентной системы (только стандартная библиотека)
+- один скомпилированный граф и общие клиенты LLM на весь процесс;
+- сессии различаются thread_id, поля сессии (history, history_summary) хранятся в LRU сервиса
+  (не больше max_sessions, сессия без запросов дольше session_ttl забывается); чекпоинты хода
+  удаляются из checkpointer после хода, поэтому память процесса не растет с числом thread_id;
+- POST /chat отдает Server-Sent Events: node (обновление узла), token (токены ответа агента), final, error;
+- один thread_id не может выполняться параллельно (второй запрос получает 409);
+- повторные/перефразированные вопросы отдаются из кэша ответов (answer_cache.py), final содержит "cached";
+  записи кэша привязаны к истории сессии, попадание тоже дописывается в историю;
+- GET /health, GET /metrics
+
+Запуск с фейковой моделью для нагрузочных тестов:
+    python -m src.server --port 8000 --fake --fake-latency 0.2
+"""
+
+# Узлы, токены которых стримим клиенту как текст ответа
+ANSWER_NODES = {"conceptual_agent", "architecture_agent", "coding_agent", "daily_agent", "literature_agent"}
+
+# Поля, которые переносятся между ходами одной сессии (не сбрасываем их во входе графа)
+SESSION_FIELDS = ("history", "history_summary")
+
+
+# Узел внешнего графа, к которому относится сообщение: первый сегмент namespace
+# ("coding_agent:<id>|agent:<id>" -> "coding_agent"), у ReAct-агентов langgraph_node — внутренний "agent"
+def outer_node(meta: Dict[str, Any]) -> str:
+    ns = meta.get("langgraph_checkpoint_ns") or meta.get("checkpoint_ns") or ""
+    return ns.split("|", 1)[0].split(":", 1)[0] or meta.get("langgraph_node", "")
+
+
+class SessionBusy(Exception):
+    pass
+
+
+class Metrics:
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._window = window
+        self.started_at = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.busy_rejections = 0
+        self.sessions_evicted = 0
+        self.active = 0
+        self.latencies_ms: List[float] = []
+        self.node_calls: Dict[str, int] = {}
+        self.node_ms: Dict[str, float] = {}
+
+    def begin(self):
+        with self._lock:
+            self.requests += 1
+            self.active += 1
+
+    def end(self, latency_ms: float, ok: bool):
+        with self._lock:
+            self.active -= 1
+            if not ok:
+                self.errors += 1
+            self.latencies_ms.append(latency_ms)
+            if len(self.latencies_ms) > self._window:
+                self.latencies_ms = self.latencies_ms[-self._window:]
+
+    def busy(self):
+        with self._lock:
+            self.busy_rejections += 1
+
+    def evicted(self, n: int):
+        with self._lock:
+            self.sessions_evicted += n
+
+    def node(self, name: str, ms: float):
+        with self._lock:
+            self.node_calls[name] = self.node_calls.get(name, 0) + 1
+            self.node_ms[name] = self.node_ms.get(name, 0.0) + ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = sorted(self.latencies_ms)
+
+            def pct(p: float) -> Optional[float]:
+                return round(lat[min(len(lat) - 1, int(p * len(lat)))], 2) if lat else None
+
+            return {
+                "uptime_s": round(time.time() - self.started_at, 1),
+                "requests": self.requests,
+                "active": self.active,
+                "errors": self.errors,
+                "busy_rejections": self.busy_rejections,
+                "sessions_evicted": self.sessions_evicted,
+                "latency_ms": {
+                    "mean": round(statistics.fmean(lat), 2) if lat else None,
+                    "p50": pct(0.50),
+                    "p95": pct(0.95),
+                    "p99": pct(0.99),
+                },
+                "nodes": {
+                    n: {"calls": c, "avg_ms": round(self.node_ms[n] / c, 2)} for n, c in self.node_calls.items()
+                },
+            }
+
+
+class MASService:
+    """
+    Держит граф и выполняет ходы сессий; используется HTTP-обработчиком, но не зависит от него
+    """
+
+    def __init__(
+            self,
+            max_rounds: int = 3,
+            use_cache: bool = ANSWER_CACHE_ENABLED,
+            max_sessions: int = SERVER_MAX_SESSIONS,
+            session_ttl: float = SERVER_SESSION_TTL,
+            keep_checkpoints: bool = False,
+    ):
+        self.app = build_graph_with_retry_loop()
+        self.max_rounds = max_rounds
+        self.use_cache = use_cache
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        # True — не удалять чекпоинты после хода (loadtest --keep-checkpoints меряет их рост)
+        self.keep_checkpoints = keep_checkpoints
+        self.metrics = Metrics()
+        # thread_id -> {"lock", "fields" (поля сессии), "used_at"}; порядок — от давно не использованных
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sessions_lock = threading.Lock()
+
+    def _session(self, thread_id: str) -> Dict[str, Any]:
+        now = time.time()
+        with self._sessions_lock:
+            entry = self._sessions.get(thread_id)
+            if entry is None:
+                entry = self._sessions[thread_id] = {"lock": threading.Lock(), "fields": {}, "used_at": now}
+            entry["used_at"] = now
+            self._sessions.move_to_end(thread_id)
+            self._evict(now)
+            return entry
+
+    # Вытесняем лишние и просроченные сессии (выполняющиеся не трогаем); вызывается под _sessions_lock
+    def _evict(self, now: float) -> None:
+        evicted = 0
+        for thread_id in list(self._sessions):
+            entry = self._sessions[thread_id]
+            if len(self._sessions) <= self.max_sessions and now - entry["used_at"] < self.session_ttl:
+                break
+            if entry["lock"].locked():
+                continue
+            del self._sessions[thread_id]
+            # Незабранное резюме сессии иначе осталось бы в summary._PENDING до конца процесса
+            discard_summary(thread_id)
+            evicted += 1
+        if evicted:
+            self.metrics.evicted(evicted)
+
+    def session_count(self) -> int:
+        with self._sessions_lock:
+            return len(self._sessions)
+
+    # Вход графа для нового хода: поля сессии из прошлых ходов, остальное с нуля
+    def _turn_input(self, query: str, thread_id: str, max_rounds: int, fields: Dict[str, Any]) -> Dict[str, Any]:
+        init = dict(init_state(query, thread_id=thread_id, max_rounds=max_rounds))
+        init["verbose"] = False
+        init.update(fields)
+        return init
+
+    def run_turn(self, query: str, thread_id: str, max_rounds: Optional[int] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Генератор событий (event, data) одного хода сессии. Бросает SessionBusy, если сессия уже выполняется
+        """
+        session = self._session(thread_id)
+        lock = session["lock"]
+        if not lock.acquire(blocking=False):
+            self.metrics.busy()
+            raise SessionBusy(thread_id)
+
+        self.metrics.begin()
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            config = {"configurable": {"thread_id": thread_id}, "recursion_limit": 120}
+            fields = session["fields"]
+            scope, hit = "", None
+            if self.use_cache:
+                scope = history_scope(thread_id, fields.get("history"), fields.get("history_summary", ""))
+                hit = ANSWER_CACHE.lookup(query, scope=scope)
+            if hit is not None:
+                # Ход из кэша тоже часть диалога: следующий вопрос сессии должен видеть его в истории
+                session["fields"] = hit_session_update(fields, thread_id, query, hit["final_answer"])
+                yield "final", {
+                    "thread_id": thread_id,
+                    "intent": hit["intent"],
+                    "final_answer": hit["final_answer"],
+                    "activated_nodes": ["answer_cache"],
+                    "handoff_log": [],
+                    "tools_used": 0,
+                    "memory_summary": hit["metadata"].get("memory_summary", ""),
+                    "cached": True,
+                    "similarity": hit["similarity"],
+                    "latency_ms": round((time.perf_counter() - t0) * 1000, 2),
+                }
+                ok = True
+                return
+
+            init = self._turn_input(query, thread_id, max_rounds or self.max_rounds, fields)
+            last = time.perf_counter()
+            with decision_scope(thread_id), tool_cache_scope():
+                # subgraphs=True: токены ReAct-агентов приходят из их подграфов
+                for ns, mode, chunk in self.app.stream(init, config=config, stream_mode=["updates", "messages"],
+                                                       subgraphs=True):
+                    if mode == "messages":
+                        msg, meta = chunk
+                        node = outer_node(meta)
+                        text = msg.content if isinstance(msg.content, str) else ""
+                        if node in ANSWER_NODES and text:
+                            yield "token", {"node": node, "text": text}
+                        continue
+                    if ns:
+                        continue
+                    now = time.perf_counter()
+                    for node_name, patch in chunk.items():
+                        self.metrics.node(node_name, (now - last) * 1000)
+                        patch = patch or {}
+                        yield "node", {
+                            "node": node_name,
+                            "ms": round((now - last) * 1000, 2),
+                            "intent": patch.get("intent"),
+                            "need_more": patch.get("need_more"),
+                            "round": patch.get("round"),
+                            "partial": _short(patch.get("partial", ""), 300),
+                        }
+                    last = now
+
+            out = self.app.get_state(config).values
+            session["fields"] = {k: out[k] for k in SESSION_FIELDS if k in out}
+            if self.use_cache:
+                remember(out, scope=scope)
+            yield "final", {
+                "thread_id": thread_id,
+                "intent": out.get("intent"),
+                "final_answer": out.get("final_answer", ""),
+                "activated_nodes": out.get("activated_nodes", []),
+                "handoff_log": out.get("handoff_log", []),
+                "tools_used": len(out.get("tool_calls", [])),
+                "memory_summary": out.get("memory_summary", ""),
+                "models_used": out.get("models_used", {}),
+                "prompt_cache": prompt_cache_by_node(out),
+                "cached": False,
+                "latency_ms": round((time.perf_counter() - t0) * 1000, 2),
+            }
+            ok = True
+        finally:
+            # Поля сессии уже перенесены в _sessions, чекпоинты хода больше не нужны
+            if not self.keep_checkpoints:
+                self.app.checkpointer.delete_thread(thread_id)
+            self.metrics.end((time.perf_counter() - t0) * 1000, ok)
+            lock.release()
+
+
+def _handler_for(service: MASService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):  # без логов на каждый запрос
+            pass
+
+        def _json(self, code: int, payload: Dict[str, Any]):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _sse(self, event: str, data: Dict[str, Any]):
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._json(200, {"status": "ok"})
+            elif self.path == "/metrics":
+                self._json(200, {**service.metrics.snapshot(), "answer_cache": ANSWER_CACHE.metrics()})
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/chat":
+                self._json(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", "0"))
+                req = json.loads(self.rfile.read(length) or b"{}")
+                query = str(req["query"])
+            except Exception:
+                self._json(400, {"error": "ожидаю JSON {\"query\": ..., \"thread_id\": ...}"})
+                return
+            thread_id = str(req.get("thread_id") or "default")
+
+            events = service.run_turn(query, thread_id, req.get("max_rounds"))
+            try:
+                first = next(events)
+            except SessionBusy:
+                self._json(409, {"error": f"сессия {thread_id} уже выполняется"})
+                return
+            except Exception as e:
+                self._json(500, {"error": str(e)})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            try:
+                self._sse(*first)
+                for event, data in events:
+                    self._sse(event, data)
+            except (BrokenPipeError, ConnectionResetError):
+                events.close()
+            except Exception as e:
+                self._sse("error", {"error": str(e)})
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000, max_rounds: int = 3) -> ThreadingHTTPServer:
+    service = MASService(max_rounds=max_rounds)
+    httpd = ThreadingHTTPServer((host, port), _handler_for(service))
+    httpd.daemon_threads = True
+    httpd.service = service
+    return httpd
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="HTTP/SSE сервис мультиагентной системы")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--max-rounds", type=int, default=3)
+    ap.add_argument("--fake", action="store_true", help="локальная ScriptedChatModel вместо OpenAI")
+    ap.add_argument("--fake-latency", type=float, default=0.0, help="задержка фейковой модели на вызов, сек")
+    ap.add_argument("--fake-token-latency", type=float, default=0.0, help="задержка фейковой модели на токен, сек")
+    args = ap.parse_args(argv)
+
+    if args.fake:
+        from .config import set_llm_factory
+        from .fake_llm import ScriptedChatModel
+
+        set_llm_factory(lambda t: ScriptedChatModel(
+            temperature=t, latency=args.fake_latency, latency_per_token=args.fake_token_latency))
+
+    httpd = serve(args.host, args.port, args.max_rounds)
+    print(f"MAS server: http://{args.host}:{args.port} (POST /chat, GET /health, GET /metrics)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
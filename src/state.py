@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Literal, Optional, TypedDict
+from typing import Annotated, Any, Dict, List, Literal, Optional, TypedDict
 
 """
 Передача состояний между узлами графа
@@ -14,24 +14,74 @@ from typing import Any, Dict, List, Literal, Optional, TypedDict
 
 Intent = Literal["conceptual", "architecture", "coding", "daily", "literature"]
 
+
+# Результаты параллельных подзадач добора (gather_item) сливаются по id записи: узлы возвращают весь state,
+# поэтому повторная запись того же списка ничего не добавляет; None очищает канал (после gather_merge)
+def merge_gather_results(left: Optional[List[Dict[str, Any]]], right: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    if right is None:
+        return []
+    seen = {e.get("id") for e in left or []}
+    return list(left or []) + [e for e in right if e.get("id") not in seen]
+
+
 class MASState(TypedDict):
     query: str                           # Запрос пользователя
     intent: Optional[Intent]             # Тип запроса пользователя
     plan: List[str]                      # План решение от планировщика
     tool_context: List[Dict[str, Any]]   # Накопленная информация от интрументов
     focus: str                           # Какую информацию еще необходимо собрать
+    focus_items: List[str]               # Независимые пункты focus (добираются параллельно)
     need_more: bool                      # Флаг для понимания нужно ли делать новый запрос интрументу
     round: int                           # Итерация цикла
+    gather_results: Annotated[List[Dict[str, Any]], merge_gather_results]  # Результаты параллельного добора
     max_rounds: int                      # Максимальное количество итераций цикла
     partial: str                         # Промежуточный ответ агента
     final_answer: str                    # Финальный ответ агента
-    history: List[Dict[str, Any]]        # История диалога
-    memory_notes: List[Dict[str, Any]]   # История пользователя из файла
+    history: List[Dict[str, Any]]        # История диалога (последние реплики)
+    history_summary: str                 # Резюме более старых реплик (см. summary.py)
+    memory_notes: List[Dict[str, Any]]   # Не заполняется: заметки ищутся по общему снапшоту (notes_snapshot.py)
     memory_hits: List[Dict[str, Any]]    # Результаты поиска по истории из файла
     memory_summary: str                  # Резюме об использовании памяти
     activated_nodes: List[str]           # Список узлов
     tool_calls: List[Dict[str, Any]]     # Лог вызова инструментов
+    trace: List[Dict[str, Any]]          # Служебный журнал узлов (review_gate, code_check, tool_cache, gather_fanout)
     handoff_log: List[str]               # Передача информации между агентами
+    code_repair_turns: int               # Сколько реплик ушло на исправление синтаксиса кода
+    context_stats: List[Dict[str, Any]]  # Статистика упаковки контекста (токены до/после по узлам)
+    models_used: Dict[str, str]          # Какая модель отвечала за каждый узел
+    prompt_usage: List[Dict[str, Any]]   # Токены промпта по вызовам модели (сколько взято из кэша провайдера)
     thread_id: str                       # id сессии
     verbose: bool
 
+
+# Начальное состояние графа для одного запроса пользователя
+def init_state(query: str, thread_id: str = "u1", max_rounds: int = 3) -> MASState:
+    return {
+        "query": query,
+        "intent": None,
+        "plan": [],
+        "tool_context": [],
+        "focus": "",
+        "focus_items": [],
+        "need_more": False,
+        "round": 0,
+        "gather_results": [],
+        "max_rounds": max_rounds,
+        "partial": "",
+        "final_answer": "",
+        "history": [],
+        "history_summary": "",
+        "memory_notes": [],
+        "memory_hits": [],
+        "memory_summary": "",
+        "activated_nodes": [],
+        "tool_calls": [],
+        "trace": [],
+        "handoff_log": [],
+        "code_repair_turns": 0,
+        "context_stats": [],
+        "models_used": {},
+        "prompt_usage": [],
+        "thread_id": thread_id,
+        "verbose": True,
+    }
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from .config import HISTORY_KEEP_RAW, HISTORY_SUMMARY_MAX_TOKENS, HISTORY_SUMMARY_TRIGGER_TOKENS, get_llm
+from .context import count_tokens, trim_text
+from .utils import _coerce_text, _short
+
+
+"""
+Уровень памяти "резюме диалога"
+Старые реплики history не выбрасываются, а сворачиваются в краткое резюме сессии (state["history_summary"]).
+- сворачиваем только когда история превысила порог по токенам;
+- резюме обновляется инкрементально: старое резюме + новые свернутые реплики;
+- LLM-вызов идет в фоне, узлы подхватывают готовое резюме при следующей сборке контекста.
+В промпт попадают резюме + последние HISTORY_KEEP_RAW реплик, поэтому размер промпта не растет с длиной сессии
+"""
+
+SUMMARY_SYSTEM = (
+    "Ты ведешь краткое резюме диалога пользователя с мультиагентной системой.\n"
+    "Обнови резюме с учетом новых реплик: цели пользователя, принятые решения, важные факты и числа.\n"
+    f"Не больше {HISTORY_SUMMARY_MAX_TOKENS // 2} слов, без вступлений. Верни только текст резюме.\n"
+)
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+_PENDING: Dict[str, Future] = {}
+_LOCK = threading.Lock()
+
+
+def _history_tokens(history: List[Dict[str, Any]]) -> int:
+    return sum(count_tokens(f"{h.get('role', '')}: {h.get('content', '')}") for h in history)
+
+
+# Резюме без LLM (если модель недоступна): старое резюме + начало каждой реплики
+def _fallback_summary(prev: str, turns: List[Dict[str, Any]]) -> str:
+    parts = [prev] if prev else []
+    parts += [f"{h.get('role', '')}: {_short(h.get('content', ''), 80)}" for h in turns]
+    return "\n".join(parts)
+
+
+def _summarize(prev: Optional[Future], prev_summary: str, turns: List[Dict[str, Any]]) -> str:
+    # Резюме строятся цепочкой: ждем предыдущее свертывание этой же сессии
+    if prev is not None:
+        try:
+            prev_summary = prev.result()
+        except Exception:
+            pass
+
+    dialog = "\n".join(f"{h.get('role', '')}: {h.get('content', '')}" for h in turns)
+    try:
+        raw = get_llm(temperature=0.0, node="summary").invoke([
+            SystemMessage(content=SUMMARY_SYSTEM),
+            HumanMessage(content=f"ТЕКУЩЕЕ РЕЗЮМЕ:\n{prev_summary or '(пусто)'}\n\nНОВЫЕ РЕПЛИКИ:\n{dialog}"),
+        ])
+        summary = _coerce_text(raw).strip()
+    except Exception:
+        summary = _fallback_summary(prev_summary, turns)
+    return trim_text(summary, HISTORY_SUMMARY_MAX_TOKENS)
+
+
+def refresh_history_summary(state: "MASState", wait: bool = False) -> None:
+    """
+    Переносит готовое фоновое резюме в state (wait=True — дождаться незавершенного)
+    """
+    thread_id = state.get("thread_id", "")
+    with _LOCK:
+        fut = _PENDING.get(thread_id)
+    if fut is None or (not wait and not fut.done()):
+        return
+    try:
+        state["history_summary"] = fut.result()
+    except Exception:
+        return
+    with _LOCK:
+        if _PENDING.get(thread_id) is fut:
+            del _PENDING[thread_id]
+
+
+def discard_summary(thread_id: str) -> None:
+    """
+    Забывает фоновое резюме сессии (сессия вытеснена и больше его не заберет)
+    """
+    with _LOCK:
+        fut = _PENDING.pop(thread_id, None)
+    if fut is not None:
+        fut.cancel()
+
+
+def fold_history(state: "MASState") -> None:
+    """
+    Если история длиннее порога по токенам — старые реплики уходят в фоновое резюме,
+    в state["history"] остаются последние HISTORY_KEEP_RAW
+    """
+    refresh_history_summary(state)
+
+    history = state["history"]
+    if len(history) <= HISTORY_KEEP_RAW or _history_tokens(history) <= HISTORY_SUMMARY_TRIGGER_TOKENS:
+        return
+
+    old, state["history"] = history[:-HISTORY_KEEP_RAW], history[-HISTORY_KEEP_RAW:]
+    thread_id = state.get("thread_id", "")
+    with _LOCK:
+        prev = _PENDING.get(thread_id)
+        _PENDING[thread_id] = _EXECUTOR.submit(_summarize, prev, state.get("history_summary", ""), old)
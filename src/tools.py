@@ -1,13 +1,118 @@
 from __future__ import annotations
 
+import contextlib
+import contextvars
 import datetime
 import json
-import math
 import re
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
 
 from langchain_core.tools import tool
 
-from .memory_store import load_notes, append_note, simple_retrieve_notes
+from .calc import evaluate_batch
+from .memory_store import append_note, retrieve_notes
+
+
+"""
+Мемоизация инструментов в рамках одного прогона графа
+За несколько раундов reviewer -> gather_tools -> agent модель часто повторяет одни и те же вызовы
+(search_user_notes с тем же запросом, calc/days_until с теми же аргументами).
+Результаты кэшируются по (инструмент, нормализованные аргументы); save_user_note сбрасывает поиск.
+Вне tool_cache_scope() инструменты работают как раньше, без кэша.
+В логе инструментов прогона (tool_calls) у ответа инструмента есть флаг cached — взят ли он из кэша.
+"""
+
+
+class ToolCache:
+    def __init__(self):
+        self._data: Dict[Tuple[str, Any], str] = {}
+        self._lock = threading.Lock()
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.invalidations = 0
+        # (инструмент, вывод) -> попадания в кэш по порядку вызовов (для флага cached в логе инструментов)
+        self._served: Dict[Tuple[str, str], Deque[bool]] = {}
+
+    def get_or_call(self, tool_name: str, key: Any, fn: Callable[[], str]) -> str:
+        k = (tool_name, key)
+        with self._lock:
+            if k in self._data:
+                self.hits[tool_name] = self.hits.get(tool_name, 0) + 1
+                val = self._data[k]
+                self._served.setdefault((tool_name, val), deque()).append(True)
+                return val
+        val = fn()
+        with self._lock:
+            self._data[k] = val
+            self.misses[tool_name] = self.misses.get(tool_name, 0) + 1
+            self._served.setdefault((tool_name, val), deque()).append(False)
+        return val
+
+    def served_from_cache(self, tool_name: Optional[str], content: Any) -> Optional[bool]:
+        """
+        Взят ли из кэша ответ tool_name с таким текстом (каждый ответ забирается один раз, по порядку).
+        Ответы с одинаковым текстом неразличимы в логе, поэтому порядок между ними не важен.
+        None — вызов шел мимо кэша
+        """
+        if not isinstance(content, str):
+            return None
+        with self._lock:
+            served = self._served.get((tool_name or "", content))
+            return served.popleft() if served else None
+
+    # Удаляем записи инструмента (после записи в заметки результаты поиска устарели)
+    def invalidate(self, tool_name: str) -> None:
+        with self._lock:
+            for k in [k for k in self._data if k[0] == tool_name]:
+                del self._data[k]
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": dict(self.hits), "misses": dict(self.misses), "invalidations": self.invalidations}
+
+
+_TOOL_CACHE: contextvars.ContextVar[Optional[ToolCache]] = contextvars.ContextVar("mas_tool_cache", default=None)
+
+
+@contextlib.contextmanager
+def tool_cache_scope() -> Iterator[ToolCache]:
+    """
+    Включает кэш инструментов на время прогона графа:
+
+        with tool_cache_scope() as cache:
+            app.invoke(...)
+    """
+    cache = ToolCache()
+    token = _TOOL_CACHE.set(cache)
+    try:
+        yield cache
+    finally:
+        _TOOL_CACHE.reset(token)
+
+
+def current_tool_cache() -> Optional[ToolCache]:
+    return _TOOL_CACHE.get()
+
+
+# Флаг cached для ответа инструмента в логе (None — кэш не включен или вызов шел мимо него)
+def tool_result_cached(tool_name: Optional[str], content: Any) -> Optional[bool]:
+    cache = _TOOL_CACHE.get()
+    return None if cache is None else cache.served_from_cache(tool_name, content)
+
+
+def _memoized(tool_name: str, key: Any, fn: Callable[[], str]) -> str:
+    cache = _TOOL_CACHE.get()
+    if cache is None:
+        return fn()
+    return cache.get_or_call(tool_name, key, fn)
+
+
+# Нормализуем поисковый запрос так же, как simple_retrieve_notes (набор токенов длиной >= 3)
+def _search_key(query: str, k: int) -> Tuple[frozenset, int]:
+    return frozenset(re.findall(r"[a-zа-я0-9]{3,}", (query or "").lower())), int(k)
 
 
 # Инструменты для агентов
@@ -16,13 +121,27 @@ def calc(expression: str) -> str:
     """
     Для вычисления простых математических формул 
     """""
-    if not re.fullmatch(r"[0-9\.\+\-\*\/\(\)\s]+", expression or ""):
-        return "Ошибка: недопустимые символы в выражении"
-    try:
-        val = eval(expression, {"__builtins__": {}}, {"math": math})
-        return str(val)
-    except Exception as e:
-        return f"Ошибка вычисления: {e}"
+    return _memoized("calc", re.sub(r"\s+", "", expression or ""), lambda: _calc(expression))
+
+
+def _calc(expression: str) -> str:
+    res = evaluate_batch([expression])[0]
+    if "error" in res:
+        return f"Ошибка вычисления: {res['error']}"
+    return res["value"]
+
+
+@tool("calc_batch")
+def calc_batch(expressions: List[str]) -> str:
+    """
+    Вычисляет сразу несколько формул за один вызов.
+    Каждый элемент — выражение ("2*(3+4)") или именованный результат ("total = 2*(3+4)"),
+    имена можно использовать в следующих выражениях ("total / 7").
+    Доступно: + - * / // % **, sqrt, log, exp, sin, cos, floor, ceil, abs, round, min, max, pi, e.
+    Возвращает JSON-список [{"expr", "value"} | {"expr", "error"}]
+    """
+    key = tuple(re.sub(r"\s+", "", x or "") for x in expressions or [])
+    return _memoized("calc_batch", key, lambda: json.dumps(evaluate_batch(list(expressions or [])), ensure_ascii=False))
 
 
 @tool("days_until")
@@ -30,6 +149,10 @@ def days_until(date_iso: str) -> str:
     """
     Считаем количество дней до заданной даты для планирования бытовых задач
     """""
+    return _memoized("days_until", (date_iso or "").strip(), lambda: _days_until(date_iso))
+
+
+def _days_until(date_iso: str) -> str:
     try:
         target = datetime.date.fromisoformat((date_iso or "").strip())
         today = datetime.date.today()
@@ -50,9 +173,13 @@ def save_user_note(text: str, tags_json: str = "[]") -> str:
     except Exception:
         tags = []
 
-    # Загружаем текущие ответы, добавляем новую и сохраняем
-    notes = load_notes()
-    note = append_note(notes, text=text, tags=tags)
+    # Добавляем заметку к текущим (под блокировкой файла) и сохраняем
+    note = append_note(text=text, tags=tags)
+
+    # Закэшированные результаты поиска больше не актуальны
+    cache = _TOOL_CACHE.get()
+    if cache is not None:
+        cache.invalidate("search_user_notes")
     return json.dumps(note, ensure_ascii=False)
 
 
@@ -61,16 +188,19 @@ def search_user_notes(query: str, k: int = 5) -> str:
     """
     Ищем релевантные ответы в файле с историей
     """
-    notes = load_notes()
-    hits = simple_retrieve_notes(notes, query=query, k=k)
+    return _memoized("search_user_notes", _search_key(query, k), lambda: _search_user_notes(query, k))
+
+
+def _search_user_notes(query: str, k: int = 5) -> str:
+    hits = retrieve_notes(query, k=k)
     return json.dumps(hits, ensure_ascii=False)
 
 
-# Для бытовых задач
-TOOLS_DAILY = [calc, days_until, save_user_note, search_user_notes]
+# Для бытовых задач (расчеты одним вызовом calc_batch)
+TOOLS_DAILY = [calc_batch, days_until, save_user_note, search_user_notes]
 
 # Для задач программирования
-TOOLS_CODING = [calc, save_user_note, search_user_notes]
+TOOLS_CODING = [calc_batch, save_user_note, search_user_notes]
 
 # Для задач литературных
 TOOLS_LITERATURE = [save_user_note, search_user_notes]
\ No newline at end of file
@@ -40,6 +40,110 @@ def _extract_json(text: str) -> Optional[Any]:
     except Exception:
         return None
 
+# Потоковый разбор JSON-объекта: поля верхнего уровня отдаются, как только значение дописано
+class IncrementalJSONParser:
+    """
+    Пример:
+        p = IncrementalJSONParser()
+        for chunk in llm.stream(messages):
+            for key, value in p.feed(_coerce_text(chunk)).items():
+                ...  # key уже полностью пришел, остальной ответ еще генерируется
+
+    Текст до первой "{" (пояснения, ```json) пропускается
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._text = ""
+        self._pos = 0
+        self._depth = 0          # глубина вложенности относительно начала объекта
+        self._in_str = False
+        self._esc = False
+        self._phase = "start"    # start -> key -> colon -> value -> after
+        self._start = 0          # начало текущего ключа/значения в self._text
+        self._key = ""
+
+    def _finish_value(self, end: int, new: Dict[str, Any]):
+        try:
+            value = json.loads(self._text[self._start:end])
+        except Exception:
+            value = None
+        self.fields[self._key] = value
+        new[self._key] = value
+        self._phase = "after"
+
+    def feed(self, chunk: str) -> Dict[str, Any]:
+        new: Dict[str, Any] = {}
+        self._text += chunk or ""
+        text = self._text
+        while self._pos < len(text) and not self.done:
+            i = self._pos
+            c = text[i]
+            self._pos += 1
+
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+                    if self._phase == "key" and self._depth == 1:
+                        self._key = json.loads(text[self._start:i + 1])
+                        self._phase = "colon"
+                    elif self._phase == "value" and self._depth == 1:
+                        self._finish_value(i + 1, new)
+                continue
+
+            if self._phase == "start":
+                if c == "{":
+                    self._depth = 1
+                    self._phase = "key"
+                continue
+
+            if self._phase in ("key", "after"):
+                if c == '"' and self._depth == 1:
+                    self._phase = "key"
+                    self._in_str = True
+                    self._start = i
+                elif c == "}":
+                    self.done = True
+                continue
+
+            if self._phase == "colon":
+                if c == ":":
+                    self._phase = "value_start"
+                continue
+
+            if self._phase == "value_start":
+                if c.isspace():
+                    continue
+                self._phase = "value"
+                self._start = i
+                if c == '"':
+                    self._in_str = True
+                elif c in "{[":
+                    self._depth += 1
+                continue
+
+            # phase == "value"
+            if c == '"':
+                self._in_str = True
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]" and self._depth > 1:
+                self._depth -= 1
+                if self._depth == 1:
+                    self._finish_value(i + 1, new)
+            elif self._depth == 1 and (c in ",}" or c.isspace()):
+                # Конец литерала: число, true/false/null
+                self._finish_value(i, new)
+                if c == "}":
+                    self.done = True
+        return new
+
+
 # Уменьшаем размер строки для вывода ответов в логах
 def _short(s: str, n: int = 240) -> str:
     s = (s or "").strip().replace("\n", " ")
@@ -53,6 +157,20 @@ def add_history(state: "MASState", role: str, content: str):
 def add_tool_log(state: "MASState", tool_name: str, payload: Any):
     state["tool_calls"].append({"ts": now_iso(), "tool": tool_name, "payload": payload})
 
+# Служебные записи (проверки, статистика кэша, fan-out) — отдельно от tool_calls, чтобы не считать их вызовами инструментов
+def add_trace(state: "MASState", event: str, payload: Any):
+    state.setdefault("trace", []).append({"ts": now_iso(), "event": event, "payload": payload})
+
+# Добавляем результат инструмента в tool_context (повторный одинаковый результат того же инструмента не дублируем;
+# одинаковый текст разных инструментов храним: по полю tool правила ревьюера проверяют, что инструмент вызывался)
+def add_tool_context(state: "MASState", content: Any, tool: Optional[str] = None):
+    if any(e.get("tool_message") == content and e.get("tool") == tool for e in state["tool_context"]):
+        return
+    entry = {"ts": now_iso(), "tool_message": content}
+    if tool:
+        entry["tool"] = tool
+    state["tool_context"].append(entry)
+
 # Логируем посещение узла графа LangGraph
 def add_node_log(state: "MASState", node_name: str):
     state["activated_nodes"].append(node_name)
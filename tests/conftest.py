@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+
+"""
+Тесты запускаются без OpenAI: фейковая модель и временный файл заметок подменяются ДО импорта src
+(NOTES_PATH и FAKE_LLM читаются при импорте config)
+"""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["MAS_FAKE_LLM"] = "1"
+os.environ.setdefault("MAS_NOTES_PATH", os.path.join(tempfile.mkdtemp(prefix="mas_tests_"), "notes.json"))
+os.environ.setdefault("MAS_ANSWER_CACHE", "0")
+
+
+import pytest
+
+
+@pytest.fixture
+def llm_responder():
+    """
+    Подменяет ответы фейковой модели: llm_responder(fn), fn(messages, tools) -> AIMessage | None
+    (None — ответ по умолчанию). После теста возвращается обычная ScriptedChatModel
+    """
+    from src.config import set_llm_factory
+    from src.fake_llm import ScriptedChatModel, default_responder
+
+    def install(fn):
+        def responder(messages, tools):
+            return fn(messages, tools) or default_responder(messages, tools)
+        set_llm_factory(lambda t: ScriptedChatModel(temperature=t, responder=responder))
+
+    yield install
+    set_llm_factory(None)
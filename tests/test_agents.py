@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+
+from src.agents import agent_cache_stats, clear_agent_cache, get_react_agent
+from src.tools import TOOLS_DAILY
+
+
+def test_cache_counters_are_exact_under_concurrency():
+    clear_agent_cache()
+
+    def lookup(i: int):
+        return get_react_agent("daily_agent", "system", TOOLS_DAILY, temperature=float(i % 2))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        agents = list(pool.map(lookup, range(400)))
+
+    assert len({id(a) for a in agents}) == 2
+    assert agent_cache_stats() == {"size": 2, "hits": 398, "misses": 2}
+    clear_agent_cache()
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import pytest
+
+from src.answer_cache import AnswerCache, history_scope, hit_session_update
+
+
+@pytest.fixture
+def cache():
+    return AnswerCache(threshold=0.9, ttl_by_intent={"default": 3600, "daily": 600})
+
+
+def test_exact_and_rephrased_queries_hit(cache):
+    assert cache.store("Как приготовить штрудель?", "рецепт", "conceptual")
+    assert cache.lookup("Как приготовить штрудель?")["final_answer"] == "рецепт"
+    assert cache.lookup("как приготовить штрудель")["final_answer"] == "рецепт"
+    assert cache.metrics()["hits"] == 2
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("Напиши код, который выводит числа от 1 до 10", "Напиши код, который выводит числа от 1 до 100"),
+    ("Можно ли пить кофе старше 18 лет", "Можно ли пить кофе младше 18 лет"),
+    ("Сколько будет 1234 * 5678?", "Сколько будет 1234 * 5679?"),
+    ("Сколько будет 1234 * 5678?", "Сколько будет 1234 + 5678?"),
+    ("Как приготовить штрудель?", "Как не приготовить штрудель?"),
+])
+def test_near_identical_queries_with_different_meaning_miss(cache, stored, asked):
+    cache.store(stored, "ответ", "conceptual")
+    assert cache.lookup(asked) is None
+
+
+def test_unrelated_query_misses(cache):
+    cache.store("Как приготовить штрудель?", "рецепт", "conceptual")
+    assert cache.lookup("Объясни паттерн supervisor") is None
+
+
+def test_daily_with_dates_is_not_cached(cache):
+    assert not cache.store("Сколько дней до 2030-01-01?", "1000", "daily")
+    assert cache.lookup("Сколько дней до 2030-01-01?") is None
+
+
+def test_entries_are_scoped_by_history(cache):
+    history = [{"role": "user", "content": "Как приготовить штрудель?"}]
+    scope = history_scope("t1", history)
+    assert history_scope("t1") == ""
+    assert scope != history_scope("t2", history)
+
+    cache.store("А сколько по времени?", "час", "daily", scope=scope)
+    assert cache.lookup("А сколько по времени?") is None
+    assert cache.lookup("А сколько по времени?", scope=history_scope("t2", history)) is None
+    assert cache.lookup("А сколько по времени?", scope=scope)["final_answer"] == "час"
+
+
+def test_hit_is_added_to_session_history():
+    update = hit_session_update({"history": [], "history_summary": ""}, "t1", "вопрос", "ответ")
+    assert [(h["role"], h["content"]) for h in update["history"]] == [("user", "вопрос"), ("assistant", "ответ")]
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import json
+import random
+
+import pytest
+
+from src.calc import VECTORIZE_MIN_BATCH, CalcError, _fmt, _vectorized, evaluate, evaluate_batch
+from src.tools import calc, calc_batch
+
+
+def _scalar(expr: str) -> str:
+    try:
+        return _fmt(evaluate(expr))
+    except ZeroDivisionError:
+        return "деление на ноль"
+    except Exception as e:
+        return str(e)
+
+
+def _batch_values(exprs):
+    return [r.get("value", r.get("error")) for r in evaluate_batch(exprs)]
+
+
+@pytest.mark.parametrize("template", [
+    "({i} + 1) * 2.5 / 3",
+    "{i} // 7 + {i} % 7",
+    "sqrt({i}) + log({i} + 1)",
+    "(2**60 + {i}) - 2**60",
+    "{i} * 12345678901 * 98765",
+    "1 / ({i} - 20)",
+    "(-{i}) ** 0.5",
+])
+def test_batch_matches_scalar(template):
+    exprs = [template.format(i=i) for i in range(1, 2 * VECTORIZE_MIN_BATCH)]
+    assert _batch_values(exprs) == [_scalar(e) for e in exprs]
+
+
+def test_batch_matches_scalar_on_random_expressions():
+    rng = random.Random(7)
+    ops = ["+", "-", "*", "/", "//", "%"]
+    exprs = []
+    for _ in range(200):
+        a, b, c = rng.randint(-10 ** 6, 10 ** 6), rng.randint(1, 10 ** 9), rng.randint(1, 50)
+        exprs.append(f"({a} {rng.choice(ops)} {b}) {rng.choice(ops)} {c}")
+    assert _batch_values(exprs) == [_scalar(e) for e in exprs]
+
+
+def test_small_floats_are_vectorized():
+    exprs = [(i, f"({i} + 1) * 2.5 / 3") for i in range(VECTORIZE_MIN_BATCH)]
+    results = [{} for _ in exprs]
+    assert _vectorized(exprs, results) == []
+
+
+def test_named_results_and_tools():
+    res = evaluate_batch(["total = 2*(3+4)", "total / 7", "x + 1"])
+    assert res[0] == {"expr": "2*(3+4)", "name": "total", "value": "14"}
+    assert res[1]["value"] == "2"
+    assert "error" in res[2]
+    assert calc.invoke({"expression": "2 + 2"}) == "4"
+    assert json.loads(calc_batch.invoke({"expressions": ["1/0"]}))[0]["error"] == "деление на ноль"
+
+
+@pytest.mark.parametrize("expr", ["10**10**10", "((9**999)**999)**999", "(-8)**(1/3)", "__import__('os')"])
+def test_rejected_expressions(expr):
+    with pytest.raises(CalcError):
+        evaluate(expr)
@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+from src import config
+
+
+def test_openai_client_is_cached_with_nested_tier_params(monkeypatch):
+    tier = {"model": "gpt-4o-mini", "max_tokens": 100, "model_kwargs": {"top_p": 0.5}, "stop": ["END"]}
+    monkeypatch.setattr(config, "FAKE_LLM", False)
+    monkeypatch.setattr(config, "API_KEY", "sk-test")
+    monkeypatch.setattr(config, "MODEL_TIERS", {**config.MODEL_TIERS, "test": tier})
+    config._openai_llm.cache_clear()
+
+    llm = config.get_llm(temperature=0.0, tier="test")
+    assert llm.top_p == 0.5 and llm.stop == ["END"] and llm.max_tokens == 100
+    assert config.get_llm(temperature=0.0, tier="test") is llm
+    assert config.get_llm(temperature=0.5, tier="test") is not llm
+    config._openai_llm.cache_clear()
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from src import nodes
+from src.graph import build_graph_with_retry_loop
+from src.state import init_state
+
+
+def _system(messages) -> str:
+    return "\n".join(m.content for m in messages if isinstance(m, SystemMessage))
+
+
+@pytest.fixture
+def run_with_review(monkeypatch, llm_responder):
+    """
+    Первый ответ LLM-ревьюера — need_more с заданными focus/focus_items, дальше — готово.
+    Возвращает финальный state и список focus, с которыми запускался агент добора
+    """
+    monkeypatch.setattr(nodes, "REVIEW_GATES", "0")
+
+    def run(focus: str, focus_items):
+        reviews = []
+        gathered = []
+
+        def respond(messages, tools):
+            system = _system(messages)
+            if "reviewer" in system and not reviews:
+                reviews.append(1)
+                return AIMessage(content=json.dumps({
+                    "need_more": True, "focus": focus, "focus_items": focus_items, "improved_answer": ""}))
+            if "агент добора" in system and not any(isinstance(m, AIMessage) for m in messages):
+                human = next(m.content for m in messages if isinstance(m, HumanMessage))
+                gathered.append(next((line.split(":", 1)[1].strip() for line in human.splitlines()
+                                      if line.startswith("FOCUS:")), ""))
+            return None
+
+        llm_responder(respond)
+        app = build_graph_with_retry_loop()
+        out = app.invoke(init_state("Как приготовить штрудель?", thread_id="gather"),
+                         config={"configurable": {"thread_id": "gather"}, "recursion_limit": 120})
+        return out, gathered
+
+    return run
+
+
+def test_fan_out_counts_as_one_round(run_with_review):
+    out, gathered = run_with_review("a, b, c", ["notes on a", "notes on b", "Notes on A", "deadline c"])
+
+    assert out["activated_nodes"].count("gather_merge") == 1
+    assert out["round"] == 2
+    assert sorted(gathered[1:]) == ["deadline c", "notes on a", "notes on b"]
+    fanout = [c for c in out["trace"] if c["event"] == "gather_fanout"]
+    assert len(fanout) == 1 and len(fanout[0]["payload"]["items"]) == 3
+    assert out["gather_results"] == []
+    # Служебные записи — в trace, в tool_calls только результаты инструментов
+    assert {c.get("tool") or c.get("type") for c in out["tool_calls"]} <= {"tool_message", "ToolMessage"}
+
+    messages = [e["tool_message"] for e in out["tool_context"] if "tool_message" in e]
+    assert len(messages) == len(set(messages))
+
+
+def test_single_focus_item_is_used_as_focus(run_with_review):
+    out, gathered = run_with_review("", ["рецепт теста"])
+
+    assert "gather_merge" not in out["activated_nodes"]
+    assert gathered[1] == "рецепт теста"
+    assert out["round"] == 2
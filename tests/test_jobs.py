@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import time
+import types
+
+import pytest
+
+from src import jobs
+from src.jobs import JobQueue, worker_loop
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Подменяет время очереди: clock.now += секунды
+    """
+    fake = types.SimpleNamespace(now=time.time())
+    monkeypatch.setattr(jobs, "time", types.SimpleNamespace(time=lambda: fake.now, sleep=time.sleep))
+    return fake
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"), lease_seconds=10, max_attempts=2)
+
+
+def test_expired_lease_is_requeued_then_failed(queue, clock):
+    job_id = queue.enqueue("запрос", thread_id="t1")
+    assert queue.claim("w1")["id"] == job_id
+
+    clock.now += 11
+    job = queue.claim("w2")
+    assert job["id"] == job_id and job["attempts"] == 2
+
+    clock.now += 11
+    assert queue.claim("w3") is None
+    failed = queue.get(job_id)
+    assert failed["status"] == "failed" and failed["error"] == "lease expired"
+
+
+def test_one_thread_runs_on_one_worker_in_fifo_order(queue):
+    first = queue.enqueue("ход 1", thread_id="t1")
+    second = queue.enqueue("ход 2", thread_id="t1")
+    other = queue.enqueue("другая сессия", thread_id="t2")
+
+    assert queue.claim("w1")["id"] == first
+    # Второй ход t1 ждет первого, свободный воркер берет t2
+    assert queue.claim("w2")["id"] == other
+    assert queue.claim("w3") is None
+
+    assert queue.complete(first, "w1", {"final_answer": "1"}, {"history": []})
+    assert queue.claim("w3")["id"] == second
+
+
+def test_worker_that_lost_lease_cannot_heartbeat_or_complete(queue, clock):
+    job_id = queue.enqueue("запрос", thread_id="t1")
+    queue.claim("w1")
+    clock.now += 11
+    queue.claim("w2")
+
+    assert not queue.heartbeat(job_id, "w1")
+    assert not queue.complete(job_id, "w1", {"final_answer": "старый"}, {"history": ["старый"]})
+    assert queue.load_session("t1") == {}
+
+    assert queue.heartbeat(job_id, "w2")
+    assert queue.complete(job_id, "w2", {"final_answer": "новый"}, {"history": ["новый"], "intent": "daily"})
+    assert queue.get(job_id)["result"] == {"final_answer": "новый"}
+    assert queue.load_session("t1") == {"history": ["новый"]}
+
+
+def test_fail_requeues_until_max_attempts(queue):
+    job_id = queue.enqueue("запрос", thread_id="t1")
+    queue.claim("w1")
+    assert queue.fail(job_id, "w1", "RuntimeError: x")
+    assert queue.get(job_id)["status"] == "queued"
+    queue.claim("w1")
+    assert queue.fail(job_id, "w1", "RuntimeError: x")
+    assert queue.get(job_id)["status"] == "failed"
+
+
+def test_worker_loop_runs_turns_and_writes_session(queue, monkeypatch):
+    from src.config import set_llm_factory
+
+    monkeypatch.setattr(jobs.signal, "signal", lambda *a: None)
+    first = queue.enqueue("Как приготовить штрудель?", thread_id="s1", max_rounds=1)
+    second = queue.enqueue("А сколько его печь?", thread_id="s1", max_rounds=1)
+    try:
+        done = worker_loop(queue.path, name="w1", poll=0.01, drain=True, fake=True)
+    finally:
+        set_llm_factory(None)
+
+    assert done == 2
+    for job_id in (first, second):
+        job = queue.get(job_id)
+        assert job["status"] == "done"
+        assert job["result"]["final_answer"]
+        assert job["state"]["thread_id"] == "s1"
+    # История второго хода продолжает первый: сессия пережила смену хода
+    history = queue.load_session("s1")["history"]
+    assert len(history) == 4 and history[0]["content"] == "Как приготовить штрудель?"
+    assert queue.get(second)["state"]["history"] == history
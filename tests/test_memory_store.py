@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import json
+import multiprocessing
+
+import pytest
+
+from src.memory_store import append_note, load_notes
+
+
+def _append_many(path: str, worker: int, n: int) -> None:
+    for i in range(n):
+        append_note(f"заметка {worker}-{i}", tags=["test"], path=path)
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="нужен fork")
+def test_parallel_appends_from_processes_keep_every_note(tmp_path):
+    path = str(tmp_path / "notes.json")
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_append_many, args=(path, w, 10)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+    texts = [n["text"] for n in load_notes(path)]
+    assert sorted(texts) == sorted(f"заметка {w}-{i}" for w in range(4) for i in range(10))
+
+
+def test_append_does_not_overwrite_unreadable_file(tmp_path):
+    path = tmp_path / "notes.json"
+    path.write_text('[{"text": "старая"', encoding="utf-8")
+    with pytest.raises(ValueError):
+        append_note("новая", path=str(path))
+    assert path.read_text(encoding="utf-8") == '[{"text": "старая"'
+
+
+def test_append_keeps_existing_notes(tmp_path):
+    path = tmp_path / "notes.json"
+    path.write_text(json.dumps([{"ts": "t", "text": "старая", "tags": []}]), encoding="utf-8")
+    note = append_note("новая", tags=["x"], path=str(path))
+    assert note["tags"] == ["x"]
+    assert [n["text"] for n in load_notes(str(path))] == ["старая", "новая"]
+    assert not list(tmp_path.glob(".notes_*"))
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from src import notes_snapshot
+from src.memory_store import simple_retrieve_notes
+from src.notes_snapshot import content_digest, open_snapshot, rebuild_snapshot
+
+
+NOTES_A = [
+    {"ts": "2025-01-01T00:00:00", "text": "Рецепт штруделя: яблоки и тесто", "tags": ["кулинария"]},
+    {"ts": "2025-01-02T00:00:00", "text": "LangGraph router выбирает агента", "tags": ["langgraph"]},
+    {"ts": "2025-01-03T00:00:00", "text": "Дедлайн по лабораторной в пятницу", "tags": []},
+]
+NOTES_B = NOTES_A + [{"ts": "2025-01-04T00:00:00", "text": "Новая заметка про штрудель с вишней", "tags": []}]
+
+
+def _write(path, notes) -> bytes:
+    data = json.dumps(notes, ensure_ascii=False, indent=2).encode("utf-8")
+    path.write_bytes(data)
+    return data
+
+
+@pytest.fixture
+def paths(tmp_path):
+    notes_snapshot._OPEN.clear()
+    yield str(tmp_path / "notes.json"), str(tmp_path / "notes.snap")
+    notes_snapshot._OPEN.clear()
+
+
+@pytest.mark.parametrize("query", ["штрудель", "langgraph router", "дедлайн пятницу", "кот", ""])
+def test_search_matches_simple_retrieve(paths, tmp_path, query):
+    json_path, snap_path = paths
+    _write(tmp_path / "notes.json", NOTES_B)
+    snap = open_snapshot(json_path, snap_path)
+    assert snap.search(query, k=5) == simple_retrieve_notes(NOTES_B, query, k=5)
+    assert list(snap.notes()) == NOTES_B
+
+
+def test_changed_json_rebuilds_snapshot(paths, tmp_path):
+    json_path, snap_path = paths
+    _write(tmp_path / "notes.json", NOTES_A)
+    assert len(open_snapshot(json_path, snap_path)) == 3
+    _write(tmp_path / "notes.json", NOTES_B)
+    assert len(open_snapshot(json_path, snap_path)) == 4
+
+
+def test_stale_snapshot_from_concurrent_save_is_not_served(paths, tmp_path):
+    json_path, snap_path = paths
+    data_a = _write(tmp_path / "notes.json", NOTES_A)
+    # json уже заменен на B, а другой процесс после этого пересобирает снапшот по прочитанным ранее байтам A
+    data_b = _write(tmp_path / "notes.json", NOTES_B)
+    rebuild_snapshot(json_path, snap_path, notes=NOTES_A, data=data_a)
+
+    snap = open_snapshot(json_path, snap_path)
+    assert snap.digest == content_digest(data_b)
+    assert list(snap.notes()) == NOTES_B
+
+
+def test_snapshot_built_by_other_process_is_reused(paths, tmp_path, monkeypatch):
+    json_path, snap_path = paths
+    data = _write(tmp_path / "notes.json", NOTES_A)
+    rebuild_snapshot(json_path, snap_path, notes=NOTES_A, data=data)
+    monkeypatch.setattr(notes_snapshot, "build_snapshot", lambda *a, **kw: pytest.fail("лишняя пересборка"))
+    assert list(open_snapshot(json_path, snap_path).notes()) == NOTES_A
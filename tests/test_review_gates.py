@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from src.review_gates import run_gates
+from src.state import init_state
+
+
+def _state(intent: str, query: str, draft: str, tool_context=None):
+    s = init_state(query, thread_id="gates")
+    s["intent"] = intent
+    s["partial"] = draft
+    s["tool_context"] = tool_context or []
+    return s
+
+
+def test_empty_draft_needs_more():
+    assert run_gates(_state("conceptual", "q", ""))["need_more"] is True
+
+
+def test_length_gate():
+    assert run_gates(_state("conceptual", "q", "Коротко."))["gate"] == "draft_length"
+    long_draft = "Supervisor распределяет задачи между агентами, а planner-executor сначала строит план и исполняет шаги."
+    s = _state("conceptual", "q", long_draft)
+    assert run_gates(s) is None
+    assert s["trace"][0]["payload"]["checks"][-1] == {"gate": "draft_length", "need_more": None, "reason": ""}
+    # Для coding короткий ответ (один блок кода) нормален
+    assert run_gates(_state("coding", "код", "```python\nprint(1)\n```"))["gate"] == "parseable_code"
+
+
+def test_architecture_gate_never_asks_for_tool_round():
+    assert run_gates(_state("architecture", "Спроектируй MAS", "Короткий текст без разделов")) is None
+    full = "Компоненты и роли. State. Маршрутизация. Инструменты. Память. Риски и улучшения."
+    assert run_gates(_state("architecture", "Спроектируй MAS", full))["need_more"] is False
+
+
+def test_coding_gate():
+    assert run_gates(_state("coding", "код", "Без кода"))["need_more"] is True
+    assert run_gates(_state("coding", "код", "```python\nprint(1)\n```"))["need_more"] is False
+
+
+def test_daily_date_gate_checks_days_until():
+    query = "Сколько дней до 2030-01-01?"
+    assert run_gates(_state("daily", query, "Много"))["need_more"] is True
+    ctx = [{"tool": "days_until", "tool_message": "1000"}]
+    assert run_gates(_state("daily", query, "1000 дней", ctx))["need_more"] is False
+
+
+def test_daily_gate_sees_days_until_with_same_text_as_earlier_tool():
+    from src.utils import add_tool_context
+
+    s = _state("daily", "Сколько дней до 2030-01-01?", "1000 дней")
+    add_tool_context(s, "1000", "calc")
+    add_tool_context(s, "1000", "days_until")
+    add_tool_context(s, "1000", "days_until")
+    assert [e["tool"] for e in s["tool_context"]] == ["calc", "days_until"]
+    assert run_gates(s)["need_more"] is False
+
+
+def test_gate_checks_are_traced_not_counted_as_tools():
+    s = _state("coding", "код", "```python\nprint(1)\n```")
+    run_gates(s)
+    assert s["tool_calls"] == []
+    assert [e["event"] for e in s["trace"]] == ["review_gate"]
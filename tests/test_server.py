@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from src.server import MASService, outer_node
+
+QUERIES = {
+    "conceptual": "Объясни паттерн supervisor",
+    "architecture": "Спроектируй архитектуру мультиагентной системы",
+    "coding": "Напиши код на python для вывода чисел",
+    "daily": "Как приготовить штрудель?",
+    "literature": "Дай обзор литературы по LLM-агентам",
+}
+
+
+@pytest.fixture(scope="module")
+def service():
+    return MASService(max_rounds=1, use_cache=False)
+
+
+@pytest.mark.parametrize("intent", list(QUERIES))
+def test_tokens_stream_for_every_intent(service, intent):
+    events = list(service.run_turn(QUERIES[intent], thread_id=f"tokens-{intent}"))
+    final = events[-1][1]
+    assert events[-1][0] == "final"
+    assert final["intent"] == intent
+
+    tokens = [d for e, d in events if e == "token"]
+    assert tokens
+    assert {d["node"] for d in tokens} == {f"{intent}_agent"}
+
+
+def test_outer_node_from_namespace():
+    assert outer_node({"langgraph_node": "agent",
+                       "langgraph_checkpoint_ns": "coding_agent:1|agent:2"}) == "coding_agent"
+    assert outer_node({"langgraph_node": "planner", "langgraph_checkpoint_ns": "planner:1"}) == "planner"
+
+
+def test_session_history_survives_turns_but_checkpoints_do_not(service):
+    list(service.run_turn("Как приготовить штрудель?", thread_id="history"))
+    list(service.run_turn("А сколько по времени?", thread_id="history"))
+
+    fields = service._session("history")["fields"]
+    assert [h["role"] for h in fields["history"]] == ["user", "assistant", "user", "assistant"]
+    assert not service.app.get_state({"configurable": {"thread_id": "history"}}).values
+
+
+def test_keep_checkpoints_leaves_turn_checkpoints():
+    svc = MASService(max_rounds=1, use_cache=False, keep_checkpoints=True)
+    list(svc.run_turn("Как приготовить штрудель?", thread_id="kept"))
+    assert svc.app.get_state({"configurable": {"thread_id": "kept"}}).values["final_answer"]
+
+
+def test_sessions_are_evicted_by_size_and_ttl():
+    svc = MASService(max_rounds=1, use_cache=False, max_sessions=2, session_ttl=3600)
+    for i in range(4):
+        list(svc.run_turn("Как приготовить штрудель?", thread_id=f"s{i}"))
+    assert svc.session_count() == 2
+    assert svc.metrics.snapshot()["sessions_evicted"] == 2
+
+    svc.session_ttl = 0.05
+    time.sleep(0.1)
+    svc._session("fresh")
+    assert svc.session_count() == 1
+
+
+def test_evicted_session_drops_pending_summary():
+    from concurrent.futures import Future
+    from src import summary
+
+    svc = MASService(max_rounds=1, use_cache=False, max_sessions=1)
+    svc._session("old")
+    summary._PENDING["old"] = Future()
+    svc._session("new")
+    assert "old" not in summary._PENDING
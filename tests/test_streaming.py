@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from src.fake_llm import ScriptedChatModel
+from src.nodes import REVIEWER_PARSER
+from src.retry import StreamedDecision, decision_scope, defer_decision, pop_decision
+from src.utils import IncrementalJSONParser
+
+PAYLOAD = {
+    "need_more": True,
+    "focus": "добрать \"цитаты\", {скобки} и [списки]",
+    "focus_items": ["a", "b"],
+    "nested": {"x": [1, {"y": None}]},
+    "score": -1.5e3,
+    "ok": False,
+}
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_incremental_parser_on_split_chunks(size):
+    text = "```json\n" + json.dumps(PAYLOAD, ensure_ascii=False) + "\n```"
+    parser = IncrementalJSONParser()
+    order = []
+    for i in range(0, len(text), size):
+        order.extend(parser.feed(text[i:i + size]))
+    assert parser.fields == PAYLOAD
+    assert order == list(PAYLOAD)
+    assert parser.done
+
+
+def test_incremental_parser_reports_field_before_the_rest_arrives():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"need_more": true, "focus": "до') == {"need_more": True}
+    assert parser.fields == {"need_more": True}
+    assert parser.feed('бор"') == {"focus": "добор"}
+    assert not parser.done
+
+
+def test_streamed_decision_fields_and_result():
+    answer = {"need_more": True, "focus": "x", "focus_items": ["x"], "improved_answer": ""}
+    decision = StreamedDecision(
+        make_llm=lambda t: ScriptedChatModel(script=[answer]),
+        messages=[SystemMessage(content="reviewer"), HumanMessage(content="QUERY: q")],
+        parser=REVIEWER_PARSER,
+    )
+    assert decision.wait_field("need_more") is True
+    assert decision.result().focus_items == ["x"]
+    assert decision.responses
+
+
+def test_decision_scope_drops_unclaimed_decisions():
+    with pytest.raises(RuntimeError):
+        with decision_scope("t-scope"):
+            defer_decision("t-scope", "reviewer", object())
+            raise RuntimeError("граф упал посреди хода")
+    assert pop_decision("t-scope", "reviewer") is None
+
+    defer_decision("t-scope", "router", object())
+    with decision_scope("t-scope"):
+        assert pop_decision("t-scope", "router") is None
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import uuid
+
+from langchain_core.messages import AIMessage
+
+from src import summary
+from src.config import HISTORY_KEEP_RAW, HISTORY_SUMMARY_TRIGGER_TOKENS
+from src.summary import discard_summary, fold_history, refresh_history_summary
+
+
+def _state(n_turns: int, words: int = 20):
+    history = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"реплика {i} " + "слово " * words}
+               for i in range(n_turns)]
+    return {"thread_id": f"t-{uuid.uuid4().hex}", "history": history, "history_summary": ""}
+
+
+def _summary_prompts(llm_responder):
+    prompts = []
+
+    def responder(messages, tools):
+        text = messages[-1].content
+        prompts.append(text)
+        return AIMessage(content=f"резюме #{len(prompts)}")
+
+    llm_responder(responder)
+    return prompts
+
+
+def test_short_history_is_not_folded(llm_responder):
+    prompts = _summary_prompts(llm_responder)
+    state = _state(HISTORY_KEEP_RAW + 2, words=1)
+    before = list(state["history"])
+    fold_history(state)
+    refresh_history_summary(state, wait=True)
+    assert state["history"] == before
+    assert state["history_summary"] == "" and prompts == []
+
+
+def test_long_history_keeps_last_turns_and_summarizes_the_rest(llm_responder):
+    prompts = _summary_prompts(llm_responder)
+    state = _state(12, words=HISTORY_SUMMARY_TRIGGER_TOKENS // 8)
+    before = list(state["history"])
+    fold_history(state)
+
+    assert state["history"] == before[-HISTORY_KEEP_RAW:]
+    refresh_history_summary(state, wait=True)
+    assert state["history_summary"] == "резюме #1"
+    assert "реплика 0 " in prompts[0] and f"реплика {12 - HISTORY_KEEP_RAW} " not in prompts[0]
+
+
+def test_summaries_are_chained_per_session(llm_responder):
+    prompts = _summary_prompts(llm_responder)
+    state = _state(12, words=HISTORY_SUMMARY_TRIGGER_TOKENS // 8)
+    fold_history(state)
+    # Новые реплики до того, как первое резюме перенесено в state: второе свертывание ждет первое
+    state["history"] += _state(12, words=HISTORY_SUMMARY_TRIGGER_TOKENS // 8)["history"]
+    fold_history(state)
+    refresh_history_summary(state, wait=True)
+
+    assert len(state["history"]) == HISTORY_KEEP_RAW
+    assert state["history_summary"] == "резюме #2"
+    assert "резюме #1" in prompts[1]
+
+
+def test_discard_summary_forgets_pending_fold(llm_responder):
+    _summary_prompts(llm_responder)
+    state = _state(12, words=HISTORY_SUMMARY_TRIGGER_TOKENS // 8)
+    fold_history(state)
+    assert state["thread_id"] in summary._PENDING
+    discard_summary(state["thread_id"])
+    assert state["thread_id"] not in summary._PENDING
+    refresh_history_summary(state, wait=True)
+    assert state["history_summary"] == ""
+
+
+def test_llm_failure_falls_back_to_short_summary(llm_responder):
+    def responder(messages, tools):
+        raise RuntimeError("модель недоступна")
+
+    llm_responder(responder)
+    state = _state(12, words=HISTORY_SUMMARY_TRIGGER_TOKENS // 8)
+    fold_history(state)
+    refresh_history_summary(state, wait=True)
+    assert state["history_summary"].startswith("user: реплика 0")
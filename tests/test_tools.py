@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+from src.nodes import _log_tool_message
+from src.state import init_state
+from src.tools import calc, days_until, tool_cache_scope, tool_result_cached
+
+
+def test_repeated_calls_are_served_from_cache():
+    with tool_cache_scope() as cache:
+        assert calc.invoke({"expression": "2 + 2"}) == "4"
+        assert calc.invoke({"expression": "2+2"}) == "4"
+        days_until.invoke({"date_iso": "2030-01-01"})
+    assert cache.stats()["hits"] == {"calc": 1}
+    assert cache.stats()["misses"] == {"calc": 1, "days_until": 1}
+
+
+def test_tool_log_entries_are_marked_cached():
+    state = init_state("q", thread_id="tools")
+    with tool_cache_scope():
+        for expr in ("6*7", "6 * 7", "40+2"):
+            calc.invoke({"expression": expr})
+        for _ in range(3):
+            _log_tool_message(state, "42", "calc")
+        assert tool_result_cached("calc", "42") is None
+    assert [c["payload"]["cached"] for c in state["tool_calls"]] == [False, True, False]
+
+
+def test_no_cached_flag_outside_cache_scope():
+    state = init_state("q", thread_id="tools")
+    calc.invoke({"expression": "1+1"})
+    _log_tool_message(state, "2", "calc")
+    assert state["tool_calls"][0]["payload"] == {"content": "2"}